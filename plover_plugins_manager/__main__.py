@@ -1,5 +1,7 @@
 
+import argparse
 import itertools
+import json
 import os
 import subprocess
 import site
@@ -7,25 +9,39 @@ import sys
 
 from plover_plugins_manager import global_registry
 from plover_plugins_manager import local_registry
+from plover_plugins_manager import package_index
+from plover_plugins_manager import pip_worker
+from plover_plugins_manager.resolver import Resolver
+from plover_plugins_manager.search_index import SearchIndex
+from plover_plugins_manager.uninstall import uninstall_args
 from plover_plugins_manager.utils import running_under_virtualenv
+from plover_plugins_manager.version_index import VersionIndex
 
 
-def list_plugins(freeze=False):
+def list_plugins(freeze=False, snapshot=None, search=None):
     installed_plugins = local_registry.list_plugins()
     if freeze:
         available_plugins = {}
     else:
-        available_plugins = global_registry.list_plugins()
-    for name, installed, available in sorted(
+        available_plugins = global_registry.list_plugins(snapshot=snapshot)
+    names = sorted(set(itertools.chain(installed_plugins, available_plugins)))
+    if search is not None:
+        # Only list matching plugins, best matches first.
+        search_index = SearchIndex()
+        for name in names:
+            versions = available_plugins.get(name) or installed_plugins[name]
+            search_index.update(name, versions[-1])
+        names = search_index.search(search)
+    for name, installed, available in (
         (name,
          installed_plugins.get(name, []),
          available_plugins.get(name, []))
-        for name in set(itertools.chain(installed_plugins,
-                                        available_plugins))
+        for name in names
     ):
-        latest = available[-1] if available else None
+        latest = VersionIndex(available).latest_compatible()
         current = installed[-1] if installed else None
-        info = latest or current
+        # Note: fallback to the newest (incompatible) version.
+        info = latest or current or available[-1]
         if freeze:
             if current:
                 print('%s==%s' % (current.name, current.version))
@@ -37,41 +53,84 @@ def list_plugins(freeze=False):
                 print('  LATEST:    %s' % latest.version)
 
 
-def pip(args, stdin=None, stdout=None, stderr=None, **kwargs):
-    cmd = [sys.executable, '-m',
-           'plover_plugins_manager.pip_wrapper',
-           '--disable-pip-version-check']
-    env = dict(os.environ)
-    # Make sure user plugins are handled
-    # even if user site is not enabled.
-    if not running_under_virtualenv() and not site.ENABLE_USER_SITE:
-        pypath = env.get('PYTHONPATH')
-        if pypath is None:
-            pypath = []
-        else:
-            pypath = pypath.split(os.pathsep)
-        pypath.insert(0, site.USER_SITE)
-        env['PYTHONPATH'] = os.pathsep.join(pypath)
-    command = args.pop(0)
+def resolve(requirements):
+    plan = Resolver().resolve(requirements)
+    print(plan)
+    return 0 if plan.ok else 1
+
+
+def build_index(output):
+    # Always query PyPI directly when building the aggregated index.
+    releases = package_index.find_plover_plugins_releases(index_url='')
+    with open(output, 'wb') as fp:
+        package_index.dump_index(releases, fp)
+
+
+def capture_snapshot(output):
+    package_index.find_plover_plugins_releases(capture=output)
+
+
+def _pip_args(args, wheelhouse=False):
+    # Return the `pip_wrapper` arguments for a command.
+    pip_args = ['--disable-pip-version-check']
+    command, args = args[0], list(args[1:])
     if command == 'check':
-        cmd.append('check')
+        pip_args.append('check')
     elif command == 'install':
-        cmd.extend((
+        if wheelhouse:
+            # Download distributions in parallel to a
+            # local wheelhouse (see `wheelhouse.install_args`).
+            pip_args.insert(0, '--wheelhouse')
+        pip_args.extend((
             'install',
             '--upgrade-strategy=only-if-needed',
         ))
         if not running_under_virtualenv():
-            cmd.append('--user')
+            pip_args.append('--user')
     elif command == 'uninstall':
-        cmd.append('uninstall')
+        pip_args.append('uninstall')
     elif command == 'list':
-        cmd.extend((
+        pip_args.extend((
             'list',
             '--format=columns',
         ))
+    elif command == 'transaction':
+        # The commands to run as a batch (see `transaction.run_transaction`),
+        # e.g. `['transaction', ['uninstall', '-y', 'foo'], ['install', 'bar']]`.
+        transaction = {
+            'steps': [_pip_args(step, wheelhouse) for step in args],
+            'install': _pip_args(['install', '--no-deps', '--no-index']),
+            'uninstall': _pip_args(['uninstall', '-y']),
+        }
+        return ['--transaction', json.dumps(transaction)]
     else:
         raise ValueError('invalid command: %s' % command)
-    cmd.extend(args)
+    return pip_args + args
+
+
+def pip(args, stdin=None, stdout=None, stderr=None, wheelhouse=False,
+        worker=None, **kwargs):
+    env = dict(os.environ)
+    # Make sure user plugins are handled
+    # even if user site is not enabled.
+    if not running_under_virtualenv() and not site.ENABLE_USER_SITE:
+        pypath = env.get('PYTHONPATH')
+        if pypath is None:
+            pypath = []
+        else:
+            pypath = pypath.split(os.pathsep)
+        pypath.insert(0, site.USER_SITE)
+        env['PYTHONPATH'] = os.pathsep.join(pypath)
+    pip_args = _pip_args(args, wheelhouse)
+    if worker is None:
+        worker = os.environ.get('PLOVER_PLUGINS_PIP_WORKER') == '1'
+    if worker and stdout == subprocess.PIPE and stderr == subprocess.STDOUT:
+        # Use the long-lived worker (see `pip_worker`),
+        # unless it's already busy with another command.
+        proc = pip_worker.popen(pip_args, env)
+        if proc is not None:
+            return proc
+    cmd = [sys.executable, '-m', 'plover_plugins_manager.pip_wrapper'] + pip_args
     return subprocess.Popen(cmd, env=env, stdin=stdin,
                             stdout=stdout, stderr=stderr,
                             **kwargs)
@@ -81,14 +140,39 @@ def main(args=None):
     if args is None:
         args = sys.argv[1:]
     if args[0] == 'list_plugins':
-        assert len(args) <= 2
-        if len(args) > 1:
-            assert args[1] == '--freeze'
-            freeze = True
-        else:
-            freeze = False
-        sys.exit(list_plugins(freeze=freeze))
-    proc = pip(args)
+        parser = argparse.ArgumentParser(prog='plover_plugins list_plugins')
+        parser.add_argument('--freeze', action='store_true',
+                            help='only list installed plugins, '
+                            'in requirements format')
+        parser.add_argument('--snapshot', metavar='PATH',
+                            help='list available plugins from a snapshot '
+                            '(see the `snapshot` command), '
+                            'instead of querying PyPI')
+        parser.add_argument('--search', metavar='TERM',
+                            help='only list plugins matching TERM (on name, '
+                            'summary, keywords, or author)')
+        options = parser.parse_args(args[1:])
+        sys.exit(list_plugins(freeze=options.freeze,
+                              snapshot=options.snapshot,
+                              search=options.search))
+    if args[0] == 'resolve':
+        parser = argparse.ArgumentParser(prog='plover_plugins resolve')
+        parser.add_argument('requirements', metavar='REQUIREMENT', nargs='+',
+                            help='requirement to check (e.g. plover-foo==1.0)')
+        options = parser.parse_args(args[1:])
+        sys.exit(resolve(options.requirements))
+    if args[0] == 'build_index':
+        assert len(args) == 2
+        sys.exit(build_index(args[1]))
+    if args[0] == 'snapshot':
+        assert len(args) == 2
+        sys.exit(capture_snapshot(args[1]))
+    if args[0] == 'uninstall':
+        # Natively, without starting pip if possible.
+        args = uninstall_args(args)
+        if args is None:
+            sys.exit(0)
+    proc = pip(args, wheelhouse=True, worker=False)
     sys.exit(proc.wait())
 
 
@@ -1,19 +1,79 @@
 from collections import defaultdict
+from functools import partial
 
 from pkg_resources import safe_name
 
-from plover_plugins_manager.package_index import find_plover_plugins_releases
+from plover_plugins_manager.package_index import (
+    fetch_projects,
+    fetch_releases,
+    find_plover_plugins_releases,
+    iter_plover_plugins_releases,
+    load_description,
+)
 from plover_plugins_manager.plugin_metadata import PluginMetadata
 
 
-def list_plugins():
+def _group_by_name(releases, load_description=None):
     plugins = defaultdict(list)
-    for release in find_plover_plugins_releases():
+    for release in releases:
         release_info = release['info']
-        plugin_metadata = PluginMetadata.from_dict(release_info)
-        plugins[safe_name(plugin_metadata.name)].append(plugin_metadata)
+        if load_description is None:
+            plugin_metadata = PluginMetadata.from_dict(release_info)
+        else:
+            # Don't keep the description in memory, load it on demand.
+            plugin_metadata = PluginMetadata.lazy(
+                release_info, partial(load_description, release_info['name']))
+        versions = plugins[safe_name(plugin_metadata.name)]
+        versions.append(plugin_metadata)
+        # History mode: other available versions. Only the version is
+        # known, the rest of the metadata can be fetched on demand (see
+        # `package_index.fetch_releases`).
+        for version in release.get('versions', ()):
+            # Note: their requirements are unknown.
+            other_metadata = plugin_metadata._replace(
+                version=version, requires_dist=None, requires_python='')
+            # Ignore newer pre-releases.
+            if other_metadata < plugin_metadata:
+                versions.append(other_metadata)
     plugins = {
         name: list(sorted(versions))
         for name, versions in plugins.items()
     }
     return plugins
+
+
+def _description_loader(kwargs):
+    return partial(load_description, **{
+        key: kwargs.get(key)
+        for key in ('pypi_url', 'registry_url', 'snapshot')
+    })
+
+
+def list_plugins(**kwargs):
+    return _group_by_name(find_plover_plugins_releases(**kwargs),
+                          _description_loader(kwargs))
+
+
+def iter_plugins(**kwargs):
+    for releases in iter_plover_plugins_releases(**kwargs):
+        yield _group_by_name(releases, _description_loader(kwargs))
+
+
+def fetch_metadata(versions):
+    return {
+        key: None if release is None else PluginMetadata.from_dict(release['info'])
+        for key, release in fetch_releases(versions).items()
+    }
+
+
+def fetch_versions(names):
+    '''
+    Fetch the available versions of any project (not only plugins),
+    return a `{name: [metadata]}` dictionary (see `_group_by_name`,
+    only the newest version's metadata is complete).
+    '''
+    releases = fetch_projects(names)
+    return {
+        name: _group_by_name([release]).popitem()[1] if release else []
+        for name, release in releases.items()
+    }
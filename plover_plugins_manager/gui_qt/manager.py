@@ -1,19 +1,23 @@
 
-from threading import Thread
+from functools import partial
 import atexit
 import html
 import os
 import sys
+import time
 
 from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtGui import QPalette
 from PyQt5.QtWidgets import QDialog, QMessageBox, QTableWidgetItem, QInputDialog
 
+from plover import log
 from plover.gui_qt.tool import Tool
 
+from plover_plugins_manager import global_registry
 from plover_plugins_manager.gui_qt.info_browser import InfoBrowser
 from plover_plugins_manager.gui_qt.manager_ui import Ui_PluginsManager
 from plover_plugins_manager.gui_qt.run_dialog import RunDialog
-from plover_plugins_manager.registry import Registry
+from plover_plugins_manager.registry import Registry, RegistryDiff
 from plover_plugins_manager.utils import description_to_html
 from plover_plugins_manager.__main__ import pip
 
@@ -28,6 +32,7 @@ class PluginsManager(Tool, Ui_PluginsManager):
     # accross different executions of the dialog when
     # the user does not restart.
     _packages = None
+    _packages_changed = pyqtSignal(object)
     _packages_updated = pyqtSignal()
 
     def __init__(self, engine):
@@ -39,9 +44,26 @@ class PluginsManager(Tool, Ui_PluginsManager):
         self.info = InfoBrowser()
         self.info_frame.layout().addWidget(self.info)
         self.table.sortByColumn(1, Qt.AscendingOrder)
+        self._name_items = {}
+        # Names of the rows showing stale data.
+        self._stale_names = set()
+        self._refreshing = False
+        self._refresh_task = None
+        self._packages_changed.connect(self._apply_diff)
         self._packages_updated.connect(self._on_packages_updated)
+        # Refresh listener (see `RefreshTask.add_listener`).
+        self._refresh_listener = (self._packages_changed.emit,
+                                  self._packages_updated.emit)
+        self.finished.connect(self._on_finished)
+        start = time.perf_counter()
         if self._packages is None:
-            PluginsManager._packages = Registry()
+            # Open instantly using the state saved by the last refresh
+            # (revalidated in the background), if available.
+            PluginsManager._packages = Registry.load() or Registry()
+        self._update_table()
+        log.debug('plugins manager: table ready in %.3fs%s',
+                  time.perf_counter() - start,
+                  ' (stale)' if self._packages.stale else '')
         self._on_packages_updated()
         self.on_refresh()
 
@@ -52,23 +74,93 @@ class PluginsManager(Tool, Ui_PluginsManager):
         return False
 
     def _on_packages_updated(self):
+        self._refreshing = False
+        self._refresh_task = None
+        self._update_stale_rows()
         self.restart_button.setEnabled(self._need_restart())
         self.progress.hide()
-        self.refresh_button.show()
-        self._update_table()
-        self.setEnabled(True)
+        self.refresh_button.setText('Refresh')
+        self.table.resizeColumnsToContents()
+        self._update_buttons()
+
+    def _set_row(self, row, state):
+        if state.stale:
+            self._stale_names.add(state.name)
+            tooltip = 'Not checked since %s' % time.strftime(
+                '%Y-%m-%d %H:%M', time.localtime(state.checked or 0))
+        else:
+            self._stale_names.discard(state.name)
+            tooltip = None
+        for column, attr in enumerate('status name version summary'.split()):
+            item = QTableWidgetItem(getattr(state, attr, "N/A"))
+            item.setFlags(item.flags() & ~Qt.ItemIsEditable)
+            if tooltip is not None:
+                item.setForeground(self.palette().brush(QPalette.Disabled, QPalette.Text))
+                item.setToolTip(tooltip)
+            self.table.setItem(row, column, item)
+            if column == 1:
+                self._name_items[state.name] = item
+
+    def _update_stale_rows(self):
+        # Only rows whose data changed are updated by `_apply_diff`.
+        packages = self._packages.snapshot()
+        revalidated = [
+            name for name in self._stale_names
+            if name in packages and not packages[name].stale
+        ]
+        if not revalidated:
+            return
+        self.table.setSortingEnabled(False)
+        for name in revalidated:
+            self._set_row(self._name_items[name].row(), packages[name])
+        self.table.setSortingEnabled(True)
 
     def _update_table(self):
         self.table.setCurrentItem(None)
         self.table.setSortingEnabled(False)
-        self.table.setRowCount(len(self._packages))
-        for row, state in enumerate(self._packages):
-            for column, attr in enumerate('status name version summary'.split()):
-                item = QTableWidgetItem(getattr(state, attr, "N/A"))
-                item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-                self.table.setItem(row, column, item)
+        self._name_items.clear()
+        self._stale_names.clear()
+        # Note: the registry may be updated concurrently
+        # (by a refresh), so use a consistent snapshot.
+        packages = self._packages.snapshot()
+        self.table.setRowCount(len(packages))
+        for row, state in enumerate(packages.values()):
+            self._set_row(row, state)
         self.table.resizeColumnsToContents()
         self.table.setSortingEnabled(True)
+        self._apply_filter()
+
+    def _apply_filter(self):
+        query = self.search.text().strip()
+        # Note: the table has its own order, no need for ranking.
+        matches = self._packages.matches(query) if query else None
+        for name, item in self._name_items.items():
+            self.table.setRowHidden(item.row(), matches is not None and name not in matches)
+
+    def _apply_diff(self, diff):
+        # Note: the diff may be applied after later changes to the
+        # registry (when emitted by a refresh), so rows are always
+        # updated from the current state.
+        packages = self._packages.snapshot()
+        self.table.setSortingEnabled(False)
+        for name in diff.removed + diff.added + diff.changed:
+            state = packages.get(name)
+            item = self._name_items.get(name)
+            if state is None:
+                self._name_items.pop(name, None)
+                self._stale_names.discard(name)
+                if item is not None:
+                    self.table.removeRow(item.row())
+                continue
+            if item is None:
+                row = self.table.rowCount()
+                self.table.insertRow(row)
+            else:
+                row = item.row()
+            self._set_row(row, state)
+        self.table.setSortingEnabled(True)
+        self._apply_filter()
+        self._update_buttons()
 
     def _get_state(self, row):
         name = self.table.item(row, 1).data(Qt.DisplayRole)
@@ -83,6 +175,9 @@ class PluginsManager(Tool, Ui_PluginsManager):
             state = self._get_state(item.row())
             if state.status in ('installed', 'updated'):
                 can_uninstall.append(state.name)
+                if len(state.available) > 1:
+                    # Allow switching to another version.
+                    can_install.append(state.name)
             elif state.status in ('outdated',):
                 can_uninstall.append(state.name)
                 can_install.append(state.name)
@@ -91,16 +186,25 @@ class PluginsManager(Tool, Ui_PluginsManager):
         return can_install, can_uninstall
 
     @staticmethod
-    def _run(args):
-        dialog = RunDialog(args, popen=pip)
+    def _run(args, **kwargs):
+        dialog = RunDialog(args, popen=partial(pip, **kwargs))
         code = dialog.exec_()
         # dialog.destroy()
         return code
 
-    def on_selection_changed(self):
-        can_install, can_uninstall = self._get_selection()
+    def _update_buttons(self):
+        if self._refreshing:
+            can_install, can_uninstall = (), ()
+        else:
+            can_install, can_uninstall = self._get_selection()
         self.uninstall_button.setEnabled(bool(can_uninstall))
         self.install_button.setEnabled(bool(can_install))
+
+    def on_search(self, text):
+        self._apply_filter()
+
+    def on_selection_changed(self):
+        self._update_buttons()
         self._clear_info()
         current_item = self.table.currentItem()
         if current_item is None:
@@ -140,20 +244,33 @@ class PluginsManager(Tool, Ui_PluginsManager):
             args = [sys.executable, '-m', __spec__.name]
             os.execv(args[0], args)
 
-    def _update_packages(self):
-        self._packages.update()
-        self._packages_updated.emit()
-
     def _clear_info(self):
         self.info.setHtml('')
 
     def on_refresh(self):
-        Thread(target=self._update_packages).start()
-        self._clear_info()
-        self.setEnabled(False)
-        self.refresh_button.hide()
+        if self._refresh_task is not None:
+            # In progress: cancel it.
+            self._refresh_task.cancel()
+            return
+        # Keep the table usable while the refresh is in progress,
+        # rows are inserted / updated as results come in.
+        self._refreshing = True
+        self._update_buttons()
+        joined = self._packages.refreshing
+        self._refresh_task = self._packages.refresh(*self._refresh_listener)
+        if joined:
+            # Coalesced with a refresh started by another instance:
+            # resynchronize, as previous changes were not received.
+            self._update_table()
+        self.refresh_button.setText('Cancel')
         self.progress.show()
 
+    def _on_finished(self, result):
+        if self._refresh_task is not None:
+            # Stop listening, the refresh is cancelled
+            # if no other instance is waiting on it.
+            self._refresh_task.remove_listener(*self._refresh_listener)
+
     def on_install_git(self):
         url, ok = QInputDialog.getText(
             self, "Install from Git repo", 
@@ -174,9 +291,11 @@ class PluginsManager(Tool, Ui_PluginsManager):
             defaultButton=QMessageBox.No
         ) != QMessageBox.Yes:
             return
+        # Note: builds are cached by commit (see `Wheelhouse.build`).
         code = self._run(
             ['install'] +
-            ['git+' + url]
+            ['git+' + url],
+            wheelhouse=True,
         )
         if code == QDialog.Accepted:
             self._update_table()
@@ -184,37 +303,113 @@ class PluginsManager(Tool, Ui_PluginsManager):
            
     def on_install(self):
         packages = self._get_selection()[0]
+        to_install = {}
+        for name in packages:
+            state = self._packages[name]
+            latest, current = state.latest, state.current
+            # Skip packages without a compatible version,
+            # or already up to date (see `_get_selection`).
+            if latest is not None and (current is None or
+                                       latest.version != current.version):
+                to_install[name] = latest
+        if len(packages) == 1:
+            state = self._packages[packages[0]]
+            if len(state.available) > 1:
+                available = list(reversed(state.available))
+                versions = [
+                    m.version if state.is_compatible(m)
+                    else '%s (incompatible)' % m.version
+                    for m in available
+                ]
+                default = available.index(state.latest) if state.latest else 0
+                version, ok = QInputDialog.getItem(
+                    self, 'Install ' + state.name, 'Version:',
+                    versions, default, False)
+                if not ok:
+                    return
+                to_install[state.name] = available[versions.index(version)]
+        if not to_install:
+            return
+        packages = sorted(to_install)
+        requirements = [metadata.requirement
+                        for metadata in to_install.values()]
+        # Check for conflicts before running pip.
+        try:
+            plan = self._packages.resolve(requirements)
+        except Exception:
+            log.error('failed to resolve dependencies', exc_info=True)
+            plan = None
+        if plan is not None and not plan.ok and QMessageBox.warning(
+            self, 'Install ' + ', '.join(packages),
+            'Installing would result in conflicts:<ul>%s</ul>'
+            'Are you sure you want to proceed?' % ''.join(
+                '<li>%s</li>' % html.escape(conflict)
+                for conflict in plan.conflicts
+            ),
+            buttons=QMessageBox.Yes | QMessageBox.No,
+            defaultButton=QMessageBox.No
+        ) != QMessageBox.Yes:
+            return
+        dependencies = '' if plan is None else ''.join(
+            '<li>%s</li>' % html.escape(requirement)
+            for requirement in plan.requirements
+            if requirement not in requirements
+        )
+        if dependencies:
+            dependencies = '<p>The following dependencies will also be ' \
+                'installed:<ul>%s</ul></p>' % dependencies
         if QMessageBox.warning(
             self, 'Install ' + ', '.join(packages), 
             'Installing plugins is a <b>security risk</b>. '
             'A plugin can contain virus/malware. '
             'Only install it if you got it from a trusted source.'
             ' Are you sure you want to proceed?'
-            ,
+            + dependencies,
             buttons=QMessageBox.Yes | QMessageBox.No,
             defaultButton=QMessageBox.No
         ) != QMessageBox.Yes:
             return
-        code = self._run(
-            ['install'] +
-            [self._packages[name].latest.requirement
-             for name in packages]
-        )
-        if code == QDialog.Accepted:
-            for name in packages:
+        # Note: run as a transaction, so a failure does
+        # not leave a partially upgraded environment.
+        code = self._run(['transaction', ['install'] + requirements],
+                         wheelhouse=True)
+        if code != QDialog.Accepted:
+            # Reflect the outcome (changes are rolled back on failure).
+            self._apply_diff(self._packages.rescan_installed())
+        else:
+            older_versions = [
+                (metadata.name, metadata.version)
+                for name, metadata in to_install.items()
+                if metadata is not self._packages[name].latest
+            ]
+            fetched = {}
+            if older_versions:
+                # Only the version is known for older releases,
+                # fetch the rest of their metadata.
+                try:
+                    fetched = global_registry.fetch_metadata(older_versions)
+                except Exception:
+                    log.error('failed to fetch metadata', exc_info=True)
+                    fetched = {}
+            diff = RegistryDiff()
+            for name, metadata in to_install.items():
                 state = self._packages[name]
-                state.current = state.latest
-            self._update_table()
+                if metadata is not state.latest:
+                    metadata = fetched.get((metadata.name, metadata.version)) or metadata
+                diff.update(self._packages.set_installed(name, metadata))
+            self._apply_diff(diff)
             self.restart_button.setEnabled(True)
 
     def on_uninstall(self):
         packages = self._get_selection()[1]
-        code = self._run(['uninstall', '-y'] + packages)
-        if code == QDialog.Accepted:
+        code = self._run(['transaction', ['uninstall', '-y'] + packages])
+        if code != QDialog.Accepted:
+            self._apply_diff(self._packages.rescan_installed())
+        else:
+            diff = RegistryDiff()
             for name in packages:
-                state = self._packages[name]
-                state.current = None
-            self._update_table()
+                diff.update(self._packages.set_installed(name, None))
+            self._apply_diff(diff)
             self.restart_button.setEnabled(True)
 
 
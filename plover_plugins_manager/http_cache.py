@@ -0,0 +1,219 @@
+from hashlib import sha256
+import json
+import os
+import tempfile
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+
+# Only cache those: redirections are cached too so
+# following them does not need a network round-trip.
+CACHEABLE_STATUS_CODES = (200, 301, 302, 307, 308)
+
+_BODY_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding'}
+
+
+class DiskCache:
+    """
+    Persistent HTTP responses cache.
+
+    Each entry is stored in its own file (a JSON header line followed by
+    the raw body), always written to a temporary file first and then
+    atomically renamed into place: so several processes can safely share
+    the same cache directory. The modification time of an entry is bumped
+    on each use, and the least recently used entries are evicted when the
+    total size goes over `max_size`.
+    """
+
+    def __init__(self, directory, max_size=100 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = None
+        self.evict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, sha256(key.encode()).hexdigest())
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fp:
+                header = json.loads(fp.readline().decode())
+                body = fp.read()
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        if header.get('key') != key:
+            return None
+        return header, body
+
+    def set(self, key, header, body):
+        header = dict(header, key=key)
+        data = json.dumps(header).encode() + b'\n' + body
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self._size += len(data)
+            need_eviction = self._size > self.max_size
+        if need_eviction:
+            self.evict()
+
+    def delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        for entry in self._entries():
+            try:
+                os.unlink(entry.path)
+            except OSError:
+                pass
+        with self._lock:
+            self._size = 0
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.startswith('.tmp'):
+                    # Stale temporary file from a crashed process?
+                    try:
+                        if entry.stat().st_mtime < time.time() - 3600:
+                            os.unlink(entry.path)
+                    except OSError:
+                        pass
+                    continue
+                entries.append(entry)
+        return entries
+
+    def evict(self):
+        entries = []
+        total_size = 0
+        for entry in self._entries():
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+            total_size += st.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                # Already evicted by another process?
+                pass
+            total_size -= size
+        with self._lock:
+            self._size = total_size
+
+
+class CachingAdapter(HTTPAdapter):
+    """
+    Transport adapter caching GET responses to a `DiskCache`.
+
+    Fresh entries (stored less than `expire_after` seconds ago) are served
+    without any network access. Once stale, a conditional request is made
+    (using the stored `ETag` / `Last-Modified` validators), so an unchanged
+    document only costs a `304 Not Modified` response.
+    """
+
+    def __init__(self, cache, expire_after=600, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = cache
+        self.expire_after = expire_after
+
+    def send(self, request, stream=False, **kwargs):
+        if request.method != 'GET':
+            return super().send(request, stream=stream, **kwargs)
+        key = request.url
+        cached = self.cache.get(key)
+        if cached is not None:
+            header, body = cached
+            if time.time() - header['stored'] < self.expire_after:
+                return self._build_cached_response(request, header, body)
+            etag = header['headers'].get('ETag')
+            if etag is not None:
+                request.headers['If-None-Match'] = etag
+            last_modified = header['headers'].get('Last-Modified')
+            if last_modified is not None:
+                request.headers['If-Modified-Since'] = last_modified
+        resp = super().send(request, stream=stream, **kwargs)
+        resp.from_cache = False
+        resp.revalidated = False
+        if resp.status_code == 304 and cached is not None:
+            header, body = cached
+            # Consume the (empty) body so the connection can be reused.
+            resp.content
+            resp.close()
+            # Refresh the stored headers (some, like
+            # `X-PyPI-Last-Serial`, may have changed).
+            header['headers'].update(
+                (name, value)
+                for name, value in resp.headers.items()
+                if name.lower() not in _BODY_HEADERS
+            )
+            header['stored'] = time.time()
+            self.cache.set(key, header, body)
+            resp = self._build_cached_response(request, header, body)
+            resp.revalidated = True
+            return resp
+        if resp.status_code not in CACHEABLE_STATUS_CODES or \
+           'no-store' in resp.headers.get('Cache-Control', ''):
+            return resp
+        if stream:
+            # Don't consume the body behind the caller's back.
+            return resp
+        # The body is stored decoded.
+        headers = {
+            name: value
+            for name, value in resp.headers.items()
+            if name.lower() not in _BODY_HEADERS
+        }
+        self.cache.set(key, {
+            'status': resp.status_code,
+            'reason': resp.reason,
+            'url': resp.url,
+            'headers': headers,
+            'stored': time.time(),
+        }, resp.content)
+        return resp
+
+    @staticmethod
+    def _build_cached_response(request, header, body):
+        resp = Response()
+        resp.status_code = header['status']
+        resp.reason = header['reason']
+        resp.url = header['url']
+        resp.headers = CaseInsensitiveDict(header['headers'])
+        resp.encoding = get_encoding_from_headers(resp.headers)
+        resp.request = request
+        resp.connection = None
+        resp._content = body
+        resp._content_consumed = True
+        resp.from_cache = True
+        resp.revalidated = False
+        return resp
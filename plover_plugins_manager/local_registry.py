@@ -1,52 +1,297 @@
 
-from collections import defaultdict
+from functools import partial
+from hashlib import sha1
+import csv
+import io
+import os
+import re
 import site
+import sys
+import time
+import zipfile
 
 from pkginfo.distribution import Distribution as Metadata
-from pkg_resources import DistInfoDistribution, WorkingSet, find_distributions
 
 from plover_plugins_manager.plugin_metadata import PluginMetadata
-from plover_plugins_manager.utils import running_under_virtualenv
+from plover_plugins_manager.utils import (
+    cache_path,
+    load_json,
+    running_under_virtualenv,
+    save_json,
+)
 
 from plover import log
 
 
-def list_plugins():
-    working_set = WorkingSet()
-    # Make sure user site packages are added
-    # to the set so user plugins are listed.
+def _dist_key(filename):
+    # Same as `pkg_resources.safe_name(project_name).lower()`.
+    project_name = os.path.splitext(filename)[0].split('-')[0]
+    return re.sub('[^A-Za-z0-9.]+', '-', project_name).lower()
+
+
+def _read_file(directory, name):
+    try:
+        with open(os.path.join(directory, name), encoding='utf-8') as fp:
+            return fp.read()
+    except (OSError, ValueError):
+        return None
+
+
+def _read_zip(path, directory, name):
+    try:
+        with zipfile.ZipFile(path) as zf:
+            return zf.read(directory + '/' + name).decode('utf-8')
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return None
+
+
+def _find_egg(path):
+    if os.path.isdir(path):
+        return partial(_read_file, os.path.join(path, 'EGG-INFO'))
+    if zipfile.is_zipfile(path):
+        return partial(_read_zip, path, 'EGG-INFO')
+    return None
+
+
+def _metadata_reader(location):
+    lower_location = location.lower()
+    if lower_location.endswith('.egg'):
+        return 'PKG-INFO', _find_egg(location)
+    if lower_location.endswith('.dist-info'):
+        return 'METADATA', partial(_read_file, location)
+    return 'PKG-INFO', partial(_read_file, location)
+
+
+def _find_distributions(path_entry):
+    '''
+    Find the distributions available in a `sys.path` entry.
+
+    Yield `(key, location)` tuples, with `location` the path to the
+    distribution's metadata directory (or egg), see `_metadata_reader`.
+
+    Note: like `pkg_resources.WorkingSet`, eggs are only
+    found if they are themselves a `sys.path` entry.
+    '''
+    path_entry = path_entry or os.curdir
+    if path_entry.lower().endswith('.egg'):
+        if _find_egg(path_entry) is not None:
+            yield _dist_key(os.path.basename(path_entry)), path_entry
+        return
+    try:
+        names = sorted(os.listdir(path_entry))
+    except OSError:
+        return
+    for name in names:
+        if name.lower().endswith(('.dist-info', '.egg-info')):
+            path = os.path.join(path_entry, name)
+            if os.path.isdir(path):
+                yield _dist_key(name), path
+
+
+def _has_plover_entrypoints(entry_points):
+    return any(line.strip().startswith('[plover.')
+               for line in entry_points.splitlines())
+
+
+def _path_entries():
+    path_entries = [(path_entry, False) for path_entry in sys.path]
+    # Make sure user site packages are scanned
+    # too so user plugins are listed.
     user_site_packages = site.USER_SITE
     if not running_under_virtualenv() and \
-       user_site_packages not in working_set.entries:
-        working_set.entry_keys.setdefault(user_site_packages, [])
-        working_set.entries.append(user_site_packages)
-        for dist in find_distributions(user_site_packages, only=True):
-            working_set.add(dist, user_site_packages, replace=True)
-    plugins = defaultdict(list)
-    for dist in working_set.by_key.values():
-        if dist.key == 'plover':
-            continue
-        for entrypoint_type in dist.get_entry_map().keys():
-            if entrypoint_type.startswith('plover.'):
-                break
-        else:
+       user_site_packages not in sys.path:
+        path_entries.append((user_site_packages, True))
+    return path_entries
+
+
+def _parse_metadata(metadata_text):
+    metadata = Metadata()
+    metadata.parse(metadata_text)
+    return metadata
+
+
+def _load_description(location):
+    metadata_entry, read = _metadata_reader(location)
+    metadata_text = read(metadata_entry)
+    if metadata_text is None:
+        return None
+    return _parse_metadata(metadata_text).description
+
+
+def _plugin_metadata(location, metadata):
+    # Note: the description is loaded on demand.
+    return PluginMetadata.lazy(metadata, partial(_load_description, location))
+
+
+def _locate(path_entries):
+    distributions = {}
+    for path_entry, replace in path_entries:
+        for key, location in _find_distributions(path_entry):
+            if replace or key not in distributions:
+                distributions[key] = location
+    return distributions
+
+
+def _read_metadata(key, location, read=None):
+    if read is None:
+        metadata_entry, read = _metadata_reader(location)
+    else:
+        metadata_entry = _metadata_reader(location)[0]
+    metadata_text = read(metadata_entry)
+    if metadata_text is None:
+        log.warning('ignoring distribution (missing metadata): %s', key)
+        return None
+    # Only parse the headers, skipping the
+    # description (the message's payload).
+    metadata = _parse_metadata(re.split('\r?\n\r?\n', metadata_text, maxsplit=1)[0])
+    return {
+        attr: getattr(metadata, attr)
+        for attr in PluginMetadata._fields
+        if attr != 'description'
+    }
+
+
+def _scan(path_entries):
+    plugins = {}
+    for key, location in _locate(path_entries).items():
+        if key == 'plover':
             continue
-        if isinstance(dist, DistInfoDistribution):
-            metadata_entry = 'METADATA'
-        else:
-            # Assume it's an egg distribution...
-            metadata_entry = 'PKG-INFO'
-        if not dist.has_metadata(metadata_entry):
-            log.warning('ignoring distribution (missing metadata): %s', dist)
+        read = _metadata_reader(location)[1]
+        entry_points = read('entry_points.txt')
+        if not entry_points or not _has_plover_entrypoints(entry_points):
             continue
-        metadata = Metadata()
-        metadata.parse(dist.get_metadata(metadata_entry))
-        plugin_metadata = PluginMetadata.from_dict({
-            attr: getattr(metadata, attr)
-            for attr in PluginMetadata._fields
-        })
-        plugins[dist.key].append(plugin_metadata)
+        metadata = _read_metadata(key, location, read)
+        if metadata is not None:
+            plugins[key] = (location, _plugin_metadata(location, metadata))
+    return plugins
+
+
+def _mtime(path):
+    try:
+        return os.stat(path or os.curdir).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _fingerprint(path_entries, locations):
+    # Installing / removing a distribution changes the modification time of
+    # its `sys.path` entry, updating a plugin the one of its metadata directory.
+    return [
+        [path, _mtime(path)]
+        for path in [
+            path_entry for path_entry, replace in path_entries
+        ] + sorted(locations)
+    ]
+
+
+# In memory cache for `list_distributions`: `(fingerprint, distributions)`.
+_distributions = None
+
+
+def _cache_file():
+    # One cache per Python environment.
+    key = sha1(sys.executable.encode('utf-8')).hexdigest()
+    return cache_path('local', key + '.json')
+
+
+def invalidate_cache():
+    global _distributions
+    _distributions = None
+    try:
+        os.unlink(_cache_file())
+    except FileNotFoundError:
+        pass
+    except OSError:
+        # Note: a stale cache is still detected (see `_fingerprint`).
+        log.warning('failed to remove local plugins cache', exc_info=True)
+
+
+def list_plugins():
+    path_entries = _path_entries()
+    cache_file = _cache_file()
+    cache = load_json(cache_file, {})
+    cached_plugins = cache.get('plugins', {})
+    if cache.get('fingerprint') == _fingerprint(path_entries, [
+        location for location, metadata in cached_plugins.values()
+    ]):
+        plugins = {
+            key: (location, _plugin_metadata(location, metadata))
+            for key, (location, metadata) in cached_plugins.items()
+        }
+    else:
+        plugins = _scan(path_entries)
+        fingerprint = _fingerprint(path_entries, [
+            location for location, metadata in plugins.values()
+        ])
+        # Don't cache the results if a modification time is too
+        # recent, as a change in the same tick would go unnoticed.
+        now = time.time()
+        if all(mtime is None or now - mtime / 1e9 > 2
+               for path, mtime in fingerprint):
+            try:
+                save_json(cache_file, {
+                    'fingerprint': fingerprint,
+                    'plugins': {
+                        key: [location, {
+                            field: getattr(metadata, field)
+                            for field in PluginMetadata._fields
+                            if field != 'description'
+                        }]
+                        for key, (location, metadata) in plugins.items()
+                    },
+                })
+            except OSError:
+                log.warning('failed to save local plugins cache', exc_info=True)
     return {
-        name: list(sorted(versions))
-        for name, versions in plugins.items()
+        key: [metadata]
+        for key, (location, metadata) in plugins.items()
     }
+
+
+def list_distributions():
+    '''
+    List all the installed distributions (not only plugins), return
+    a `{key: metadata}` dictionary (without the descriptions).
+
+    The result is kept in memory until one of the `sys.path`
+    entries is modified (or the cache is invalidated).
+    '''
+    global _distributions
+    path_entries = _path_entries()
+    fingerprint = _fingerprint(path_entries, [])
+    if _distributions is None or _distributions[0] != fingerprint:
+        distributions = {}
+        for key, location in _locate(path_entries).items():
+            metadata = _read_metadata(key, location)
+            if metadata is not None:
+                distributions[key] = PluginMetadata.from_dict(metadata)
+        _distributions = fingerprint, distributions
+    return _distributions[1]
+
+
+def locate_distributions():
+    '''
+    Return the location (metadata directory, or egg) of all
+    the installed distributions: a `{key: location}` dictionary.
+    '''
+    return _locate(_path_entries())
+
+
+def read_record(location):
+    '''
+    Return the (absolute) paths of the files listed in the `RECORD`
+    of a distribution, or `None` if there is none (e.g. eggs, or legacy
+    `.egg-info` installs).
+    '''
+    if not location.lower().endswith('.dist-info'):
+        return None
+    record = _read_file(location, 'RECORD')
+    if record is None:
+        return None
+    # Note: paths are relative to the `.dist-info` parent directory.
+    root = os.path.dirname(location)
+    return [
+        os.path.normpath(os.path.join(root, row[0]))
+        for row in csv.reader(io.StringIO(record))
+        if row and row[0]
+    ]
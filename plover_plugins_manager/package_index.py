@@ -1,15 +1,767 @@
-from concurrent.futures import as_completed
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from hashlib import sha1
+from queue import Queue
+from threading import Lock, Thread
+import asyncio
+import gzip
 import json
 import os
+import random
+import re
+import time
 
-from plover_plugins_manager.requests import CachedFuturesSession
+from requests import HTTPError, RequestException
+
+from plover import log
+
+from plover_plugins_manager.requests import CachedSession
+from plover_plugins_manager.snapshot import (
+    Snapshot,
+    SnapshotError,
+    trim_release,
+    write_snapshot,
+)
+from plover_plugins_manager.utils import cache_path, load_json, save_json
 
 
 PYPI_URL = 'https://pypi.org/pypi'
 REGISTRY_URL = 'https://github.com/openstenoproject/plover_plugins_registry/raw/master/registry.json'
+# Optional aggregated index: a (possibly gzip compressed) JSON
+# document mapping each plugin name to its PyPI release data.
+INDEX_URL = None
+# Maximum number of simultaneous requests.
+CONCURRENCY = 16
+# Packages checked less than this many seconds ago are not checked again.
+MAX_AGE = 600
+# Per request timeout (in seconds).
+TIMEOUT = 15
+# Number of retries on errors, and initial delay between retries (doubled
+# after each failed attempt).
+RETRIES = 2
+BACKOFF = 0.5
+# If set, a second identical request is started for
+# requests taking longer than that many seconds.
+HEDGE_AFTER = None
+# Overall deadline for a refresh (in seconds): on expiration,
+# partial results are returned.
+DEADLINE = 120
+
+
+class FetchStats:
+
+    def __init__(self):
+        self.latencies = []
+        self.from_cache = 0
+        self.unchanged = 0
+        self.retries = 0
+        self.hedged = 0
+        self.failed = []
+        self.wall_time = None
+
+    def add(self, url, latency, resp):
+        self.latencies.append((url, latency))
+        if getattr(resp, 'from_cache', False):
+            self.from_cache += 1
+
+    @property
+    def requests(self):
+        return len(self.latencies)
+
+    @property
+    def max_latency(self):
+        return max((latency for url, latency in self.latencies), default=0)
+
+    @property
+    def mean_latency(self):
+        if not self.latencies:
+            return 0
+        return sum(latency for url, latency in self.latencies) / len(self.latencies)
+
+    def __str__(self):
+        return ('%u requests (%u from cache, %u unchanged, %u retried, '
+                '%u hedged, %u failed) in %.3fs, '
+                'latency: mean=%.3fs max=%.3fs' % (
+                    self.requests, self.from_cache, self.unchanged,
+                    self.retries, self.hedged, len(self.failed),
+                    self.wall_time or 0, self.mean_latency, self.max_latency))
+
+
+class Cancelled(Exception):
+    """
+    Raised when an operation is cancelled (see `CancelToken`).
+    """
+
+
+class CancelToken:
+    """
+    Thread-safe cancellation request.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._callbacks = []
+        self._lock = Lock()
+
+    def cancel(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            # Note: called with the lock held, so a callback
+            # is never called after its removal.
+            for fn in self._callbacks:
+                fn()
+            self._callbacks.clear()
+
+    def add_callback(self, fn):
+        """
+        Call `fn()` on cancellation (immediately if already cancelled).
+        """
+        with self._lock:
+            if self.cancelled:
+                fn()
+            else:
+                self._callbacks.append(fn)
+
+    def remove_callback(self, fn):
+        with self._lock:
+            if fn in self._callbacks:
+                self._callbacks.remove(fn)
+
+
+def _all_tasks(loop):
+    # Note: `asyncio.all_tasks` is only available since Python 3.7.
+    all_tasks = getattr(asyncio, 'all_tasks', None)
+    if all_tasks is None:
+        return asyncio.Task.all_tasks(loop)
+    return all_tasks(loop)
+
+
+class Fetcher:
+    """
+    Run requests from an asyncio event loop, at most `concurrency`
+    at a time, through a shared (keep-alive) connection pool.
+
+    Each request is given `timeout` seconds (see `requests`' timeout
+    parameter), and is retried up to `retries` times (with a jittered
+    exponential backoff) on errors / server errors / rate limiting
+    (429 responses). If `hedge_after` is set, a second identical
+    request is started when the first one takes longer than that,
+    and the first to finish wins.
+    """
+
+    def __init__(self, concurrency=CONCURRENCY, session=None, stats=None,
+                 timeout=TIMEOUT, retries=RETRIES, backoff=BACKOFF,
+                 hedge_after=HEDGE_AFTER):
+        if session is None:
+            session = CachedSession(pool_maxsize=concurrency)
+        self.session = session
+        self.stats = FetchStats() if stats is None else stats
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_after = hedge_after
+        self._concurrency = concurrency
+        max_workers = concurrency
+        if hedge_after is not None:
+            # Leave room for hedged requests.
+            max_workers *= 2
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._semaphore = None
+
+    def _request(self, url):
+        loop = asyncio.get_event_loop()
+        return asyncio.ensure_future(loop.run_in_executor(
+            self._executor, partial(self.session.get, url,
+                                    timeout=self.timeout)))
+
+    async def _hedged_get(self, url):
+        tasks = {self._request(url)}
+        try:
+            if self.hedge_after is not None:
+                done, __ = await asyncio.wait(tasks, timeout=self.hedge_after)
+                if not done:
+                    # Straggler, start a second request.
+                    self.stats.hedged += 1
+                    tasks.add(self._request(url))
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def get(self, url):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.stats.retries += 1
+                delay = self.backoff * 2 ** (attempt - 1)
+                await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+            async with self._semaphore:
+                start = time.perf_counter()
+                try:
+                    resp = await self._hedged_get(url)
+                except RequestException as exc:
+                    error = exc
+                    continue
+            self.stats.add(url, time.perf_counter() - start, resp)
+            if resp.status_code < 500 and resp.status_code != 429:
+                return resp
+            try:
+                resp.raise_for_status()
+            except RequestException as exc:
+                error = exc
+        raise error
+
+    def run(self, coroutine, cancel=None):
+        """
+        Run `coroutine` to completion, unless cancelled through the optional
+        `cancel` token: `Cancelled` is then raised, once all the pending
+        tasks (including queued requests) have been cancelled.
+        """
+        loop = asyncio.new_event_loop()
+        start = time.perf_counter()
+        try:
+            if cancel is None:
+                return loop.run_until_complete(coroutine)
+            main = loop.create_task(coroutine)
+
+            def on_cancel():
+                loop.call_soon_threadsafe(main.cancel)
+
+            cancel.add_callback(on_cancel)
+            try:
+                return loop.run_until_complete(main)
+            except asyncio.CancelledError:
+                if not cancel.cancelled:
+                    raise
+                raise Cancelled()
+            finally:
+                cancel.remove_callback(on_cancel)
+                pending = [task for task in _all_tasks(loop) if not task.done()]
+                for task in pending:
+                    task.cancel()
+                if pending:
+                    loop.run_until_complete(asyncio.wait(pending))
+        finally:
+            self.stats.wall_time = time.perf_counter() - start
+            loop.close()
+
+    def close(self):
+        # Don't wait on stragglers (they are bounded by the timeout anyway).
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class IndexState:
+    """
+    What was learned during the previous refresh: the registry's content,
+    and for each package its last serial, the last time it was checked,
+    and its release data.
+    """
+
+    def __init__(self, path, load=True):
+        self.path = path
+        state = load_json(path, {}) if load else {}
+        self.registry = state.get('registry', [])
+        self.packages = state.get('packages', {})
+
+    @classmethod
+    def for_urls(cls, pypi_url, registry_url, load=True):
+        key = sha1(('%s\n%s' % (pypi_url, registry_url)).encode()).hexdigest()
+        return cls(cache_path('index', key + '.json'), load=load)
+
+    @property
+    def releases_path(self):
+        """
+        The releases are also saved as a snapshot (see `snapshot.Snapshot`),
+        so a single one can be loaded without parsing the whole state.
+        """
+        return os.path.splitext(self.path)[0] + '.snapshot'
+
+    def serial(self, name):
+        return self.packages.get(name, {}).get('serial')
+
+    def release(self, name, max_age=None):
+        package = self.packages.get(name)
+        if package is None:
+            return None
+        if max_age is not None and time.time() - package['checked'] > max_age:
+            return None
+        return package['release']
+
+    def update(self, name, serial, release):
+        self.packages[name] = {
+            'serial': serial,
+            'checked': time.time(),
+            'release': release,
+        }
+
+    def save(self):
+        save_json(self.path, {
+            'registry': self.registry,
+            'packages': self.packages,
+        })
+        self.save_releases()
+
+    def save_releases(self):
+        write_snapshot(self.releases_path, [
+            package['release'] for package in self.packages.values()
+        ])
+
+
+def _is_plugin(release):
+    return 'plover_plugin' in (release['info']['keywords'] or '').split()
+
+
+def _available_versions(release):
+    versions = release.get('versions')
+    if versions is not None:
+        return versions
+    files_per_version = release.get('releases')
+    if files_per_version is None:
+        return [release['info']['version']]
+    # Ignore versions without files, or with only yanked files.
+    return [
+        version
+        for version, files in files_per_version.items()
+        if any(not f.get('yanked', False) for f in files)
+    ]
+
+
+_JSON_DECODER = json.JSONDecoder()
+_JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def _parse_fields(text, fields):
+    """
+    Parse only the top-level `fields` of the JSON object `text`: parsing
+    stops as soon as they have all been found (the top-level keys of a
+    PyPI package document are ordered: `info`, `last_serial`, `releases`,
+    `urls`, so the bulk of the document is usually never parsed).
+    """
+    def skip(idx):
+        return _JSON_WHITESPACE.match(text, idx).end()
+    result = {}
+    idx = skip(0)
+    if text[idx:idx + 1] != '{':
+        raise ValueError('not a JSON object')
+    idx = skip(idx + 1)
+    while len(result) < len(fields) and text[idx:idx + 1] != '}':
+        key, idx = _JSON_DECODER.raw_decode(text, idx)
+        idx = skip(idx)
+        if text[idx:idx + 1] != ':':
+            raise ValueError('invalid JSON object at %u' % idx)
+        value, idx = _JSON_DECODER.raw_decode(text, skip(idx + 1))
+        if key in fields:
+            result[key] = value
+        idx = skip(idx)
+        if text[idx:idx + 1] == ',':
+            idx = skip(idx + 1)
+    return result
+
+
+def parse_release(data, history=False):
+    """
+    Parse a PyPI package document, directly trimming it
+    down to the fields we need (see `trim_release`).
+    """
+    fields = {'info', 'last_serial'}
+    if history:
+        fields.add('releases')
+    release = _parse_fields(data.decode('utf-8'), fields)
+    if 'info' not in release:
+        raise ValueError('invalid release: missing info')
+    if history:
+        release['versions'] = _available_versions(release)
+    return trim_release(release)
+
+
+def load_index(data):
+    if data[:2] == b'\x1f\x8b':
+        data = gzip.decompress(data)
+    return json.loads(data.decode('utf-8'))
+
+
+def dump_index(releases, fp):
+    index = {}
+    for release in releases:
+        entry = {
+            'info': release['info'],
+            'last_serial': release.get('last_serial'),
+        }
+        if 'versions' in release:
+            entry['versions'] = release['versions']
+        index[release['info']['name']] = entry
+    with gzip.GzipFile(fileobj=fp, mode='wb') as gz:
+        gz.write(json.dumps(index, sort_keys=True).encode('utf-8'))
+
+
+async def _fetch_index(fetcher, index_url):
+    try:
+        resp = await fetcher.get(index_url)
+        resp.raise_for_status()
+        return {
+            name.lower(): release
+            for name, release in load_index(resp.content).items()
+        }
+    except (RequestException, ValueError, OSError):
+        log.warning('failed to load aggregated index from %s',
+                    index_url, exc_info=True)
+        return {}
+
+
+def _response_serial(resp):
+    try:
+        return int(resp.headers['X-PyPI-Last-Serial'])
+    except (KeyError, ValueError):
+        return None
+
+
+def _has_history(release):
+    return 'versions' in release
+
+
+async def _fetch_release(fetcher, state, pypi_url, name, history):
+    resp = await fetcher.get('%s/%s/json' % (pypi_url, name))
+    if resp.status_code in (404, 410):
+        # Can happen if a package has been deleted.
+        return name, None, None
+    if resp.status_code != 200:
+        # E.g. access denied: fallback to the previous release, if any.
+        raise HTTPError('unexpected status %u for %s' % (resp.status_code, resp.url),
+                        response=resp)
+    serial = _response_serial(resp)
+    if serial is not None and serial == state.serial(name):
+        release = state.release(name)
+        if not history or _has_history(release):
+            # Unchanged, no need to parse the response.
+            fetcher.stats.unchanged += 1
+            return name, serial, release
+    release = parse_release(resp.content, history=history)
+    if release['last_serial'] is None:
+        release['last_serial'] = serial
+    return name, release['last_serial'], release
+
+
+async def _find_releases(fetcher, state, pypi_url, registry_url, index_url,
+                         max_age, history, deadline, callback):
+
+    all_releases = {}
+    start = time.monotonic()
 
+    def remaining():
+        if deadline is None:
+            return None
+        return max(0, deadline - (time.monotonic() - start))
 
-def find_plover_plugins_releases(pypi_url=None, registry_url=None, capture=None):
+    def add_plugin(release):
+        if _is_plugin(release):
+            info = release['info']
+            all_releases[(info['name'], info['version'])] = release
+            if callback is not None:
+                callback(release)
+
+    def add_release(name, serial, release):
+        if release is None:
+            state.packages.pop(name, None)
+            return
+        state.update(name, serial, release)
+        add_plugin(release)
+
+    def add_failed(name):
+        fetcher.stats.failed.append(name)
+        # Fallback to the previous (stale) release, if any.
+        release = state.release(name)
+        if release is not None and (not history or _has_history(release)):
+            add_plugin(release)
+
+    if index_url:
+        index = asyncio.ensure_future(_fetch_index(fetcher, index_url))
+    try:
+        resp = await asyncio.wait_for(fetcher.get(registry_url), remaining())
+        resp.raise_for_status()
+        registry = resp.json()
+    except (RequestException, ValueError, asyncio.TimeoutError):
+        if not state.registry:
+            raise
+        log.warning('failed to fetch plugins registry, using previous version',
+                    exc_info=True)
+        registry = state.registry
+    if index_url:
+        try:
+            index = await asyncio.wait_for(index, remaining())
+        except asyncio.TimeoutError:
+            index = {}
+    else:
+        index = {}
+
+    registry = set(registry)
+    for name in set(state.packages) - registry:
+        # Removed from the registry.
+        del state.packages[name]
+    state.registry = sorted(registry)
+
+    to_fetch = {}
+    for name in registry:
+        release = index.get(name.lower())
+        if release is not None:
+            release = trim_release(release)
+            serial = release['last_serial']
+            if serial is not None and serial == state.serial(name):
+                fetcher.stats.unchanged += 1
+            add_release(name, serial, release)
+            continue
+        release = state.release(name, max_age=max_age)
+        if release is not None and (not history or _has_history(release)):
+            # Recently checked.
+            fetcher.stats.unchanged += 1
+            add_plugin(release)
+            continue
+        # Missing from the aggregated index (or no aggregated
+        # index available): fallback to querying PyPI directly.
+        task = asyncio.ensure_future(_fetch_release(fetcher, state, pypi_url,
+                                                    name, history))
+        to_fetch[task] = name
+
+    def on_fetched(name, task):
+        if task.cancelled():
+            return
+        try:
+            add_release(*task.result())
+        except (RequestException, ValueError):
+            log.debug('fetching %s failed', name, exc_info=True)
+            add_failed(name)
+
+    for task, name in to_fetch.items():
+        task.add_done_callback(partial(on_fetched, name))
+    if to_fetch:
+        __, pending = await asyncio.wait(to_fetch, timeout=remaining())
+        if pending:
+            # Deadline expired.
+            for task in pending:
+                task.cancel()
+                add_failed(to_fetch[task])
+            await asyncio.wait(pending)
+    if fetcher.stats.failed:
+        log.warning('failed to fetch %u packages: %s',
+                    len(fetcher.stats.failed),
+                    ', '.join(sorted(fetcher.stats.failed)))
+
+    return list(all_releases.values())
+
+
+_releases_cache = {}
+_projects_cache = {}
+_files_cache = {}
+
+
+async def _fetch_version(fetcher, pypi_url, name, version):
+    resp = await fetcher.get('%s/%s/%s/json' % (pypi_url, name, version))
+    if resp.status_code == 200:
+        release = parse_release(resp.content)
+    else:
+        release = None
+    return (pypi_url, name, version), release
+
+
+async def _fetch_project(fetcher, pypi_url, name):
+    resp = await fetcher.get('%s/%s/json' % (pypi_url, name))
+    if resp.status_code == 200:
+        release = parse_release(resp.content, history=True)
+    else:
+        release = None
+    return (pypi_url, name), release
+
+
+def parse_files(data):
+    """
+    Parse the list of files of a PyPI release document.
+    """
+    urls = _parse_fields(data.decode('utf-8'), {'urls'}).get('urls') or []
+    return [
+        {
+            'filename': f['filename'],
+            'url': f['url'],
+            'sha256': f.get('digests', {}).get('sha256'),
+            'packagetype': f.get('packagetype'),
+        }
+        for f in urls
+        if not f.get('yanked', False)
+    ]
+
+
+async def _fetch_files(fetcher, pypi_url, name, version):
+    resp = await fetcher.get('%s/%s/%s/json' % (pypi_url, name, version))
+    if resp.status_code == 200:
+        files = parse_files(resp.content)
+    else:
+        files = None
+    return (pypi_url, name, version), files
+
+
+def _fetch_cached(cache, fetch, keys, concurrency):
+    if concurrency is None:
+        concurrency = int(os.environ.get('PYPI_CONCURRENCY', CONCURRENCY))
+    to_fetch = {key for key in keys if key not in cache}
+    if to_fetch:
+        async def fetch_all():
+            for future in asyncio.as_completed([
+                fetch(fetcher, *key) for key in to_fetch
+            ]):
+                key, release = await future
+                cache[key] = release
+        with Fetcher(min(concurrency, len(to_fetch))) as fetcher:
+            fetcher.run(fetch_all())
+
+
+def fetch_releases(versions, pypi_url=None, concurrency=None):
+    """
+    Fetch the release data for specific versions: `versions` is a list
+    of `(name, version)` tuples, return a `{(name, version): release}`
+    dictionary (`None` for missing releases). Results are cached.
+    """
+
+    if pypi_url is None:
+        pypi_url = os.environ.get('PYPI_URL', PYPI_URL)
+
+    _fetch_cached(_releases_cache, _fetch_version, [
+        (pypi_url, name, version)
+        for name, version in versions
+    ], concurrency)
+
+    return {
+        (name, version): _releases_cache[(pypi_url, name, version)]
+        for name, version in versions
+    }
+
+
+def fetch_projects(names, pypi_url=None, concurrency=None):
+    """
+    Fetch the release data of any project (not only plugins), including
+    the list of its available versions (see `parse_release`'s history
+    mode): return a `{name: release}` dictionary (`None` for missing
+    projects). Results are cached.
+    """
+
+    if pypi_url is None:
+        pypi_url = os.environ.get('PYPI_URL', PYPI_URL)
+
+    _fetch_cached(_projects_cache, _fetch_project, [
+        (pypi_url, name) for name in names
+    ], concurrency)
+
+    return {
+        name: _projects_cache[(pypi_url, name)]
+        for name in names
+    }
+
+
+def fetch_files(versions, pypi_url=None, concurrency=None):
+    """
+    Fetch the list of (non-yanked) files of specific versions (see
+    `fetch_releases`): return a `{(name, version): files}` dictionary
+    (`None` for missing releases), with each file a dictionary
+    (`filename`, `url`, `sha256`, and `packagetype`). Results are cached.
+    """
+
+    if pypi_url is None:
+        pypi_url = os.environ.get('PYPI_URL', PYPI_URL)
+
+    _fetch_cached(_files_cache, _fetch_files, [
+        (pypi_url, name, version)
+        for name, version in versions
+    ], concurrency)
+
+    return {
+        (name, version): _files_cache[(pypi_url, name, version)]
+        for name, version in versions
+    }
+
+
+def fetch_release(name, version, pypi_url=None):
+    return fetch_releases([(name, version)], pypi_url=pypi_url)[(name, version)]
+
+
+def load_description(name, pypi_url=None, registry_url=None, snapshot=None):
+    """
+    Load a plugin's description from the releases of the last refresh
+    (see `IndexState.releases_path`), or from the snapshot in offline
+    mode, so descriptions don't have to be kept in memory. Return `None`
+    if not available.
+    """
+
+    if snapshot is None:
+        snapshot = os.environ.get('INDEX_SNAPSHOT')
+
+    if not snapshot:
+        if pypi_url is None:
+            pypi_url = os.environ.get('PYPI_URL', PYPI_URL)
+        if registry_url is None:
+            registry_url = os.environ.get('REGISTRY_URL', REGISTRY_URL)
+        state = IndexState.for_urls(pypi_url, registry_url, load=False)
+        snapshot = state.releases_path
+        if not os.path.exists(snapshot):
+            # Saved by a previous version: convert it (once).
+            state = IndexState(state.path)
+            if not state.packages:
+                return None
+            try:
+                state.save_releases()
+            except OSError:
+                log.warning('failed to save index releases', exc_info=True)
+                return None
+
+    try:
+        with Snapshot(snapshot) as snap:
+            release = snap.load(name)
+    except (OSError, SnapshotError):
+        return None
+
+    if release is None:
+        return None
+    return release['info'].get('description')
+
+
+def _replay_snapshot(snapshot, callback):
+    with Snapshot(snapshot) as snap:
+        all_releases = [release for release in snap if _is_plugin(release)]
+    if callback is not None:
+        for release in all_releases:
+            callback(release)
+    return all_releases
+
+
+def find_plover_plugins_releases(pypi_url=None, registry_url=None,
+                                 index_url=None, capture=None,
+                                 concurrency=None, stats=None,
+                                 max_age=MAX_AGE, callback=None,
+                                 snapshot=None, history=None,
+                                 timeout=TIMEOUT, retries=RETRIES,
+                                 hedge_after=HEDGE_AFTER, deadline=DEADLINE,
+                                 cancel=None):
+
+    if snapshot is None:
+        snapshot = os.environ.get('INDEX_SNAPSHOT')
+
+    if snapshot:
+        # Offline mode: replay a previous capture.
+        return _replay_snapshot(snapshot, callback)
 
     if pypi_url is None:
         pypi_url = os.environ.get('PYPI_URL', PYPI_URL)
@@ -17,53 +769,67 @@ def find_plover_plugins_releases(pypi_url=None, registry_url=None, capture=None)
     if registry_url is None:
         registry_url = os.environ.get('REGISTRY_URL', REGISTRY_URL)
 
-    session = CachedFuturesSession()
+    if index_url is None:
+        index_url = os.environ.get('INDEX_URL', INDEX_URL)
 
-    in_progress = set()
-    all_releases = {}
+    if concurrency is None:
+        concurrency = int(os.environ.get('PYPI_CONCURRENCY', CONCURRENCY))
 
-    def fetch_release(name, version=None):
-        if (name, version) in all_releases:
-            return
-        all_releases[(name, version)] = None
-        if version is None:
-            url = '%s/%s/json' % (pypi_url, name)
-        else:
-            url = '%s/%s/%s/json' % (pypi_url, name, version)
-        in_progress.add(session.get(url))
-
-    with session:
-
-        for name in session.get(registry_url).result().json():
-            fetch_release(name)
-
-        while in_progress:
-            for future in as_completed(list(in_progress)):
-                in_progress.remove(future)
-                if not future.done():
-                    continue
-                resp = future.result()
-                if resp.status_code != 200:
-                    # Can happen if a package has been deleted.
-                    continue
-                release = resp.json()
-                info = release['info']
-                if 'plover_plugin' not in info['keywords'].split():
-                    # Not a plugin.
-                    continue
-                name, version = info['name'], info['version']
-                all_releases[(name, version)] = release
-                # for version in release['releases'].keys():
-                #     fetch_release(name, version)
-
-    all_releases = [
-        release
-        for release in all_releases.values()
-        if release is not None
-    ]
+    if history is None:
+        # List all available versions, not just the latest.
+        history = bool(os.environ.get('INDEX_HISTORY'))
+
+    state = IndexState.for_urls(pypi_url, registry_url)
+
+    with Fetcher(concurrency, stats=stats, timeout=timeout, retries=retries,
+                 hedge_after=hedge_after) as fetcher:
+        all_releases = fetcher.run(_find_releases(fetcher, state, pypi_url,
+                                                  registry_url, index_url,
+                                                  max_age, history, deadline,
+                                                  callback), cancel)
+    try:
+        state.save()
+    except OSError:
+        log.warning('failed to save index state', exc_info=True)
+    log.debug('fetched %u plugins releases: %s',
+              len(all_releases), fetcher.stats)
 
     if capture is not None:
-        with open(capture, 'w') as fp:
-            json.dump(all_releases, fp, indent=2, sort_keys=True)
+        write_snapshot(capture, all_releases)
 
     return all_releases
+
+
+def iter_plover_plugins_releases(**kwargs):
+    """
+    Same as `find_plover_plugins_releases`, but run in the background
+    and yield batches of releases (lists) as soon as they are available.
+    """
+    results = Queue()
+    done = object()
+
+    def run():
+        try:
+            find_plover_plugins_releases(callback=results.put, **kwargs)
+        except Exception as exc:
+            results.put(exc)
+        finally:
+            results.put(done)
+
+    Thread(target=run, daemon=True).start()
+    while True:
+        batch = [results.get()]
+        while not results.empty():
+            batch.append(results.get())
+        finished = batch[-1] is done
+        if finished:
+            batch.pop()
+        error = None
+        if batch and isinstance(batch[-1], Exception):
+            error = batch.pop()
+        if batch:
+            yield batch
+        if error is not None:
+            raise error
+        if finished:
+            break
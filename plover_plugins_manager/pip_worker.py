@@ -0,0 +1,236 @@
+'''
+Long-lived pip process, to avoid paying for the interpreter startup and
+pip's imports on each operation.
+
+The worker reads commands (JSON encoded `pip_wrapper` arguments, one per
+line) on its standard input, and runs them in-process: the output is
+streamed back on its standard output, followed by a status line starting
+with the worker's token. Before running a command, the worker checks the
+environment (the `sys.path` entries) did not change since it started, or
+asks to be restarted, as pip's state could be stale (e.g. after pip itself
+was upgraded, or the user site directory was created).
+'''
+
+from threading import Event, Lock
+import atexit
+import json
+import os
+import subprocess
+import sys
+import traceback
+import uuid
+
+
+class _Worker:
+
+    def __init__(self):
+        self._lock = Lock()
+        self._proc = None
+        self._env = None
+        self._token = None
+        self._busy = False
+
+    def _start(self, env):
+        self.stop()
+        if sys.platform.startswith('win32'):
+            # Make it possible to interrupt by sending a Ctrl+C event.
+            kwargs = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+        else:
+            kwargs = {}
+        self._token = uuid.uuid4().hex.encode()
+        self._env = env
+        self._proc = subprocess.Popen([sys.executable, '-u', '-m', __name__,
+                                       self._token.decode()],
+                                      env=env, stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE,
+                                      stderr=subprocess.STDOUT, **kwargs)
+
+    def stop(self):
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        try:
+            proc.stdin.close()
+            proc.wait(10)
+        except (OSError, subprocess.TimeoutExpired):
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+
+    def popen(self, args, env):
+        with self._lock:
+            if self._busy:
+                return None
+            if self._proc is None or self._proc.poll() is not None or \
+               env != self._env:
+                self._start(env)
+            self._busy = True
+        return WorkerProcess(self, args)
+
+    def _send(self, args):
+        # Return the worker process, or `None` if it died.
+        command = json.dumps(args).encode('utf-8') + b'\n'
+        for attempt in range(2):
+            proc = self._proc
+            try:
+                proc.stdin.write(command)
+                proc.stdin.flush()
+            except OSError:
+                return None
+            # Note: skip the output on startup (e.g. warnings).
+            line = proc.stdout.readline()
+            while line and not line.startswith(self._token):
+                line = proc.stdout.readline()
+            if not line:
+                return None
+            status = line[len(self._token):].split()
+            if status == [b'start']:
+                return proc
+            # The environment changed: restart the worker.
+            with self._lock:
+                self._start(self._env)
+        return None
+
+    def _release(self):
+        with self._lock:
+            self._busy = False
+
+
+class WorkerProcess:
+    '''
+    `subprocess.Popen` like handle on a command run by the worker, with
+    the output (`stdout` and `stderr` merged) available through `stdout`.
+
+    Note: the output must be read for the command to complete.
+    '''
+
+    def __init__(self, worker, args):
+        self.args = args
+        self.returncode = None
+        # Note: only `readline` is supported.
+        self.stdout = self
+        self._worker = worker
+        self._proc = None
+        self._started = False
+        self._done = Event()
+
+    @property
+    def pid(self):
+        return None if self._proc is None else self._proc.pid
+
+    def _finish(self, returncode):
+        self.returncode = returncode
+        self._worker._release()
+        self._done.set()
+
+    def readline(self):
+        if self.returncode is not None:
+            return b''
+        if not self._started:
+            # Note: started lazily, so the caller is not
+            # blocked while the worker is (re)starting.
+            self._started = True
+            self._proc = self._worker._send(self.args)
+            if self._proc is None:
+                self._finish(1)
+                return b'failed to start pip worker' + os.linesep.encode()
+        line = self._proc.stdout.readline()
+        if not line:
+            # The worker died (e.g. it was terminated).
+            self._finish(self._proc.wait() or 1)
+            return b''
+        token = self._worker._token
+        index = line.find(token)
+        if index < 0:
+            return line
+        self._finish(int(line[index + len(token):].split()[1]))
+        return line[:index]
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise subprocess.TimeoutExpired(self.args, timeout)
+        return self.returncode
+
+    def send_signal(self, sig):
+        if self._proc is not None and self.returncode is None:
+            self._proc.send_signal(sig)
+
+    def terminate(self):
+        # Note: the worker is restarted on the next command.
+        if self._proc is not None and self.returncode is None:
+            self._proc.terminate()
+
+
+_worker = None
+
+
+def popen(args, env):
+    '''
+    Run `pip_wrapper` with `args` in the worker (started, or restarted if
+    `env` changed, as needed). Return a `WorkerProcess`, or `None` if the
+    worker is busy with another command.
+    '''
+    global _worker
+    if _worker is None:
+        _worker = _Worker()
+        atexit.register(_worker.stop)
+    return _worker.popen(args, env)
+
+
+def _environment():
+    from plover_plugins_manager import local_registry
+    return local_registry._fingerprint(local_registry._path_entries(), [])
+
+
+def _serve(token):
+    from pkg_resources import load_entry_point
+    from plover_plugins_manager import pip_wrapper
+    # Keep the commands channel private, pip must not read from it.
+    commands = os.fdopen(os.dup(sys.stdin.fileno()), 'rb')
+    os.dup2(os.open(os.devnull, os.O_RDONLY), sys.stdin.fileno())
+    sys.argv[0] = 'pip'
+    environment = _environment()
+    # Loaded once, this is what makes the worker faster.
+    pip_main = load_entry_point('pip', 'console_scripts', 'pip')
+
+    def reply(status):
+        sys.stderr.flush()
+        sys.stdout.flush()
+        print(token, status, flush=True)
+
+    while True:
+        try:
+            line = commands.readline()
+        except KeyboardInterrupt:
+            continue
+        if not line:
+            break
+        args = json.loads(line.decode('utf-8'))
+        if _environment() != environment:
+            reply('restart')
+            break
+        reply('start')
+        try:
+            code = pip_wrapper.run(args, pip_main)
+        except KeyboardInterrupt:
+            code = 1
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                code = e.code
+            else:
+                print(e.code, file=sys.stderr)
+                code = 1
+        except Exception:
+            traceback.print_exc()
+            code = 1
+        reply('exit %u' % (code or 0))
+
+
+if __name__ == '__main__':
+    if sys.platform.startswith('win32'):
+        # Allow interrupting with Ctrl+C.
+        __import__('ctypes').windll.kernel32.SetConsoleCtrlHandler(0, 0)
+    _serve(sys.argv[1])
@@ -1,12 +1,72 @@
+from functools import partial
+import json
 import re
+import shutil
 import sys
+import tempfile
 from pkg_resources import load_entry_point
 
+
+def run(args, pip_main=None):
+    '''
+    Run pip with `args`, and return its exit code.
+
+    If the first argument is `--wheelhouse`, distributions are staged in a
+    local wheelhouse first (see `wheelhouse.install_args`), and if the
+    index was not used, the install is retried with it on failure. With
+    `--transaction`, the second argument is a JSON encoded batch of commands
+    (see `transaction.run_transaction`). Uninstalls are done natively when
+    possible (see `uninstall.uninstall_args`). `pip_main` is pip's entry
+    point, and is loaded if not provided.
+
+    The cache of installed plugins is invalidated once an
+    install / uninstall is done (see `local_registry.list_plugins`).
+    '''
+    if pip_main is None:
+        pip_main = load_entry_point('pip', 'console_scripts', 'pip')
+    if args[:1] == ['--transaction']:
+        # Batch of commands (see `transaction.run_transaction`).
+        from plover_plugins_manager.transaction import run_transaction
+        return run_transaction(json.loads(args[1]),
+                               partial(run, pip_main=pip_main),
+                               progress=lambda msg: print(msg, flush=True))
+    if 'uninstall' in args:
+        # Natively, if possible (see `uninstall.uninstall_args`).
+        from plover_plugins_manager.uninstall import uninstall_args
+        args = uninstall_args(args, progress=lambda msg: print(msg, flush=True))
+        if args is None:
+            return 0
+    wheelhouse_dir = None
+    no_index = False
+    if args[:1] == ['--wheelhouse']:
+        # Stage distributions in a local wheelhouse first.
+        from plover_plugins_manager.wheelhouse import install_args
+        wheelhouse_dir = tempfile.mkdtemp(prefix='plover_plugins_wheelhouse')
+        staged_args = install_args(args[1:], wheelhouse_dir,
+                                   progress=lambda msg: print(msg, flush=True))
+        no_index = '--no-index' in staged_args and '--no-index' not in args
+        args = staged_args
+    try:
+        code = pip_main(args)
+        if code and no_index:
+            # Some dependencies may not have been staged (PyPI
+            # does not always list the dependencies of a release).
+            print('retrying with the package index', flush=True)
+            args = list(args)
+            args.remove('--no-index')
+            code = pip_main(args)
+        return code
+    finally:
+        if wheelhouse_dir is not None:
+            shutil.rmtree(wheelhouse_dir, ignore_errors=True)
+        if 'install' in args or 'uninstall' in args:
+            from plover_plugins_manager.local_registry import invalidate_cache
+            invalidate_cache()
+
+
 if __name__ == '__main__':
     if sys.platform.startswith('win32'):
         # Allow interrupting with Ctrl+C.
         __import__('ctypes').windll.kernel32.SetConsoleCtrlHandler(0, 0)
     sys.argv[0] = re.sub(r'(-script\.pyw?|\.exe)?$', '', sys.argv[0])
-    sys.exit(
-        load_entry_point('pip', 'console_scripts', 'pip')()
-    )
+    sys.exit(run(sys.argv[1:]))
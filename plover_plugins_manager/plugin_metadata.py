@@ -1,48 +1,173 @@
-from collections import namedtuple
-from functools import total_ordering
+from functools import lru_cache, total_ordering
+from sys import intern
 
 from pkg_resources import parse_version
 
+try:
+    from packaging.version import Version as PackagingVersion
+except Exception:
+    # 'packaging' may not be importable in old environments
+    PackagingVersion = None
+
 
 @total_ordering
-class PluginMetadata(namedtuple('PluginMetadata', '''
-                                author
-                                author_email
-                                description
-                                description_content_type
-                                home_page
-                                keywords
-                                license
-                                name
-                                summary
-                                version
-                                ''')):
+class _InvalidVersion:
+    '''
+    Sort key for versions that are not valid PEP 440 versions (rejected by
+    recent versions of setuptools): sorted before all valid versions, like
+    pkg_resources' legacy versions used to be.
+    '''
 
-    @property
-    def requirement(self):
-        return '%s==%s' % (self.name, self.version)
+    __slots__ = ('_version',)
 
-    @property
-    def parsed_version(self):
-        v = self.version
+    def __init__(self, version):
+        self._version = version
 
+    def __str__(self):
+        return self._version
+
+    def __repr__(self):
+        return '<_InvalidVersion(%r)>' % self._version
+
+    def __hash__(self):
+        return hash(self._version)
+
+    def __eq__(self, other):
+        if isinstance(other, _InvalidVersion):
+            return self._version == other._version
+        return NotImplemented
+
+    def __lt__(self, other):
+        if isinstance(other, _InvalidVersion):
+            return self._version < other._version
+        return True
+
+
+@lru_cache(maxsize=4096)
+def _parse_version_string(v):
+    # Note: parsed versions are immutable, so they can be shared.
+    try:
+        return parse_version(v or '0')
+    except ValueError:
+        # `InvalidVersion`.
+        return _InvalidVersion(v)
+
+
+def _parse_version(v):
+
+    if PackagingVersion is not None and isinstance(v, PackagingVersion):
+        v = str(v)
+
+    # Decode raw bytes/bytearray → str
+    if isinstance(v, (bytes, bytearray)):
         try:
-            from packaging.version import Version as PackagingVersion
-            if isinstance(v, PackagingVersion):
-                v = str(v)
+            v = v.decode()
         except Exception:
-            # 'packaging' may not be importable in old environments
-            pass
+            v = ''
 
-        # Decode raw bytes/bytearray → str
-        if isinstance(v, (bytes, bytearray)):
-            try:
-                v = v.decode()
-            except Exception:
-                v = ''
+    # Final fallback: ensure we hand a string to parse_version
+    return _parse_version_string(str(v))
 
-        # Final fallback: ensure we hand a string to parse_version
-        return parse_version(str(v) or '0')
+
+def _intern(value):
+    # Used for fields whose values are often shared (between versions of the
+    # same plugin, or plugins by the same author...): only keep one copy.
+    return intern(value) if type(value) is str else value
+
+
+_FIELDS = '''
+author
+author_email
+description
+description_content_type
+home_page
+keywords
+license
+name
+requires_dist
+requires_python
+summary
+version
+'''.split()
+
+
+@total_ordering
+class PluginMetadata:
+    '''
+    Immutable plugin metadata record.
+
+    The sort key (lowercase name and parsed version) is computed once
+    on creation, and the description can be loaded lazily (see `lazy`).
+    '''
+
+    _fields = tuple(_FIELDS)
+
+    __slots__ = tuple(
+        '_description' if field == 'description' else field
+        for field in _FIELDS
+    ) + ('_load_description', '_key')
+
+    def __init__(self, author='', author_email='', description='',
+                 description_content_type='', home_page='', keywords='',
+                 license='', name='', requires_dist=None, requires_python='',
+                 summary='', version=''):
+        set_field = object.__setattr__
+        set_field(self, 'author', _intern(author))
+        set_field(self, 'author_email', _intern(author_email))
+        set_field(self, '_description', description)
+        set_field(self, 'description_content_type', _intern(description_content_type))
+        set_field(self, 'home_page', _intern(home_page))
+        set_field(self, 'keywords', _intern(keywords))
+        set_field(self, 'license', _intern(license))
+        set_field(self, 'name', _intern(name))
+        # Note: normalized to a tuple (or `None`).
+        set_field(self, 'requires_dist', tuple(requires_dist) if requires_dist else None)
+        set_field(self, 'requires_python', _intern(requires_python))
+        set_field(self, 'summary', summary)
+        set_field(self, 'version', version)
+        set_field(self, '_load_description', None)
+        set_field(self, '_key', (_intern((name or '').lower()),
+                                 _parse_version(version)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("can't set attribute")
+
+    def __delattr__(self, name):
+        raise AttributeError("can't delete attribute")
+
+    def __reduce__(self):
+        return self.__class__, tuple(getattr(self, field) for field in _FIELDS)
+
+    @classmethod
+    def lazy(cls, d, load_description):
+        '''
+        Same as `from_dict`, but without the description: it is loaded on
+        first access with `load_description()` (which returns `None` on
+        failure).
+        '''
+        metadata = cls.from_dict(dict(d, description=None))
+        object.__setattr__(metadata, '_load_description', load_description)
+        return metadata
+
+    @property
+    def description(self):
+        load_description = self._load_description
+        if load_description is None:
+            return self._description
+        description = load_description()
+        if description is not None:
+            # Note: not cached on failure, so it can be retried.
+            object.__setattr__(self, '_description', description)
+            object.__setattr__(self, '_load_description', None)
+        return description
+
+    @property
+    def requirement(self):
+        return '%s==%s' % (self.name, self.version)
+
+    @property
+    def parsed_version(self):
+        return self._key[1]
 
     @classmethod
     def from_dict(cls, d):
@@ -53,12 +178,38 @@ class PluginMetadata(namedtuple('PluginMetadata', '''
         return cls.from_dict(kwargs)
 
     def to_dict(self):
-        return dict(zip(self._fields, self))
+        return {field: getattr(self, field) for field in self._fields}
+
+    def _replace(self, **kwargs):
+        values = {
+            field: getattr(self, field)
+            for field in self._fields
+            if field != 'description'
+        }
+        values['description'] = self._description
+        values.update(kwargs)
+        metadata = self.__class__(**values)
+        if 'description' not in kwargs:
+            object.__setattr__(metadata, '_load_description',
+                               self._load_description)
+        return metadata
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join(
+            '%s=%r' % (field, getattr(self, field))
+            for field in self._fields
+            if field != 'description'
+        ))
+
+    def __hash__(self):
+        return hash(self._key)
 
     def __eq__(self, other):
-        return ((self.name.lower(), self.parsed_version) ==
-                (other.name.lower(), other.parsed_version))
+        if not isinstance(other, PluginMetadata):
+            return NotImplemented
+        return self._key == other._key
 
     def __lt__(self, other):
-        return ((self.name.lower(), self.parsed_version) <
-                (other.name.lower(), other.parsed_version))
+        if not isinstance(other, PluginMetadata):
+            return NotImplemented
+        return self._key < other._key
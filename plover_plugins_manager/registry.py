@@ -1,16 +1,60 @@
 
+from functools import partial
+from hashlib import sha1
+from threading import Event, Lock, RLock, Thread
+from types import MappingProxyType
+import sys
+import time
+
 from plover import log
 
 from plover_plugins_manager import global_registry, local_registry
+from plover_plugins_manager.package_index import (
+    CancelToken,
+    Cancelled,
+    load_description,
+)
+from plover_plugins_manager.plugin_metadata import PluginMetadata
+from plover_plugins_manager.resolver import Resolver
+from plover_plugins_manager.search_index import SearchIndex
+from plover_plugins_manager.utils import cache_path, load_json, save_json
+from plover_plugins_manager.version_index import VersionIndex, is_compatible
+
+
+# Version of the saved state format (see `Registry.save`).
+STATE_VERSION = 1
 
 
 class PackageState:
 
-    def __init__(self, name, installed=None, available=None):
+    def __init__(self, name, installed=None, available=None,
+                 compatible=is_compatible):
         self.name = name
         self.installed = installed or []
-        self.available = available or []
+        self._compatible = compatible
+        self.available = available or ()
         self.status = 'installed' if installed else ''
+        # When the available versions were last fetched.
+        self.checked = time.time() if available else None
+        # Restored from a saved state, and not revalidated yet.
+        self.stale = False
+
+    def copy(self):
+        pkg = PackageState.__new__(PackageState)
+        pkg.__dict__.update(self.__dict__)
+        pkg.installed = list(self.installed)
+        return pkg
+
+    @property
+    def available(self):
+        return list(self.versions)
+
+    @available.setter
+    def available(self, metadata):
+        self.versions = VersionIndex(metadata)
+        # Computed once (a published package state is never
+        # modified): checking compatibility is not cheap.
+        self._latest = self.versions.latest(compatible=self._compatible)
 
     @property
     def current(self):
@@ -23,7 +67,25 @@ class PackageState:
 
     @property
     def latest(self):
-        return self.available[-1] if self.available else None
+        '''
+        Newest compatible version (`None` if there are none).
+        '''
+        return self._latest
+
+    def is_compatible(self, metadata):
+        return self._compatible(metadata)
+
+    def newer_versions(self):
+        '''
+        Compatible versions newer than the installed one.
+        '''
+        if self.current is None:
+            return []
+        return [
+            metadata
+            for metadata in self.versions.newer_than(self.current)
+            if self._compatible(metadata)
+        ]
 
     @property
     def metadata(self):
@@ -47,13 +109,212 @@ class PackageState:
         return str(self)
 
 
-class Registry:
+class RegistryDiff:
+    '''
+    Changes to a registry: names of the packages added, removed, whose
+    (installed or latest) version changed, and whose status changed.
+    '''
+
+    def __init__(self, added=(), removed=(), version_changed=(), status_changed=()):
+        self.added = list(added)
+        self.removed = list(removed)
+        self.version_changed = list(version_changed)
+        self.status_changed = list(status_changed)
+
+    def __bool__(self):
+        return bool(self.added or self.removed or
+                    self.version_changed or self.status_changed)
+
+    def __eq__(self, other):
+        return vars(self) == vars(other)
+
+    def __repr__(self):
+        return 'RegistryDiff(%s)' % ', '.join(
+            '%s=%r' % item for item in sorted(vars(self).items()) if item[1])
+
+    @property
+    def changed(self):
+        '''
+        Names of the updated packages (neither added nor removed).
+        '''
+        return sorted(set(self.version_changed) | set(self.status_changed))
+
+    def update(self, other):
+        for attr, names in vars(other).items():
+            getattr(self, attr).extend(names)
+
+
+class RefreshTask:
+    '''
+    A background update (see `Registry.refresh`), notifying its listeners
+    of each diff, and when done (whether successful, failed, or cancelled).
+    '''
 
     def __init__(self):
-        self._packages = {
-            name: PackageState(name, installed=metadata)
-            for name, metadata in local_registry.list_plugins().items()
-        }
+        self.cancel_token = CancelToken()
+        self._listeners = []
+        self._lock = Lock()
+        self._done = Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_token.cancelled
+
+    def cancel(self):
+        self.cancel_token.cancel()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def add_listener(self, on_diff=None, on_done=None):
+        with self._lock:
+            done = self.done
+            if not done:
+                self._listeners.append((on_diff, on_done))
+        if done and on_done is not None:
+            on_done()
+
+    def remove_listener(self, on_diff=None, on_done=None):
+        '''
+        Remove a listener (the same callbacks passed to `add_listener`):
+        once there are none left, the task is cancelled.
+        '''
+        with self._lock:
+            if (on_diff, on_done) in self._listeners:
+                self._listeners.remove((on_diff, on_done))
+            cancel = not self._listeners
+        if cancel:
+            self.cancel()
+
+    def _notify(self, diff):
+        with self._lock:
+            listeners = list(self._listeners)
+        for on_diff, on_done in listeners:
+            if on_diff is not None:
+                on_diff(diff)
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            listeners, self._listeners = self._listeners, []
+        for on_diff, on_done in listeners:
+            if on_done is not None:
+                on_done()
+
+
+def _package_key(pkg):
+    current, latest = pkg.current, pkg.latest
+    return (current and current.version, latest and latest.version), pkg.status
+
+
+def _state_file():
+    # One state per Python environment.
+    key = sha1(sys.executable.encode('utf-8')).hexdigest()
+    return cache_path('registry', key + '.json')
+
+
+def _dump_metadata(metadata):
+    return {
+        field: getattr(metadata, field)
+        for field in PluginMetadata._fields
+        if field != 'description'
+    }
+
+
+def _load_metadata(d):
+    # Note: the description is loaded on demand
+    # (from the state of the last refresh).
+    return PluginMetadata.lazy(d, partial(load_description, d['name']))
+
+
+class Registry:
+
+    def __init__(self, python_version=None, plover_version=None, state=None):
+        # Compatibility is checked against the running
+        # Python / Plover versions, unless overridden.
+        compatibility = {}
+        if python_version is not None:
+            compatibility['python_version'] = python_version
+        if plover_version is not None:
+            compatibility['plover_version'] = plover_version
+        self._compatible = partial(is_compatible, **compatibility)
+        if state is None:
+            self._packages = {
+                name: PackageState(name, installed=metadata,
+                                   compatible=self._compatible)
+                for name, metadata in local_registry.list_plugins().items()
+            }
+        else:
+            self._packages = {}
+            for name, package in state['packages'].items():
+                pkg = PackageState(name, compatible=self._compatible)
+                pkg.installed = [_load_metadata(d) for d in package['installed']]
+                pkg.available = [_load_metadata(d) for d in package['available']]
+                pkg.status = 'installed' if pkg.installed else ''
+                if pkg.newer_versions():
+                    pkg.status = 'outdated'
+                pkg.checked = package['checked']
+                pkg.stale = True
+                self._packages[name] = pkg
+        # When restored from a saved state, installed
+        # plugins must be scanned again on update.
+        self._rescan = state is not None
+        # Note: the packages mapping (and its package states) is never
+        # modified once published, updates are done on a copy that is
+        # then swapped in, so readers don't need to take the lock.
+        self._lock = RLock()
+        self._refresh_task = None
+        self._search_index = SearchIndex()
+        for name, pkg in self._packages.items():
+            self._search_index.update(name, pkg.metadata)
+        self._resolver = None
+
+    @classmethod
+    def load(cls, python_version=None, plover_version=None, path=None):
+        '''
+        Restore a registry from the state saved by the last update (see
+        `save`), without scanning installed plugins: all packages are
+        marked as stale until revalidated by `update` / `iter_update`.
+
+        Return `None` if there's no (valid) saved state.
+        '''
+        state = load_json(path or _state_file())
+        if not isinstance(state, dict) or state.get('version') != STATE_VERSION:
+            return None
+        try:
+            return cls(python_version=python_version,
+                       plover_version=plover_version, state=state)
+        except (KeyError, TypeError, ValueError):
+            log.warning('ignoring invalid registry state', exc_info=True)
+            return None
+
+    def save(self, path=None):
+        '''
+        Save the registry state: installed and available versions, with
+        the time they were last checked (see `load`).
+        '''
+        save_json(path or _state_file(), {
+            'version': STATE_VERSION,
+            'packages': {
+                name: {
+                    'installed': [_dump_metadata(pkg.current)] if pkg.current else [],
+                    'available': [_dump_metadata(m) for m in pkg.versions],
+                    'checked': pkg.checked,
+                }
+                for name, pkg in self._packages.items()
+            },
+        })
+
+    @property
+    def stale(self):
+        '''
+        Restored from a saved state, and not fully revalidated yet.
+        '''
+        return any(pkg.stale for pkg in self._packages.values())
 
     def __len__(self):
         return len(self._packages)
@@ -64,28 +325,281 @@ class Registry:
     def __getitem__(self, name):
         return self._packages[name]
 
+    def get(self, name, default=None):
+        return self._packages.get(name, default)
+
     def __iter__(self):
         return iter(self._packages.values())
 
+    def snapshot(self):
+        '''
+        Return a consistent (read-only) view of the current packages.
+        '''
+        return MappingProxyType(self._packages)
+
     def keys(self):
         return self._packages.keys()
 
     def items(self):
         return self._packages.items()
 
+    def search(self, query, limit=None):
+        '''
+        Return the names of the packages matching `query`
+        (on name, summary, keywords and author), best first.
+        '''
+        with self._lock:
+            return self._search_index.search(query, limit=limit)
+
+    def matches(self, query):
+        '''
+        Same as `search`, but return an unordered set of names
+        (or `None` if the query is empty: no filtering).
+        '''
+        with self._lock:
+            return self._search_index.matches(query)
+
+    def resolve(self, requirements):
+        '''
+        Check installing `requirements` before running pip: return
+        the resulting plan (see `resolver.Resolver`).
+        '''
+        with self._lock:
+            resolver = self._resolver
+            if resolver is None:
+                resolver = self._resolver = Resolver({
+                    name: pkg.versions
+                    for name, pkg in self._packages.items()
+                    if pkg.versions
+                }, compatible=self._compatible)
+        return resolver.resolve(requirements)
+
+    def _apply(self, changes):
+        '''
+        Apply `changes`, a `{name: fn}` mapping, with `fn(name, pkg)` returning
+        the updated package state (`pkg` is `None` for a new package, and
+        returning `None` removes it; otherwise it's a private copy that can
+        be modified). Return the corresponding diff.
+        '''
+        with self._lock:
+            packages = dict(self._packages)
+            diff = RegistryDiff()
+            for name, fn in changes.items():
+                pkg = packages.get(name)
+                old_key = None
+                if pkg is not None:
+                    old_key = _package_key(pkg)
+                    pkg = pkg.copy()
+                pkg = fn(name, pkg)
+                if pkg is None:
+                    if old_key is not None:
+                        del packages[name]
+                        self._search_index.remove(name)
+                        diff.removed.append(name)
+                    continue
+                packages[name] = pkg
+                if old_key is None:
+                    self._search_index.update(name, pkg.metadata)
+                    diff.added.append(name)
+                    continue
+                old_versions, old_status = old_key
+                new_versions, new_status = _package_key(pkg)
+                if new_versions != old_versions:
+                    self._search_index.update(name, pkg.metadata)
+                    diff.version_changed.append(name)
+                if new_status != old_status:
+                    diff.status_changed.append(name)
+            if diff.added or diff.removed or diff.version_changed:
+                # Available versions changed.
+                self._resolver = None
+            # Publish the new state.
+            self._packages = packages
+        return diff
+
+    def _rescan_installed(self):
+        installed_plugins = local_registry.list_plugins()
+
+        def rescan(name, pkg):
+            installed = installed_plugins.get(name, [])
+            if pkg is None:
+                return PackageState(name, installed=installed,
+                                    compatible=self._compatible)
+            if not installed and not pkg.versions:
+                return None
+            pkg.installed = installed
+            pkg.status = 'installed' if installed else ''
+            if pkg.newer_versions():
+                pkg.status = 'outdated'
+            return pkg
+        names = set(installed_plugins)
+        names.update(name for name, pkg in self.snapshot().items() if pkg.installed)
+        return self._apply({name: rescan for name in sorted(names)})
+
+    def _merge(self, available_plugins):
+        def merge(metadata, name, pkg):
+            if pkg is None:
+                return PackageState(name, available=metadata,
+                                    compatible=self._compatible)
+            pkg.available = metadata
+            pkg.checked = time.time()
+            if pkg.newer_versions():
+                pkg.status = 'outdated'
+            return pkg
+        return self._apply({
+            name: partial(merge, metadata)
+            for name, metadata in available_plugins.items()
+        })
+
+    def _prune(self, available_names):
+        # Packages not available anymore: forget
+        # about them, unless they're installed.
+        def prune(name, pkg):
+            # Note: `pkg` may have been removed since the names were picked.
+            if pkg is None or not pkg.installed:
+                return None
+            pkg.available = []
+            if pkg.status == 'outdated':
+                pkg.status = 'installed'
+            return pkg
+        return self._apply({
+            name: prune
+            for name, pkg in self.snapshot().items()
+            if pkg.versions and name not in available_names
+        })
+
+    def _revalidate(self):
+        def revalidate(name, pkg):
+            if pkg is None:
+                return None
+            pkg.stale = False
+            return pkg
+        return self._apply({
+            name: revalidate
+            for name, pkg in self.snapshot().items()
+            if pkg.stale
+        })
+
+    def rescan_installed(self):
+        '''
+        Scan the installed plugins again (e.g. after a failed
+        installation was rolled back), return the diff.
+
+        Unlike a full rescan, the installation history is kept: the
+        scanned version is only recorded (see `set_installed`) if it
+        differs from the current one.
+        '''
+        installed_plugins = local_registry.list_plugins()
+
+        def rescan(name, pkg):
+            installed = installed_plugins.get(name)
+            current = installed[-1] if installed else None
+            if pkg is None:
+                if current is None:
+                    return None
+                pkg = PackageState(name, compatible=self._compatible)
+            elif (pkg.current and pkg.current.version) == \
+                    (current and current.version):
+                return pkg
+            pkg.current = current
+            return pkg
+        names = set(installed_plugins)
+        names.update(name for name, pkg in self.snapshot().items() if pkg.installed)
+        return self._apply({name: rescan for name in sorted(names)})
+
+    def set_installed(self, name, metadata):
+        '''
+        Record the installation (or removal if `metadata` is `None`) of a package.
+        '''
+        def install(name, pkg):
+            if pkg is None:
+                pkg = PackageState(name, compatible=self._compatible)
+            pkg.current = metadata
+            return pkg
+        return self._apply({name: install})
+
+    def iter_update(self, cancel=None):
+        """
+        Fetch available plugins, merging them as they arrive, and
+        yielding the corresponding diff (see `RegistryDiff`) after
+        each batch.
+
+        When restored from a saved state, installed plugins are scanned
+        first. On success, the new state is saved (see `load`).
+
+        The update can be cancelled with the optional `cancel` token
+        (see `package_index.CancelToken`): the changes merged so far
+        are kept.
+        """
+        if self._rescan:
+            self._rescan = False
+            diff = self._rescan_installed()
+            if diff:
+                yield diff
+        batches = global_registry.iter_plugins(cancel=cancel)
+        available_names = set()
+        while True:
+            try:
+                available_plugins = next(batches, None)
+            except Cancelled:
+                log.info('update of available plugins cancelled')
+                return
+            except:
+                log.error("failed to fetch list of available plugins from PyPI",
+                          exc_info=True)
+                return
+            if available_plugins is None:
+                break
+            available_names.update(available_plugins)
+            diff = self._merge(available_plugins)
+            if diff:
+                yield diff
+        diff = self._prune(available_names)
+        self._revalidate()
+        try:
+            self.save()
+        except OSError:
+            log.warning('failed to save registry state', exc_info=True)
+        if diff:
+            yield diff
+
     def update(self):
+        '''
+        Fetch available plugins, and return the resulting diff.
+        '''
+        diff = RegistryDiff()
+        for batch_diff in self.iter_update():
+            diff.update(batch_diff)
+        return diff
+
+    @property
+    def refreshing(self):
+        task = self._refresh_task
+        return task is not None and not task.done
+
+    def refresh(self, on_diff=None, on_done=None):
+        '''
+        Start updating in the background (see `iter_update`), calling
+        `on_diff(diff)` after each batch, and `on_done()` at the end.
+
+        Overlapping requests are coalesced: if a refresh is already in
+        progress, the listeners are added to it. Return the corresponding
+        `RefreshTask` (which can be used to cancel it).
+        '''
+        with self._lock:
+            task = self._refresh_task
+            start = task is None or task.done
+            if start:
+                task = self._refresh_task = RefreshTask()
+        task.add_listener(on_diff, on_done)
+        if start:
+            Thread(target=self._run_refresh, args=(task,), daemon=True).start()
+        return task
+
+    def _run_refresh(self, task):
         try:
-            available_plugins = global_registry.list_plugins()
-        except:
-            log.error("failed to fetch list of available plugins from PyPI",
-                      exc_info=True)
-            return
-        for name, metadata in available_plugins.items():
-            pkg = self._packages.get(name)
-            if pkg is None:
-                pkg = PackageState(name, available=metadata)
-                self._packages[name] = pkg
-            else:
-                pkg.available = metadata
-                if pkg.current and pkg.current.parsed_version < pkg.latest.parsed_version:
-                    pkg.status = 'outdated'
+            for diff in self.iter_update(cancel=task.cancel_token):
+                task._notify(diff)
+        except Exception:
+            log.error('refreshing plugins failed', exc_info=True)
+        finally:
+            task._finish()
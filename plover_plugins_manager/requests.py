@@ -1,27 +1,34 @@
-import os
-
+from requests import Session
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter
 from requests_futures.sessions import FuturesSession
-from requests_cache import CachedSession
 
+from plover import log
 
+from plover_plugins_manager.http_cache import CachingAdapter, DiskCache
+from plover_plugins_manager.utils import cache_path
 
-class CachedSession(CachedSession):
 
-    def __init__(self):
-        super().__init__(backend='memory',
-                         expire_after=600)
-        try:
-            # requests-cache >= 1.0
-            self.cache.delete(expired=True)
-        except TypeError:
-            # Fallback for requests-cache 0.9.x
-            if hasattr(self.cache, "remove_expired_responses"):
-                self.cache.remove_expired_responses()
+# Cached responses are considered fresh for that many seconds.
+EXPIRE_AFTER = 600
 
 
-class CachedFuturesSession(FuturesSession):
+class CachedSession(Session):
 
-    def __init__(self, session=None):
-        if session is None:
-            session = CachedSession()
-        super().__init__(session=session, max_workers=4)
+    def __init__(self, cache_dir=None, expire_after=None,
+                 max_size=100 * 1024 * 1024, pool_maxsize=DEFAULT_POOLSIZE):
+        super().__init__()
+        if cache_dir is None:
+            cache_dir = cache_path('http')
+        if expire_after is None:
+            expire_after = EXPIRE_AFTER
+        try:
+            self.cache = DiskCache(cache_dir, max_size=max_size)
+        except OSError:
+            log.warning('failed to open HTTP cache, not caching', exc_info=True)
+            self.cache = None
+            adapter = HTTPAdapter(pool_maxsize=pool_maxsize)
+        else:
+            adapter = CachingAdapter(self.cache, expire_after=expire_after,
+                                     pool_maxsize=pool_maxsize)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
@@ -0,0 +1,237 @@
+from packaging.markers import UndefinedComparison, UndefinedEnvironmentName
+from packaging.requirements import InvalidRequirement, Requirement
+from packaging.utils import canonicalize_name
+
+from plover import __version__ as PLOVER_VERSION
+
+from plover_plugins_manager import global_registry, local_registry
+from plover_plugins_manager.plugin_metadata import PluginMetadata
+from plover_plugins_manager.version_index import (
+    VersionIndex,
+    _contains,
+    is_compatible,
+)
+
+
+# Distributions never changed by installing plugins.
+PINNED = {'plover'}
+
+
+def _applies(requirement, extras=()):
+    if requirement.marker is None:
+        return True
+    try:
+        return any(requirement.marker.evaluate({'extra': extra})
+                   for extra in ('',) + tuple(extras))
+    except (UndefinedComparison, UndefinedEnvironmentName):
+        return True
+
+
+def _requirements(metadata, extras=()):
+    for requirement in metadata.requires_dist or ():
+        try:
+            requirement = Requirement(requirement)
+        except InvalidRequirement:
+            continue
+        if _applies(requirement, extras):
+            yield requirement
+
+
+class ResolutionPlan:
+    '''
+    The outcome of a resolution:
+
+    - `install`: the releases to install, `{name: metadata}` (the requested
+      ones, and their missing or outdated dependencies), in resolution order
+    - `conflicts`: messages describing each conflict
+    - `unchecked`: the requirements that could not be checked (e.g. URLs)
+    '''
+
+    def __init__(self):
+        self.install = {}
+        self.conflicts = []
+        self.unchecked = []
+
+    @property
+    def ok(self):
+        return not self.conflicts
+
+    @property
+    def requirements(self):
+        return [metadata.requirement for metadata in self.install.values()]
+
+    def __str__(self):
+        lines = []
+        for metadata in self.install.values():
+            lines.append('install %s' % metadata.requirement)
+        for requirement in self.unchecked:
+            lines.append('unchecked %s' % requirement)
+        for conflict in self.conflicts:
+            lines.append('conflict: %s' % conflict)
+        return '\n'.join(lines)
+
+
+class Resolver:
+    '''
+    Pre-flight check of an installation, without running pip: resolve the
+    requirements against the installed distributions and the dependencies
+    metadata (`Requires-Dist` / `Requires-Python`) from the index.
+
+    `available` is an optional `{name: [metadata]}` mapping of the known
+    releases (e.g. `global_registry.list_plugins()`), other projects are
+    looked up on PyPI (see `global_registry.fetch_versions`). Like pip's
+    `only-if-needed` upgrade strategy, installed distributions satisfying
+    a requirement are kept. There's no backtracking: the newest compatible
+    release matching the constraints known when a project is first
+    encountered is picked, and a later incompatible constraint is reported
+    as a conflict.
+
+    Plans are cached until the available releases or installed
+    distributions change.
+    '''
+
+    def __init__(self, available=None, compatible=is_compatible):
+        self._compatible = compatible
+        self._versions = {
+            canonicalize_name(name): VersionIndex(versions)
+            for name, versions in (available or {}).items()
+        }
+        # Complete metadata of older releases: `{(name, version): metadata}`.
+        self._metadata = {}
+        self._plans = {}
+
+    def _installed(self):
+        installed = {
+            canonicalize_name(metadata.name or key): metadata
+            for key, metadata in local_registry.list_distributions().items()
+        }
+        if 'plover' not in installed:
+            # E.g. frozen distribution.
+            installed['plover'] = PluginMetadata.from_kwargs(
+                name='plover', version=PLOVER_VERSION)
+        return installed
+
+    def _prefetch(self, names):
+        names = [name for name in names if name not in self._versions]
+        if not names:
+            return
+        for name, versions in global_registry.fetch_versions(names).items():
+            self._versions[name] = VersionIndex(versions)
+
+    def _complete(self, name, versions, metadata):
+        # Only the newest release metadata is complete (see `_group_by_name`).
+        if metadata is versions[-1]:
+            return metadata
+        key = (name, metadata.version)
+        if key not in self._metadata:
+            fetched = global_registry.fetch_metadata([(metadata.name, metadata.version)])
+            self._metadata[key] = fetched[(metadata.name, metadata.version)]
+        return self._metadata[key]
+
+    def _select(self, name, specifier):
+        versions = self._versions.get(name) or VersionIndex()
+
+        def compatible(metadata):
+            metadata = self._complete(name, versions, metadata)
+            return metadata is not None and self._compatible(metadata)
+
+        metadata = versions.latest(specifier, compatible=compatible)
+        if metadata is not None:
+            return self._complete(name, versions, metadata), None
+        if versions.latest(specifier) is None:
+            return None, 'no release of %s matches "%s"' % (name, specifier or '*')
+        return None, 'no release of %s matching "%s" is compatible' % (name, specifier or '*')
+
+    @staticmethod
+    def _satisfied(requirement, installed):
+        current = installed.get(canonicalize_name(requirement.name))
+        return current is not None and \
+            _contains(requirement.specifier, current.version)
+
+    def _resolve(self, requirements, installed):
+        plan = ResolutionPlan()
+        # Process the requirements breadth first, so the
+        # projects metadata can be fetched in parallel.
+        pending = []
+        for requirement_string in requirements:
+            try:
+                requirement = Requirement(requirement_string)
+            except InvalidRequirement:
+                plan.unchecked.append(requirement_string)
+                continue
+            if _applies(requirement):
+                pending.append((requirement, None))
+        # `{name: [(specifier, required_by)]}`.
+        constraints = {}
+        while pending:
+            self._prefetch({
+                canonicalize_name(requirement.name)
+                for requirement, parent in pending
+                if not self._satisfied(requirement, installed)
+            })
+            next_pending = []
+            for requirement, parent in pending:
+                name = canonicalize_name(requirement.name)
+                required_by = 'requested' if parent is None else \
+                    'required by %s' % parent.requirement
+                constraints.setdefault(name, []).append(
+                    (requirement.specifier, required_by))
+                selected = plan.install.get(name)
+                if selected is not None:
+                    if not _contains(requirement.specifier, selected.version):
+                        plan.conflicts.append('%s%s (%s) conflicts with %s' % (
+                            requirement.name, requirement.specifier,
+                            required_by, selected.requirement))
+                    elif requirement.extras:
+                        next_pending.extend(
+                            (dependency, selected) for dependency in
+                            _requirements(selected, requirement.extras))
+                    continue
+                if self._satisfied(requirement, installed):
+                    continue
+                current = installed.get(name)
+                if name in PINNED:
+                    plan.conflicts.append('%s%s (%s), but %s is installed' % (
+                        requirement.name, requirement.specifier,
+                        required_by, current and current.version))
+                    continue
+                specifier = requirement.specifier
+                for other_specifier, __ in constraints[name][:-1]:
+                    specifier &= other_specifier
+                metadata, error = self._select(name, specifier)
+                if metadata is None:
+                    plan.conflicts.append('%s (%s)' % (error, required_by))
+                    continue
+                plan.install[name] = metadata
+                next_pending.extend(
+                    (dependency, metadata) for dependency in
+                    _requirements(metadata, requirement.extras))
+            pending = next_pending
+        # Check the installed distributions that are kept still
+        # have their requirements satisfied after the upgrades.
+        for name, current in sorted(installed.items()):
+            if name in plan.install:
+                continue
+            for requirement in _requirements(current):
+                selected = plan.install.get(canonicalize_name(requirement.name))
+                if selected is not None and \
+                   not _contains(requirement.specifier, selected.version):
+                    plan.conflicts.append('%s requires %s, but %s would be installed' % (
+                        current.requirement, requirement, selected.requirement))
+        return plan
+
+    def resolve(self, requirements):
+        '''
+        Return the `ResolutionPlan` for installing `requirements`
+        (a list of requirement strings, e.g. `plover-foo==1.0`).
+        '''
+        installed = self._installed()
+        key = (
+            tuple(sorted(set(requirements))),
+            tuple(sorted((name, metadata.version)
+                         for name, metadata in installed.items())),
+        )
+        plan = self._plans.get(key)
+        if plan is None:
+            plan = self._plans[key] = self._resolve(key[0], installed)
+        return plan
@@ -0,0 +1,147 @@
+from bisect import bisect_left, insort
+from operator import itemgetter
+import re
+
+
+_TOKEN_RX = re.compile(r'[^\W_]+')
+
+# Indexed fields, and their weight when ranking results.
+FIELDS = (
+    ('name', 8),
+    ('keywords', 4),
+    ('summary', 2),
+    ('author', 1),
+)
+
+
+def tokenize(text):
+    if not text:
+        return []
+    if not isinstance(text, str):
+        # E.g. keywords as a list.
+        text = ' '.join(text)
+    return _TOKEN_RX.findall(text.lower())
+
+
+class SearchIndex:
+    '''
+    Inverted index over plugins metadata: each query term matches the
+    indexed tokens it is a prefix of, and results must match all terms.
+    '''
+
+    def __init__(self):
+        # Token -> {weight: names}.
+        self._postings = {}
+        # Name -> {token: weight}.
+        self._documents = {}
+        # Sorted tokens, for prefix lookups.
+        self._tokens = []
+
+    def __len__(self):
+        return len(self._documents)
+
+    def __contains__(self, name):
+        return name in self._documents
+
+    def update(self, name, metadata):
+        '''
+        (Re)index `name`, or remove it if `metadata` is `None`.
+        '''
+        self.remove(name)
+        if metadata is None:
+            return
+        weights = {}
+        for field, weight in FIELDS:
+            for token in tokenize(getattr(metadata, field, None)):
+                weights[token] = max(weights.get(token, 0), weight)
+        for token, weight in weights.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                insort(self._tokens, token)
+            postings.setdefault(weight, set()).add(name)
+        self._documents[name] = weights
+
+    def remove(self, name):
+        for token, weight in self._documents.pop(name, {}).items():
+            postings = self._postings[token]
+            names = postings[weight]
+            names.discard(name)
+            if not names:
+                del postings[weight]
+            if not postings:
+                del self._postings[token]
+                del self._tokens[bisect_left(self._tokens, token)]
+
+    def _prefixed(self, term):
+        start = bisect_left(self._tokens, term)
+        end = bisect_left(self._tokens, term + '\U0010ffff', start)
+        return self._tokens[start:end]
+
+    def matches(self, query):
+        '''
+        Return the set of names matching `query` (unranked, which
+        is cheaper: e.g. for filtering an already sorted list), or
+        `None` if the query is empty (no filtering).
+        '''
+        terms = set(tokenize(query))
+        if not terms:
+            return None
+        names = None
+        for term in terms:
+            term_names = set().union(*(
+                names
+                for token in self._prefixed(term)
+                for names in self._postings[token].values()
+            ))
+            names = term_names if names is None else names & term_names
+            if not names:
+                break
+        return names or set()
+
+    def _match(self, term):
+        groups = []
+        for token in self._prefixed(term):
+            # Favor exact and closer matches.
+            bonus = 2 if token == term else len(term) / len(token)
+            for weight, names in self._postings[token].items():
+                groups.append((weight * bonus, names))
+        # A name's score is its best match: apply the
+        # groups in increasing order of score.
+        groups.sort(key=itemgetter(0))
+        scores = {}
+        for score, names in groups:
+            scores.update(dict.fromkeys(names, score))
+        return scores
+
+    def search(self, query, limit=None):
+        '''
+        Return the names matching `query`, best matches first
+        (all names, in alphabetical order, if the query is empty).
+        '''
+        terms = set(tokenize(query))
+        if not terms:
+            names = sorted(self._documents)
+            if limit is not None:
+                del names[limit:]
+            return names
+        scores = None
+        for term in terms:
+            term_scores = self._match(term)
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {
+                    name: score + term_scores[name]
+                    for name, score in scores.items()
+                    if name in term_scores
+                }
+            if not scores:
+                return []
+        # Note: sorting is stable, so names with the same
+        # score stay in alphabetical order.
+        names = sorted(scores)
+        names.sort(key=scores.__getitem__, reverse=True)
+        if limit is not None:
+            del names[limit:]
+        return names
@@ -0,0 +1,116 @@
+"""
+Compact offline snapshot of the plugins index.
+
+Layout:
+- magic
+- one zlib compressed JSON record per release (trimmed
+  down to the fields needed to build a `PluginMetadata`)
+- zlib compressed JSON index: `{name: [offset, size]}`
+- footer: index offset and size
+
+So a single release can be loaded without parsing the whole file.
+"""
+
+import json
+import os
+import struct
+import zlib
+
+from plover_plugins_manager.plugin_metadata import PluginMetadata
+
+
+MAGIC = b'PPMSNAP1'
+FOOTER = struct.Struct('<QQ')
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def trim_release(release):
+    info = release['info']
+    trimmed = {
+        'info': {field: info.get(field) for field in PluginMetadata._fields},
+        'last_serial': release.get('last_serial'),
+    }
+    if 'versions' in release:
+        trimmed['versions'] = release['versions']
+    return trimmed
+
+
+def _pack(data):
+    return zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'), 9)
+
+
+def _unpack(data):
+    return json.loads(zlib.decompress(data).decode('utf-8'))
+
+
+def write_snapshot(path, releases):
+    index = {}
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fp:
+        fp.write(MAGIC)
+        for release in sorted(releases, key=lambda r: r['info']['name'].lower()):
+            record = _pack(trim_release(release))
+            index[release['info']['name']] = (fp.tell(), len(record))
+            fp.write(record)
+        index_offset = fp.tell()
+        record = _pack(index)
+        fp.write(record)
+        fp.write(FOOTER.pack(index_offset, len(record)))
+    os.replace(tmp_path, path)
+
+
+class Snapshot:
+
+    def __init__(self, path):
+        self.path = path
+        self._fp = open(path, 'rb')
+        try:
+            if self._fp.read(len(MAGIC)) != MAGIC:
+                raise SnapshotError('invalid snapshot: %s' % path)
+            self._fp.seek(-FOOTER.size, os.SEEK_END)
+            index_offset, index_size = FOOTER.unpack(self._fp.read(FOOTER.size))
+            self._index = {
+                name.lower(): location
+                for name, location in self._read(index_offset, index_size).items()
+            }
+        except (OSError, ValueError, zlib.error, struct.error) as exc:
+            self._fp.close()
+            raise SnapshotError('invalid snapshot: %s' % path) from exc
+        except:
+            self._fp.close()
+            raise
+
+    def _read(self, offset, size):
+        self._fp.seek(offset)
+        return _unpack(self._fp.read(size))
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, name):
+        return name.lower() in self._index
+
+    def __iter__(self):
+        for offset, size in self._index.values():
+            yield self._read(offset, size)
+
+    def names(self):
+        return self._index.keys()
+
+    def load(self, name):
+        location = self._index.get(name.lower())
+        if location is None:
+            return None
+        return self._read(*location)
+
+    def close(self):
+        self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,223 @@
+'''
+Transactional batches of pip commands: the distributions a batch may
+change are backed up first (the files listed in their `RECORD`, hardlinked
+when possible, or a cached wheel, see `Wheelhouse.cached_wheel`), and if a
+command fails, the changes made by the whole batch are reverted from that
+snapshot, without network access.
+'''
+
+import os
+import shutil
+import tempfile
+
+from packaging.requirements import InvalidRequirement, Requirement
+from packaging.utils import (
+    InvalidWheelFilename,
+    canonicalize_name,
+    parse_wheel_filename,
+)
+from requests import RequestException
+
+from plover import log
+
+from plover_plugins_manager import local_registry
+from plover_plugins_manager.resolver import Resolver
+from plover_plugins_manager.uninstall import uninstall
+from plover_plugins_manager.wheelhouse import Wheelhouse
+
+
+def _installed():
+    local_registry.invalidate_cache()
+    distributions = local_registry.list_distributions()
+    return {
+        canonicalize_name(key): (location, distributions[key])
+        for key, location in local_registry.locate_distributions().items()
+        if key in distributions
+    }
+
+
+def _requested(args):
+    # Return the command, and the requested
+    # distributions of a step's arguments.
+    commands = [arg for arg in args if arg in ('install', 'uninstall')]
+    if not commands:
+        return None, []
+    command = commands[0]
+    requested = [arg for arg in args[args.index(command) + 1:]
+                 if not arg.startswith('-')]
+    return command, requested
+
+
+def _name(requirement):
+    if requirement.endswith('.whl'):
+        try:
+            return parse_wheel_filename(os.path.basename(requirement))[0]
+        except InvalidWheelFilename:
+            return None
+    try:
+        return canonicalize_name(Requirement(requirement).name)
+    except InvalidRequirement:
+        return None
+
+
+def affected(steps):
+    '''
+    Return the names of the distributions that running `steps`
+    (`pip_wrapper` arguments of each command) may change: the
+    requested ones, and the dependencies that would be installed
+    or upgraded (as far as the `Resolver` can tell).
+    '''
+    names = set()
+    for args in steps:
+        command, requested = _requested(args)
+        names.update(filter(None, map(_name, requested)))
+        if command != 'install':
+            continue
+        try:
+            plan = Resolver().resolve(requested)
+        except (RequestException, ValueError):
+            log.warning('dependencies resolution failed', exc_info=True)
+            continue
+        names.update(plan.install)
+    return names
+
+
+def _link(src, dst):
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        # E.g. different filesystem.
+        shutil.copy2(src, dst)
+
+
+class Snapshot:
+    '''
+    Backup of installed distributions, in `directory`.
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        # `{name: [(path, backup)]}`.
+        self._files = {}
+        # `{name: wheel}`.
+        self._wheels = {}
+
+    def __contains__(self, name):
+        return name in self._files or name in self._wheels
+
+    def add(self, name, location, metadata):
+        '''
+        Back up a distribution, return `False` if that's not possible.
+        '''
+        paths = local_registry.read_record(location)
+        if paths is not None:
+            backup_dir = os.path.join(self.directory, str(len(self._files)))
+            files = []
+            for n, path in enumerate(paths):
+                if not os.path.isfile(path):
+                    continue
+                backup = os.path.join(backup_dir, str(n))
+                _link(path, backup)
+                files.append((path, backup))
+            self._files[name] = files
+            return True
+        wheel = Wheelhouse().cached_wheel(metadata.name, metadata.version)
+        if wheel is not None:
+            self._wheels[name] = wheel
+            return True
+        return False
+
+    def restore(self, name):
+        '''
+        Restore the files of a distribution, return the wheel to
+        install instead if it was backed up as a cached wheel.
+        '''
+        if name in self._wheels:
+            return self._wheels[name]
+        for path, backup in self._files[name]:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            _link(backup, path)
+        return None
+
+
+def _rollback(transaction, before, snapshot, run, progress):
+    after = _installed()
+    to_remove = []
+    to_restore = []
+    failed = []
+    for name in sorted(set(before) | set(after)):
+        old, new = before.get(name), after.get(name)
+        if old is not None and new is not None and \
+           (old[0], old[1].version) == (new[0], new[1].version):
+            continue
+        if old is not None and name not in snapshot:
+            # Can't be restored: don't remove the new version.
+            if new is not None:
+                progress('warning: keeping %s, as %s cannot be restored' % (
+                    new[1].requirement, old[1].requirement))
+            failed.append(old[1].requirement)
+            continue
+        if new is not None:
+            to_remove.append((name, new))
+        if old is not None:
+            to_restore.append((name, old))
+    for name, (location, metadata) in to_remove:
+        progress('removing %s' % metadata.requirement)
+    legacy = uninstall([metadata.name for name, (location, metadata) in to_remove],
+                       progress=None)
+    if legacy:
+        # Note: pip does not need network access for this.
+        if run(transaction['uninstall'] + legacy):
+            failed.extend(legacy)
+    wheels = []
+    for name, (location, metadata) in to_restore:
+        progress('restoring %s' % metadata.requirement)
+        wheel = snapshot.restore(name)
+        if wheel is not None:
+            wheels.append(wheel)
+    if wheels and run(transaction['install'] + wheels):
+        failed.extend(wheels)
+    local_registry.invalidate_cache()
+    if failed:
+        progress('rollback incomplete, could not restore: %s' % ', '.join(failed))
+    else:
+        progress('rollback done')
+
+
+def run_transaction(transaction, run, progress=print):
+    '''
+    Run a batch of pip commands as a transaction. `transaction` is a
+    dictionary with:
+
+    - `steps`: the `pip_wrapper` arguments of each command
+    - `install` / `uninstall`: the `pip_wrapper` arguments to use
+      for restoring cached wheels / removing legacy distributions
+      on rollback
+
+    `run` is used to run each command, and must return its exit code.
+    Return the exit code of the failed command (`0` on success).
+    '''
+    before = _installed()
+    directory = tempfile.mkdtemp(prefix='plover_plugins_transaction')
+    try:
+        snapshot = Snapshot(directory)
+        for name in sorted(affected(transaction['steps'])):
+            if name not in before:
+                continue
+            location, metadata = before[name]
+            if not snapshot.add(name, location, metadata):
+                progress('warning: %s cannot be restored on failure'
+                         % metadata.requirement)
+        for args in transaction['steps']:
+            code = run(args)
+            if code:
+                progress('command failed, rolling back all changes')
+                _rollback(transaction, before, snapshot, run, progress)
+                return code
+        return 0
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,242 @@
+'''
+Native uninstall of distributions, using their `RECORD` manifest: much
+faster than starting pip. Eggs and legacy (`.egg-info`) installs,
+distributions outside the user site (or the virtualenv when running in
+one), or with files that cannot be removed, are left to pip.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import os
+import shutil
+import site
+import sys
+import sysconfig
+import tempfile
+
+from packaging.utils import canonicalize_name
+
+from plover import log
+
+from plover_plugins_manager import local_registry
+from plover_plugins_manager.utils import running_under_virtualenv
+
+
+# Maximum number of files deleted in parallel.
+CONCURRENCY = 8
+
+
+def _roots():
+    # Return the `(site_dir, base_dir)` pairs of the installation schemes
+    # plugins are installed to: files must be located under `base_dir`
+    # (e.g. scripts are installed to `base_dir/bin`).
+    if running_under_virtualenv():
+        return [
+            (sysconfig.get_path(name), sys.prefix)
+            for name in ('purelib', 'platlib')
+        ]
+    return [(site.USER_SITE, site.USER_BASE)]
+
+
+def _inside(path, directory):
+    try:
+        return os.path.commonpath([path, directory]) == directory
+    except ValueError:
+        # E.g. different drives.
+        return False
+
+
+def _validated(location, roots):
+    # Return the files to remove, and the site / base directories,
+    # or `None` if the distribution must be left to pip.
+    paths = local_registry.read_record(location)
+    if paths is None:
+        return None
+    location = os.path.normpath(os.path.abspath(location))
+    for site_dir, base_dir in roots:
+        site_dir = os.path.normpath(os.path.abspath(site_dir))
+        base_dir = os.path.normpath(os.path.abspath(base_dir))
+        if os.path.dirname(location) == site_dir:
+            break
+    else:
+        return None
+    for path in paths:
+        if path == base_dir or not _inside(path, base_dir):
+            log.warning('%s: invalid path in RECORD: %s', location, path)
+            return None
+    return paths, site_dir, base_dir
+
+
+def _with_compiled(path):
+    directory, filename = os.path.split(path)
+    # Note: compiled files are not listed.
+    compiled = glob.glob(os.path.join(glob.escape(directory), '__pycache__',
+                                      glob.escape(filename[:-3]) + '.*.pyc')) \
+        if filename.endswith('.py') else []
+    return [path] + compiled
+
+
+def _move(move):
+    key, src, dst = move
+    try:
+        shutil.move(src, dst)
+    except FileNotFoundError:
+        return None
+    except OSError as exc:
+        return exc
+    return move
+
+
+def stash_files(files, stash_dir):
+    '''
+    Move `files`, `(key, path)` pairs, to `stash_dir` (in parallel).
+    Return the moves done (`(key, path, stashed)` tuples), and the
+    errors (`{key: (path, exception)}`).
+    '''
+    moves = [
+        (key, path, os.path.join(stash_dir, str(n)))
+        for n, (key, path) in enumerate(
+            (key, path)
+            for key, path in files
+            for path in _with_compiled(path)
+        )
+    ]
+    if len(moves) > 1:
+        with ThreadPoolExecutor(min(CONCURRENCY, len(moves))) as executor:
+            results = list(executor.map(_move, moves))
+    else:
+        results = list(map(_move, moves))
+    done = []
+    errors = {}
+    for (key, path, stashed), result in zip(moves, results):
+        if isinstance(result, OSError):
+            errors.setdefault(key, (path, result))
+        elif result is not None:
+            done.append(result)
+    return done, errors
+
+
+def unstash_files(moves):
+    '''
+    Move stashed files back (see `stash_files`), return `False`
+    if some could not be restored.
+    '''
+    restored = True
+    for key, path, stashed in moves:
+        try:
+            shutil.move(stashed, path)
+        except OSError:
+            log.error('failed to restore %s', path, exc_info=True)
+            restored = False
+    return restored
+
+
+def prune_directories(paths, root, keep=None):
+    '''
+    Prune the directories of `paths` left empty, up to `root`
+    (never removed, like `keep` and its parent directories).
+    '''
+    directories = {os.path.dirname(path) for path in paths}
+    for directory in sorted(directories, key=len, reverse=True):
+        try:
+            os.rmdir(os.path.join(directory, '__pycache__'))
+        except OSError:
+            pass
+        while directory != root and _inside(directory, root) and \
+                (keep is None or not _inside(keep, directory)):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+
+
+def uninstall(names, progress=print):
+    '''
+    Uninstall the distributions `names`, return the
+    ones that must be uninstalled with pip instead.
+    '''
+    locations = {
+        canonicalize_name(key): location
+        for key, location in local_registry.locate_distributions().items()
+    }
+    roots = _roots()
+    fallback = []
+    # `{(base_dir, site_dir): [(name, location, paths)]}`,
+    # so files are removed in bulk.
+    to_remove = {}
+    for name in names:
+        location = locations.get(canonicalize_name(name))
+        if location is None:
+            if progress is not None:
+                progress('skipping %s, as it is not installed' % name)
+            continue
+        validated = _validated(location, roots)
+        if validated is None:
+            fallback.append(name)
+            continue
+        paths, site_dir, base_dir = validated
+        to_remove.setdefault((base_dir, site_dir), []).append((name, location, paths))
+    removed = []
+    for (base_dir, site_dir), distributions in to_remove.items():
+        # Like pip: files are first moved to a stash directory, so
+        # a distribution can be restored if one of them can't be
+        # removed (e.g. a library in use on Windows).
+        try:
+            stash_dir = tempfile.mkdtemp(prefix='.plover_plugins_uninstall', dir=site_dir)
+        except OSError as exc:
+            log.warning('failed to create stash directory in %s: %s', site_dir, exc)
+            fallback.extend(name for name, location, paths in distributions)
+            continue
+        done, errors = stash_files([
+            (n, path)
+            for n, (name, location, paths) in enumerate(distributions)
+            for path in paths
+        ], stash_dir)
+        if unstash_files([move for move in done if move[0] in errors]):
+            shutil.rmtree(stash_dir, ignore_errors=True)
+        else:
+            log.error('some files could not be restored, see: %s', stash_dir)
+        for n, (name, location, paths) in enumerate(distributions):
+            if n in errors:
+                path, exc = errors[n]
+                log.warning('failed to remove %s, leaving %s to pip: %s',
+                            path, name, exc)
+                fallback.append(name)
+            else:
+                removed.append((location, paths, base_dir, site_dir))
+    for location, paths, base_dir, site_dir in removed:
+        prune_directories(paths, base_dir, keep=site_dir)
+        # Make sure the distribution is gone, even
+        # if some files were missing from `RECORD`.
+        shutil.rmtree(location, ignore_errors=True)
+        if progress is not None:
+            progress('uninstalled %s (%u files)' % (
+                os.path.basename(location), len(paths)))
+    local_registry.invalidate_cache()
+    return fallback
+
+
+def uninstall_args(args, progress=print):
+    '''
+    Natively uninstall the distributions of pip's `uninstall`
+    arguments (see `uninstall`), and return the arguments for
+    uninstalling the rest with pip, or `None` if nothing is left.
+
+    Only done if confirmation is disabled (`-y`), and
+    no other options are used (e.g. `--requirement`).
+    '''
+    commands = [arg for arg in args if not arg.startswith('-')]
+    if commands[:1] != ['uninstall']:
+        return args
+    index = args.index('uninstall') + 1
+    options = [arg for arg in args[index:] if arg.startswith('-')]
+    if not options or not set(options) <= {'-y', '--yes'}:
+        return args
+    names = [arg for arg in args[index:] if not arg.startswith('-')]
+    if not names:
+        return args
+    fallback = uninstall(names, progress=progress)
+    if not fallback:
+        return None
+    return args[:index] + options + fallback
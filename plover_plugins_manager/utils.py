@@ -1,5 +1,9 @@
+import json
+import os
 import sys
+import tempfile
 
+import appdirs
 from pygments.formatters import HtmlFormatter
 import readme_renderer.markdown
 import readme_renderer.rst
@@ -21,6 +25,10 @@ _CSS = '\n'.join((
     '</style>',
 ))
 
+CACHE_DIR = os.environ.get('PLOVER_PLUGINS_CACHE_DIR',
+                           appdirs.user_cache_dir('plover_plugins_manager',
+                                                  appauthor=False))
+
 
 def description_to_html(content, content_type):
     renderer = _RENDERERS.get(content_type, readme_renderer.rst)
@@ -38,3 +46,30 @@ def running_under_virtualenv():
         # virtualenv
         return True
     return False
+
+
+def cache_path(*parts):
+    return os.path.join(CACHE_DIR, *parts)
+
+
+def load_json(path, default=None):
+    try:
+        with open(path, encoding='utf-8') as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return default
+
+
+def save_json(path, data):
+    # Atomically replace the file, so concurrent
+    # readers never see a partially written file.
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as fp:
+            json.dump(data, fp)
+        os.replace(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
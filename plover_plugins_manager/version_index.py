@@ -0,0 +1,134 @@
+from bisect import bisect_left, bisect_right
+import platform
+
+from packaging.requirements import InvalidRequirement, Requirement
+from packaging.specifiers import InvalidSpecifier, SpecifierSet
+from packaging.utils import canonicalize_name
+from packaging.version import InvalidVersion
+
+from plover import __version__ as PLOVER_VERSION
+
+from plover_plugins_manager.plugin_metadata import _parse_version
+
+
+PYTHON_VERSION = platform.python_version()
+
+
+def _parse_specifier(specifier):
+    if isinstance(specifier, SpecifierSet):
+        return specifier
+    try:
+        return SpecifierSet(specifier or '')
+    except InvalidSpecifier:
+        return None
+
+
+def _contains(specifier, version):
+    try:
+        return specifier.contains(version, prereleases=True)
+    except InvalidVersion:
+        return False
+
+
+def is_compatible(metadata, python_version=PYTHON_VERSION,
+                  plover_version=PLOVER_VERSION):
+    '''
+    Check if a release is compatible with a Python and Plover version,
+    according to its metadata (`requires_python` and the `plover`
+    requirement in `requires_dist`). Unknown or invalid requirements
+    are assumed to be satisfied.
+    '''
+    specifier = _parse_specifier(metadata.requires_python)
+    if specifier is not None and not _contains(specifier, python_version):
+        return False
+    for requirement in metadata.requires_dist or ():
+        try:
+            requirement = Requirement(requirement)
+        except InvalidRequirement:
+            continue
+        if canonicalize_name(requirement.name) != 'plover':
+            continue
+        if requirement.marker is not None and \
+           not requirement.marker.evaluate({'extra': ''}):
+            continue
+        if not _contains(requirement.specifier, plover_version):
+            return False
+    return True
+
+
+class VersionIndex:
+    '''
+    The available versions of a package, sorted from oldest to newest.
+    '''
+
+    def __init__(self, versions=()):
+        self._versions = sorted(versions)
+        self._keys = [metadata.parsed_version for metadata in self._versions]
+
+    def __len__(self):
+        return len(self._versions)
+
+    def __iter__(self):
+        return iter(self._versions)
+
+    def __reversed__(self):
+        return reversed(self._versions)
+
+    def __getitem__(self, index):
+        return self._versions[index]
+
+    def add(self, metadata):
+        index = bisect_right(self._keys, metadata.parsed_version)
+        self._keys.insert(index, metadata.parsed_version)
+        self._versions.insert(index, metadata)
+
+    def find(self, version):
+        '''
+        Return the release for a specific version (or `None`).
+        '''
+        if isinstance(version, str):
+            version = _parse_version(version)
+        index = bisect_left(self._keys, version)
+        if index < len(self._keys) and self._keys[index] == version:
+            return self._versions[index]
+        return None
+
+    def newer_than(self, metadata):
+        '''
+        Return the releases newer than `metadata` (oldest first).
+        '''
+        return self._versions[bisect_right(self._keys, metadata.parsed_version):]
+
+    def latest(self, specifier=None, compatible=None):
+        '''
+        Return the newest release matching `specifier` (a version specifier,
+        e.g. `>=1.0,<2`) and the optional `compatible(metadata)` predicate.
+        '''
+        end = len(self._keys)
+        if specifier is not None:
+            specifier = _parse_specifier(specifier)
+            if specifier is None:
+                return None
+            # Skip newer versions excluded by an upper bound.
+            for spec in specifier:
+                if spec.operator in ('<', '<=', '==') and '*' not in spec.version:
+                    bound = _parse_version(spec.version)
+                    if spec.operator == '<':
+                        end = min(end, bisect_left(self._keys, bound))
+                    else:
+                        end = min(end, bisect_right(self._keys, bound))
+        for index in range(end - 1, -1, -1):
+            metadata = self._versions[index]
+            if specifier is not None and \
+               not _contains(specifier, str(metadata.version)):
+                continue
+            if compatible is not None and not compatible(metadata):
+                continue
+            return metadata
+        return None
+
+    def latest_compatible(self, python_version=PYTHON_VERSION,
+                          plover_version=PLOVER_VERSION):
+        return self.latest(compatible=lambda metadata: is_compatible(
+            metadata, python_version=python_version,
+            plover_version=plover_version))
@@ -0,0 +1,413 @@
+from hashlib import sha256
+from urllib.parse import urlsplit, urlunsplit
+import asyncio
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from packaging.requirements import InvalidRequirement, Requirement
+from packaging.tags import sys_tags
+from packaging.utils import InvalidWheelFilename, canonicalize_name, parse_wheel_filename
+from packaging.version import InvalidVersion, Version
+from requests import RequestException, Session
+
+from plover import log
+
+from plover_plugins_manager import local_registry
+from plover_plugins_manager.package_index import CONCURRENCY, Fetcher, fetch_files
+from plover_plugins_manager.resolver import Resolver
+from plover_plugins_manager.utils import cache_path, load_json, save_json
+
+
+# Where downloaded distributions are kept (defaults to the user cache,
+# can be shared: e.g. a network directory used by several machines).
+WHEELHOUSE_DIR = None
+
+
+# Source distributions that can be built into a (cached) wheel.
+SDIST_EXTENSIONS = ('.tar.gz', '.tar.bz2', '.zip')
+
+
+class WheelhouseError(Exception):
+    pass
+
+
+def _wheel_rank(filename, tags):
+    try:
+        __, __, __, wheel_tags = parse_wheel_filename(filename)
+    except InvalidWheelFilename:
+        return None
+    ranks = [tags[tag] for tag in wheel_tags if tag in tags]
+    return min(ranks) if ranks else None
+
+
+def select_file(files, tags=None):
+    '''
+    Select the best distribution for the running interpreter: the most
+    specific compatible wheel, or the source distribution (`None` if
+    neither are available).
+    '''
+    if tags is None:
+        tags = {tag: rank for rank, tag in enumerate(sys_tags())}
+    best, best_rank = None, None
+    sdist = None
+    for f in files:
+        if not f['sha256']:
+            # Can't be checked.
+            continue
+        if f['filename'].endswith('.whl'):
+            rank = _wheel_rank(f['filename'], tags)
+            if rank is not None and (best_rank is None or rank < best_rank):
+                best, best_rank = f, rank
+        elif f.get('packagetype') == 'sdist':
+            sdist = f
+    return best or sdist
+
+
+class Wheelhouse:
+    '''
+    Content-addressed cache of downloaded distributions: files are
+    stored by their SHA-256 (as listed by the index, and checked on
+    download), and the list of files of each release is kept in a
+    manifest, so cached releases can be staged without network access.
+    '''
+
+    def __init__(self, directory=None, pypi_url=None):
+        if directory is None:
+            directory = os.environ.get('WHEELHOUSE_DIR', WHEELHOUSE_DIR)
+        if directory is None:
+            directory = cache_path('wheelhouse')
+        self.directory = directory
+        self.pypi_url = pypi_url
+        self._manifest_path = os.path.join(directory, 'manifest.json')
+
+    def path(self, f):
+        digest = f['sha256']
+        return os.path.join(self.directory, 'sha256',
+                            digest[:2], digest, f['filename'])
+
+    def _key(self, name, version):
+        return '%s==%s' % (canonicalize_name(name), version)
+
+    def files(self, versions):
+        '''
+        Return the files of each release: `{(name, version): files}`
+        (`None` for unknown releases), from the manifest if possible.
+        '''
+        manifest = load_json(self._manifest_path, {})
+        files = {}
+        missing = []
+        for name, version in versions:
+            release_files = manifest.get(self._key(name, version))
+            if release_files is None:
+                missing.append((name, version))
+            else:
+                files[(name, version)] = release_files
+        if missing:
+            fetched = fetch_files(missing, pypi_url=self.pypi_url)
+            files.update(fetched)
+            # Note: reload before updating, as the manifest may be shared.
+            manifest = load_json(self._manifest_path, {})
+            for (name, version), release_files in fetched.items():
+                if release_files is not None:
+                    manifest[self._key(name, version)] = release_files
+            save_json(self._manifest_path, manifest)
+        return files
+
+    def cached_wheel(self, name, version):
+        '''
+        Return the path to a cached wheel of `name==version` compatible
+        with the running interpreter, or `None` (no network access).
+        '''
+        files = load_json(self._manifest_path, {}).get(self._key(name, version))
+        if not files:
+            return None
+        files = [f for f in files
+                 if f['filename'].endswith('.whl') and f['sha256'] and
+                 os.path.exists(self.path(f))]
+        f = select_file(files)
+        return None if f is None else self.path(f)
+
+    def _store(self, f, content):
+        digest = sha256(content).hexdigest()
+        if digest != f['sha256']:
+            raise WheelhouseError('hash mismatch for %s: expected %s, got %s' % (
+                f['filename'], f['sha256'], digest))
+        path = self.path(f)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(content)
+            os.replace(tmp_path, path)
+        except:
+            os.unlink(tmp_path)
+            raise
+        return path
+
+    def download(self, files, concurrency=None, progress=None):
+        '''
+        Make sure all `files` are in the cache, downloading the missing
+        ones in parallel. Return the number of files downloaded.
+        '''
+        if concurrency is None:
+            concurrency = int(os.environ.get('PYPI_CONCURRENCY', CONCURRENCY))
+        to_download = [f for f in files if not os.path.exists(self.path(f))]
+        if not to_download:
+            return 0
+
+        async def download(fetcher, f):
+            resp = await fetcher.get(f['url'])
+            resp.raise_for_status()
+            self._store(f, resp.content)
+            if progress is not None:
+                progress('downloaded %s (%u bytes)' % (f['filename'], len(resp.content)))
+
+        async def download_all(fetcher):
+            await asyncio.gather(*[download(fetcher, f) for f in to_download])
+
+        # Note: not using the HTTP cache, the wheelhouse is the cache.
+        with Fetcher(min(concurrency, len(to_download)),
+                     session=Session()) as fetcher:
+            fetcher.run(download_all(fetcher))
+        return len(to_download)
+
+    def _built_directory(self, identity):
+        # Note: builds are specific to the interpreter.
+        interpreter = next(iter(sys_tags()))
+        key = sha256(('%s\n%s' % (identity, interpreter)).encode()).hexdigest()
+        return os.path.join(self.directory, 'built', key[:2], key)
+
+    def built_wheel(self, identity):
+        '''
+        Return the path to the cached wheel built from the
+        source `identity` (see `source_identity`), or `None`.
+        '''
+        directory = self._built_directory(identity)
+        try:
+            wheels = [f for f in os.listdir(directory) if f.endswith('.whl')]
+        except FileNotFoundError:
+            return None
+        return os.path.join(directory, wheels[0]) if wheels else None
+
+    def build(self, requirement, progress=None):
+        '''
+        Return the path to a wheel of `requirement` if it must be built
+        (Git repository or source distribution, `None` otherwise): from
+        the cache when that exact source was already built, or built
+        with `pip wheel` and cached.
+        '''
+        source = source_identity(requirement)
+        if source is None:
+            return None
+        identity, build_requirement = source
+        wheel = self.built_wheel(identity)
+        if wheel is not None:
+            if progress is not None:
+                progress('using cached build of %s: %s' % (
+                    requirement, os.path.basename(wheel)))
+            return wheel
+        directory = self._built_directory(identity)
+        os.makedirs(os.path.dirname(directory), exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(directory), prefix='.tmp')
+        try:
+            if progress is not None:
+                progress('building %s' % build_requirement)
+            subprocess.check_call([sys.executable, '-m', 'pip', 'wheel',
+                                   '--disable-pip-version-check', '--no-deps',
+                                   '--wheel-dir', tmp_dir, build_requirement])
+            wheels = [f for f in os.listdir(tmp_dir) if f.endswith('.whl')]
+            if len(wheels) != 1:
+                raise WheelhouseError('building %s produced %u wheels' % (
+                    requirement, len(wheels)))
+            try:
+                os.replace(tmp_dir, directory)
+            except OSError:
+                # Built concurrently: use the existing one.
+                pass
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return self.built_wheel(identity)
+
+    def stage(self, versions, directory, progress=None):
+        '''
+        Stage the distributions of `versions` (a list of `(name, version)`
+        tuples) into `directory` (downloading them if needed), for use
+        with pip's `--find-links`. Return `True` if all the releases could
+        be staged as wheels (so pip does not need the index).
+        '''
+        selected = []
+        complete = True
+        for (name, version), files in sorted(self.files(versions).items()):
+            f = None if files is None else select_file(files)
+            if f is None:
+                log.warning('no distribution available for %s==%s', name, version)
+                complete = False
+                continue
+            if not f['filename'].endswith('.whl'):
+                complete = False
+            selected.append(f)
+        self.download(selected, progress=progress)
+        for f in selected:
+            src = self.path(f)
+            dst = os.path.join(directory, f['filename'])
+            try:
+                os.link(src, dst)
+            except OSError:
+                # E.g. different filesystem.
+                shutil.copyfile(src, dst)
+        return complete
+
+
+def _split_git_url(requirement):
+    # `git+URL[@REF][#FRAGMENT]`, note: the netloc
+    # can contain a `@` too (e.g. `ssh://git@host/`).
+    url, __, fragment = requirement[4:].partition('#')
+    scheme, netloc, path, query, __ = urlsplit(url)
+    ref = None
+    if '@' in path:
+        path, ref = path.rsplit('@', 1)
+    return urlunsplit((scheme, netloc, path, query, '')), ref, fragment
+
+
+def _git_commit(url, ref=None):
+    if ref is not None and re.fullmatch('[0-9a-f]{40}', ref):
+        return ref
+    # Note: never prompt for credentials.
+    env = dict(os.environ, GIT_TERMINAL_PROMPT='0')
+    ref = ref or 'HEAD'
+    # Note: also ask for the commit of annotated tags.
+    output = subprocess.run(['git', 'ls-remote', url, ref, ref + '^{}'],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            universal_newlines=True, check=True,
+                            timeout=60, env=env).stdout
+    refs = [line.split('\t', 1) for line in output.splitlines() if '\t' in line]
+    if not refs:
+        raise ValueError('unknown git reference: %s@%s' % (url, ref))
+    peeled = [commit for commit, name in refs if name.endswith('^{}')]
+    return (peeled or [refs[0][0]])[0]
+
+
+def source_identity(requirement):
+    '''
+    Identify the source of a requirement that must be built: a Git
+    repository (`git+URL[@REF]`, resolved to a commit) or a local source
+    distribution (hashed). Return `(identity, build_requirement)`, with
+    the requirement to use for building that exact source, or `None`.
+    '''
+    if requirement.startswith('git+'):
+        url, ref, fragment = _split_git_url(requirement)
+        commit = _git_commit(url, ref)
+        build_requirement = 'git+%s@%s' % (url, commit)
+        if fragment:
+            build_requirement += '#' + fragment
+        return 'git:%s@%s' % (url, commit), build_requirement
+    if requirement.endswith(SDIST_EXTENSIONS) and os.path.isfile(requirement):
+        digest = sha256()
+        with open(requirement, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(1 << 16), b''):
+                digest.update(chunk)
+        return 'sdist:%s' % digest.hexdigest(), requirement
+    return None
+
+
+def _pinned(requirement):
+    try:
+        requirement = Requirement(requirement)
+    except InvalidRequirement:
+        return None
+    specifiers = list(requirement.specifier)
+    if len(specifiers) != 1 or specifiers[0].operator != '==' or \
+       '*' in specifiers[0].version:
+        return None
+    return requirement.name, specifiers[0].version
+
+
+def _installed_version(wheel):
+    # Return whether the version of `wheel` is already installed: pip
+    # then ignores the wheel, unlike a Git repository or source
+    # distribution (always reinstalled, e.g. for a new commit).
+    name, version, __, __ = parse_wheel_filename(os.path.basename(wheel))
+    for key, metadata in local_registry.list_distributions().items():
+        if canonicalize_name(key) != name:
+            continue
+        try:
+            return Version(metadata.version) == version
+        except InvalidVersion:
+            return False
+    return False
+
+
+def install_args(args, directory, progress=print):
+    '''
+    Update pip's `install` arguments to use a local wheelhouse:
+
+    - Git repositories and source distributions are replaced by
+      the corresponding wheel from the cache of built wheels
+      (see `Wheelhouse.build`), unless the same version is
+      already installed (so it's still reinstalled)
+    - the other requested distributions (which must all be pinned, e.g.
+      `foo==1.0`) and their missing dependencies are staged in `directory`;
+      when everything is available as a wheel, the index is not used at all
+
+    On errors, the original arguments are returned.
+    '''
+    if 'install' not in args:
+        return args
+    index = args.index('install') + 1
+    wheelhouse = Wheelhouse()
+    args = list(args)
+    built = set()
+    for n, arg in enumerate(args[index:], index):
+        if arg.startswith('-'):
+            continue
+        try:
+            wheel = wheelhouse.build(arg, progress=progress)
+        except (OSError, ValueError, subprocess.SubprocessError, WheelhouseError) as exc:
+            log.warning('building %s failed', arg, exc_info=True)
+            progress('building %s failed: %s' % (arg, exc))
+            wheel = None
+        if wheel is not None and _installed_version(wheel):
+            progress('same version already installed, not using %s'
+                     % os.path.basename(wheel))
+            wheel = None
+        if wheel is not None:
+            args[n] = wheel
+            built.add(wheel)
+    requirements = [arg for arg in args[index:]
+                    if not arg.startswith('-') and arg not in built]
+    pinned = [_pinned(requirement) for requirement in requirements]
+    if not pinned or None in pinned:
+        return args
+    try:
+        plan = Resolver().resolve(requirements)
+        if plan.unchecked:
+            return args
+        # Note: the dependencies of built wheels are not known.
+        no_index = plan.ok and not built
+        versions = [
+            (metadata.name, metadata.version)
+            for metadata in plan.install.values()
+        ]
+    except (RequestException, ValueError):
+        log.warning('dependencies resolution failed', exc_info=True)
+        # Only stage the requested distributions.
+        no_index = False
+        versions = pinned
+    if not versions:
+        return args
+    progress('staging %u distributions' % len(versions))
+    try:
+        complete = wheelhouse.stage(versions, directory, progress=progress)
+    except (RequestException, OSError, ValueError, WheelhouseError) as exc:
+        log.warning('staging failed', exc_info=True)
+        progress('staging failed: %s' % exc)
+        return args
+    options = ['--find-links', directory]
+    if no_index and complete:
+        options.insert(0, '--no-index')
+    return args[:index] + options + args[index:]
@@ -0,0 +1,57 @@
+"""
+Compare the asyncio package index fetcher against the
+previous 4 workers thread pool implementation.
+
+Usage: python -m test.benchmarks.bench_index [PLUGINS [LATENCY]]
+"""
+
+from concurrent.futures import as_completed
+import sys
+import tempfile
+import time
+
+from requests_futures.sessions import FuturesSession
+
+from plover_plugins_manager import utils
+from plover_plugins_manager.package_index import FetchStats, find_plover_plugins_releases
+from plover_plugins_manager.requests import CachedSession
+
+from ..stub_pypi import StubPyPI, make_release
+
+
+def legacy_find_releases(pypi_url, registry_url, cache_dir):
+    session = FuturesSession(session=CachedSession(cache_dir), max_workers=4)
+    in_progress = set()
+    all_releases = []
+    with session:
+        for name in session.get(registry_url).result().json():
+            in_progress.add(session.get('%s/%s/json' % (pypi_url, name)))
+        while in_progress:
+            for future in as_completed(list(in_progress)):
+                in_progress.remove(future)
+                all_releases.append(future.result().json())
+    return all_releases
+
+
+def main(plugins=200, latency=0.02):
+    releases = [make_release('plover-plugin-%u' % n) for n in range(plugins)]
+    with StubPyPI(releases, delay=latency) as pypi:
+        print('%u plugins, %.0fms latency' % (plugins, latency * 1000))
+        with tempfile.TemporaryDirectory() as cache_dir:
+            start = time.perf_counter()
+            legacy_find_releases(pypi.pypi_url, pypi.registry_url, cache_dir)
+            print('thread pool (4 workers): %.3fs' % (time.perf_counter() - start))
+        for concurrency in (4, 16, 32, 64):
+            with tempfile.TemporaryDirectory() as cache_dir:
+                utils.CACHE_DIR = cache_dir
+                stats = FetchStats()
+                find_plover_plugins_releases(pypi.pypi_url, pypi.registry_url,
+                                             concurrency=concurrency,
+                                             stats=stats)
+                print('asyncio (concurrency=%u): %s' % (concurrency, stats))
+
+
+if __name__ == '__main__':
+    plugins = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+    main(plugins, latency)
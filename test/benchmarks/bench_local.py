@@ -0,0 +1,89 @@
+"""
+Compare local plugins discovery (`local_registry.list_plugins`) against
+the previous `pkg_resources.WorkingSet` based implementation, on a
+synthetic site-packages directory.
+
+Usage: python -m test.benchmarks.bench_local [DISTRIBUTIONS [PLUGINS]]
+"""
+
+from collections import defaultdict
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import py
+
+from plover_plugins_manager import local_registry, utils
+
+from ..test_local_registry import make_dist
+
+
+def legacy_list_plugins():
+    from pkginfo.distribution import Distribution as Metadata
+    from pkg_resources import DistInfoDistribution, WorkingSet
+    from plover_plugins_manager.plugin_metadata import PluginMetadata
+    plugins = defaultdict(list)
+    for dist in WorkingSet().by_key.values():
+        if dist.key == 'plover':
+            continue
+        for entrypoint_type in dist.get_entry_map().keys():
+            if entrypoint_type.startswith('plover.'):
+                break
+        else:
+            continue
+        if isinstance(dist, DistInfoDistribution):
+            metadata_entry = 'METADATA'
+        else:
+            metadata_entry = 'PKG-INFO'
+        metadata = Metadata()
+        metadata.parse(dist.get_metadata(metadata_entry))
+        plugins[dist.key].append(PluginMetadata.from_dict({
+            attr: getattr(metadata, attr)
+            for attr in PluginMetadata._fields
+        }))
+    return plugins
+
+
+def import_time(module):
+    start = time.perf_counter()
+    subprocess.check_call([sys.executable, '-c', 'import ' + module])
+    return time.perf_counter() - start
+
+
+def main(distributions=600, plugins=50):
+    print('import pkg_resources: %.3fs' % import_time('pkg_resources'))
+    print('import pkginfo:       %.3fs' % import_time('pkginfo'))
+    with tempfile.TemporaryDirectory() as site_packages, \
+            tempfile.TemporaryDirectory() as cache_dir:
+        directory = py.path.local(site_packages)
+        for n in range(distributions):
+            if n < plugins:
+                kind = ('dist-info', 'egg-info')[n % 2]
+                make_dist(directory, 'plover-plugin-%u' % n, '1.0', kind=kind)
+            else:
+                make_dist(directory, 'package-%u' % n, '1.0',
+                          entry_points='[console_scripts]\npackage-%u = package:main\n' % n)
+        print('%u distributions, %u plugins' % (distributions, plugins))
+        # Backdate everything, so the scan results can be cached.
+        for path in directory.listdir() + [directory]:
+            os.utime(str(path), (0, 0))
+        sys.path[:] = [site_packages]
+        utils.CACHE_DIR = cache_dir
+        for name, fn in (
+            ('pkg_resources', legacy_list_plugins),
+            ('scanner', local_registry.list_plugins),
+            ('cached', local_registry.list_plugins),
+        ):
+            start = time.perf_counter()
+            found = fn()
+            wall_time = time.perf_counter() - start
+            assert len(found) == plugins
+            print('%-14s %.3fs' % (name + ':', wall_time))
+
+
+if __name__ == '__main__':
+    distributions = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+    plugins = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    main(distributions, plugins)
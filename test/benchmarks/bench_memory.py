@@ -0,0 +1,88 @@
+"""
+Compare the peak memory usage (as reported by tracemalloc) of a refresh
+when keeping the full PyPI documents versus trimming them at parse time.
+
+Usage: python -m test.benchmarks.bench_memory [PLUGINS [VERSIONS]]
+"""
+
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from plover_plugins_manager import utils
+from plover_plugins_manager.package_index import find_plover_plugins_releases
+from plover_plugins_manager.requests import CachedSession
+
+from ..stub_pypi import StubPyPI, make_release
+
+
+def synthetic_release(n, versions):
+    versions = ['%u.%u.0' % divmod(v, 10) for v in range(versions)]
+    release = make_release('plover-plugin-%u' % n, versions[-1],
+                           versions=versions,
+                           description='Lorem ipsum dolor sit amet. ' * 500)
+    for v, files in release['releases'].items():
+        for packagetype in ('sdist', 'bdist_wheel'):
+            files.append({
+                'comment_text': '',
+                'digests': {'md5': '0' * 32, 'sha256': '0' * 64},
+                'filename': 'plover_plugin_%u-%s.%s' % (n, v, packagetype),
+                'packagetype': packagetype,
+                'python_version': 'py3',
+                'requires_python': '>=3.6',
+                'size': 12345,
+                'upload_time': '2020-01-01T00:00:00',
+                'url': 'https://files.example.com/plover_plugin_%u-%s' % (n, v),
+                'yanked': False,
+            })
+    release['urls'] = release['releases'][versions[-1]]
+    return release
+
+
+def legacy_find_releases(pypi_url, registry_url):
+    session = CachedSession()
+    return [
+        session.get('%s/%s/json' % (pypi_url, name)).json()
+        for name in session.get(registry_url).json()
+    ]
+
+
+def measure(fn):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        utils.CACHE_DIR = cache_dir
+        tracemalloc.start()
+        start = time.perf_counter()
+        releases = fn()
+        wall_time = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del releases
+    return wall_time, current, peak
+
+
+def main(plugins=200, versions=30):
+    releases = [synthetic_release(n, versions) for n in range(plugins)]
+    with StubPyPI(releases) as pypi:
+        size = sum(len(pypi.documents['/pypi/%s/json' % name])
+                   for name in pypi.registry)
+        print('%u plugins, %u versions each, %.1fMB of documents' % (
+            plugins, versions, size / 1e6))
+        for name, fn in (
+            ('full documents', lambda: legacy_find_releases(pypi.pypi_url,
+                                                            pypi.registry_url)),
+            ('trimmed', lambda: find_plover_plugins_releases(pypi.pypi_url,
+                                                             pypi.registry_url)),
+            ('trimmed (history)', lambda: find_plover_plugins_releases(pypi.pypi_url,
+                                                                       pypi.registry_url,
+                                                                       history=True)),
+        ):
+            wall_time, current, peak = measure(fn)
+            print('%-20s %.3fs, retained: %6.1fMB, peak: %6.1fMB' % (
+                name + ':', wall_time, current / 1e6, peak / 1e6))
+
+
+if __name__ == '__main__':
+    plugins = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    versions = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    main(plugins, versions)
@@ -0,0 +1,97 @@
+"""
+Compare sorting plugins metadata with the slotted `PluginMetadata`
+(precomputed sort keys) against the previous namedtuple based
+implementation (parsing versions on each comparison).
+
+Usage: python -m test.benchmarks.bench_metadata [COUNT]
+"""
+
+from collections import namedtuple
+from functools import total_ordering
+import random
+import sys
+import time
+import tracemalloc
+
+from pkg_resources import parse_version
+
+from plover_plugins_manager.plugin_metadata import PluginMetadata
+
+
+@total_ordering
+class LegacyPluginMetadata(namedtuple('LegacyPluginMetadata', PluginMetadata._fields)):
+
+    @property
+    def parsed_version(self):
+        v = self.version
+        try:
+            from packaging.version import Version as PackagingVersion
+            if isinstance(v, PackagingVersion):
+                v = str(v)
+        except Exception:
+            pass
+        if isinstance(v, (bytes, bytearray)):
+            try:
+                v = v.decode()
+            except Exception:
+                v = ''
+        return parse_version(str(v) or '0')
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(*(d.get(k, '') for k in cls._fields))
+
+    def __eq__(self, other):
+        return ((self.name.lower(), self.parsed_version) ==
+                (other.name.lower(), other.parsed_version))
+
+    def __lt__(self, other):
+        return ((self.name.lower(), self.parsed_version) <
+                (other.name.lower(), other.parsed_version))
+
+
+def synthetic_metadata(count):
+    rng = random.Random(42)
+    return [
+        {
+            # Separate strings (as when parsed from different documents).
+            'author': ''.join(['Author ', str(n % 50)]),
+            'author_email': ''.join(['author', str(n % 50), '@example.com']),
+            'description': 'Description of plugin %u.' % n,
+            'description_content_type': ''.join(['text/', 'x-rst']),
+            'home_page': ''.join(['https://example.com/', str(n % 500)]),
+            'keywords': ''.join(['plover ', 'plover_plugin']),
+            'license': ''.join(['GNU General Public License ', 'v2 or later (GPLv2+)']),
+            'name': 'plover-plugin-%u' % (n % 500),
+            'summary': 'Summary of plugin %u.' % n,
+            'version': '%u.%u.%u' % (rng.randrange(5), rng.randrange(20), rng.randrange(10)),
+        }
+        for n in range(count)
+    ]
+
+
+def main(count=10000):
+    metadata = synthetic_metadata(count)
+    print('%u metadata objects' % count)
+    for name, cls in (
+        ('namedtuple', LegacyPluginMetadata),
+        ('slotted', PluginMetadata),
+    ):
+        start = time.perf_counter()
+        objects = [cls.from_dict(d) for d in metadata]
+        create_time = time.perf_counter() - start
+        del objects
+        tracemalloc.start()
+        objects = [cls.from_dict(d) for d in metadata]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        start = time.perf_counter()
+        sorted(objects)
+        sort_time = time.perf_counter() - start
+        print('%-11s create: %.3fs, sort: %.3fs, memory: %.1fMB' % (
+            name + ':', create_time, sort_time, size / 1e6))
+        del objects
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
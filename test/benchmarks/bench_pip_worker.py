@@ -0,0 +1,45 @@
+"""
+Benchmark running a batch of pip commands (`list` and `check`), each in
+its own process (the default), or through the long-lived pip worker.
+
+Usage: python -m test.benchmarks.bench_pip_worker [-n COMMANDS]
+"""
+
+import argparse
+import statistics
+import subprocess
+import time
+
+from plover_plugins_manager.__main__ import pip
+
+
+def run(args, worker):
+    proc = pip(list(args), stdout=subprocess.PIPE,
+               stderr=subprocess.STDOUT, worker=worker)
+    while proc.stdout.readline():
+        pass
+    proc.wait()
+
+
+def bench(commands):
+    for name, worker in (('subprocess', False), ('worker', True)):
+        timings = []
+        for n in range(commands):
+            start = time.perf_counter()
+            run(['list'] if n % 2 else ['check'], worker)
+            timings.append(time.perf_counter() - start)
+        print('  %-12s first: %6.0fms  median: %6.0fms  total: %6.0fms' % (
+            name, timings[0] * 1e3, statistics.median(timings) * 1e3,
+            sum(timings) * 1e3))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m test.benchmarks.bench_pip_worker')
+    parser.add_argument('-n', '--commands', type=int, default=10,
+                        help='number of commands to run')
+    options = parser.parse_args()
+    bench(options.commands)
+
+
+if __name__ == '__main__':
+    main()
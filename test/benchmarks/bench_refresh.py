@@ -0,0 +1,88 @@
+"""
+Benchmark a refresh of the available plugins (`list_plugins`) against a
+local stand-in for PyPI and the plugins registry, for cold (empty cache)
+and warm (cache populated by the previous run) runs.
+
+Note: peak memory is measured with `tracemalloc`, which slows things down.
+
+Usage: python -m test.benchmarks.bench_refresh [-p PLUGINS...] [-s PAYLOAD] [-l LATENCY]
+"""
+
+import argparse
+import tempfile
+import time
+import tracemalloc
+
+from plover_plugins_manager import global_registry, requests, utils
+from plover_plugins_manager.package_index import FetchStats
+
+from ..stub_pypi import StubPyPI, make_release
+
+
+# (name, max_age, expire_after): `max_age` controls when packages are checked
+# again, `expire_after` when cached responses need to be revalidated.
+RUNS = (
+    ('cold', 600, 600),
+    ('warm', 600, 600),
+    ('warm (recheck)', 0, 600),
+    ('warm (revalidate)', 0, 0),
+)
+
+
+def run(pypi, max_age):
+    stats = FetchStats()
+    pypi.reset_counts()
+    tracemalloc.start()
+    start = time.perf_counter()
+    plugins = global_registry.list_plugins(pypi_url=pypi.pypi_url,
+                                           registry_url=pypi.registry_url,
+                                           max_age=max_age, stats=stats)
+    wall_time = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return plugins, wall_time, peak, stats
+
+
+def bench(plugins, payload, latency):
+    releases = [
+        make_release('plover-plugin-%u' % n, description='x' * payload)
+        for n in range(plugins)
+    ]
+    with StubPyPI(releases, delay=latency) as pypi, \
+            tempfile.TemporaryDirectory() as cache_dir:
+        utils.CACHE_DIR = cache_dir
+        print('%u plugins, %u bytes payload, %.0fms latency' % (
+            plugins, payload, latency * 1000))
+        print('  %-18s %8s %9s %8s %9s %10s %9s' % (
+            '', 'wall', 'requests', 'req/s', 'network', 'cache hit', 'peak'))
+        for name, max_age, expire_after in RUNS:
+            requests.EXPIRE_AFTER = expire_after
+            found, wall_time, peak, stats = run(pypi, max_age)
+            assert len(found) == plugins
+            # Requests actually reaching the server.
+            network = sum(pypi.requests.values())
+            hit_ratio = stats.from_cache / stats.requests if stats.requests else 1
+            print('  %-18s %7.3fs %9u %8.0f %9u %9.0f%% %7.1fMB' % (
+                name, wall_time, stats.requests, stats.requests / wall_time,
+                network, hit_ratio * 100, peak / 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m test.benchmarks.bench_refresh')
+    parser.add_argument('-p', '--plugins', type=int, nargs='+',
+                        default=[10, 100, 1000], help='number of plugins')
+    parser.add_argument('-s', '--payload', type=int, default=2000,
+                        help='size of each plugin description (in bytes)')
+    parser.add_argument('-l', '--latency', type=float, default=0.02,
+                        help='injected server latency (in seconds)')
+    args = parser.parse_args()
+    expire_after = requests.EXPIRE_AFTER
+    try:
+        for plugins in args.plugins:
+            bench(plugins, args.payload, args.latency)
+    finally:
+        requests.EXPIRE_AFTER = expire_after
+
+
+if __name__ == '__main__':
+    main()
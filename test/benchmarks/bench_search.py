@@ -0,0 +1,80 @@
+"""
+Measure building the plugins search index, and querying it
+(the GUI filters the plugins table on each keystroke).
+
+Usage: python -m test.benchmarks.bench_search [COUNT]
+"""
+
+import random
+import sys
+import time
+
+from plover_plugins_manager.plugin_metadata import PluginMetadata
+from plover_plugins_manager.search_index import SearchIndex
+
+
+WORDS = '''
+dictionary machine stenograph spanish german french python commands
+layout theme keyboard serial protocol system phonetic lookup clipboard
+emoji modifier macro retro sound speech vim emacs tabs undo jump
+'''.split()
+
+
+def synthetic_metadata(count, rng):
+    return [
+        PluginMetadata.from_kwargs(
+            name='plover-%s-%u' % ('-'.join(rng.sample(WORDS, 2)), n),
+            summary=' '.join(rng.sample(WORDS, 6)).capitalize() + '.',
+            keywords='plover plover_plugin ' + ' '.join(rng.sample(WORDS, 2)),
+            author='Author %u' % (n % 200),
+            version='1.0.0',
+        )
+        for n in range(count)
+    ]
+
+
+def main(count=5000):
+    rng = random.Random(42)
+    metadata = synthetic_metadata(count, rng)
+    start = time.perf_counter()
+    index = SearchIndex()
+    for m in metadata:
+        index.update(m.name, m)
+    build_time = time.perf_counter() - start
+    print('%u plugins, index built in %.1fms (%u tokens)' % (
+        count, build_time * 1e3, len(index._tokens)))
+    # Simulate typing queries, one keystroke at a time.
+    queries = []
+    for __ in range(200):
+        text = ' '.join(rng.sample(WORDS, rng.randrange(1, 3)))
+        queries.extend(text[:n] for n in range(1, len(text) + 1))
+    print('%u queries' % len(queries))
+    for name, method in (
+        # GUI: filter the table.
+        ('matches', index.matches),
+        # CLI: ranked results.
+        ('search', index.search),
+        ('search[:20]', lambda query: index.search(query, limit=20)),
+    ):
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            method(query)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        print('%-13s mean %4.0fus, p50 %4.0fus, p99 %5.0fus, max %5.0fus' % (
+            name + ':',
+            sum(timings) / len(timings) * 1e6,
+            timings[len(timings) // 2] * 1e6,
+            timings[int(len(timings) * .99)] * 1e6,
+            timings[-1] * 1e6,
+        ))
+    start = time.perf_counter()
+    for m in metadata[:500]:
+        index.update(m.name, m._replace(summary='Updated summary.'))
+    print('incremental update: %.0fus per plugin' % (
+        (time.perf_counter() - start) / 500 * 1e6))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
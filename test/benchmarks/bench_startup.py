@@ -0,0 +1,69 @@
+"""
+Benchmark opening the plugins manager: time until the registry can fill
+the table ("ready", and the number of rows at that point), until the
+first update is applied, and until the background refresh is done,
+starting from scratch (cold: no local cache and no saved state), with
+only the local scan cache, or from the state saved by the previous
+refresh.
+
+Usage: python -m test.benchmarks.bench_startup [-p PLUGINS] [-l LATENCY]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from plover_plugins_manager import local_registry, utils
+from plover_plugins_manager.registry import Registry
+
+from ..stub_pypi import StubPyPI, make_release
+
+
+def run(name, create):
+    start = time.perf_counter()
+    registry = create()
+    ready = time.perf_counter() - start
+    rows = len(registry)
+    first_update = None
+    for diff in registry.iter_update():
+        if first_update is None:
+            first_update = time.perf_counter() - start
+    done = time.perf_counter() - start
+    print('  %-12s %7.1fms %6u %8s %8.0fms %6u' % (
+        name, ready * 1e3, rows,
+        '-' if first_update is None else '%.0fms' % (first_update * 1e3),
+        done * 1e3, len(registry)))
+
+
+def bench(plugins, latency):
+    releases = [
+        make_release('plover-plugin-%u' % n, description='x' * 2000)
+        for n in range(plugins)
+    ]
+    with StubPyPI(releases, delay=latency) as pypi, \
+            tempfile.TemporaryDirectory() as cache_dir:
+        utils.CACHE_DIR = cache_dir
+        os.environ['PYPI_URL'] = pypi.pypi_url
+        os.environ['REGISTRY_URL'] = pypi.registry_url
+        print('%u plugins, %.0fms latency' % (plugins, latency * 1000))
+        print('  %-12s %9s %6s %8s %10s %6s' % (
+            '', 'ready', 'rows', 'first', 'refreshed', 'rows'))
+        local_registry.invalidate_cache()
+        run('cold', Registry)
+        run('scan', Registry)
+        run('saved state', Registry.load)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m test.benchmarks.bench_startup')
+    parser.add_argument('-p', '--plugins', type=int, default=300,
+                        help='number of plugins')
+    parser.add_argument('-l', '--latency', type=float, default=0.05,
+                        help='injected server latency (in seconds)')
+    args = parser.parse_args()
+    bench(args.plugins, args.latency)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Benchmark the native uninstall of several plugins (see
+`plover_plugins_manager.uninstall`), with fake distributions
+created in a temporary site directory.
+
+Usage: python -m test.benchmarks.bench_uninstall [-p PLUGINS] [-f FILES]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from plover_plugins_manager import local_registry, uninstall
+
+from ..test_local_registry import make_dist
+
+
+def bench(plugins, files):
+    with tempfile.TemporaryDirectory() as base_dir:
+        site_dir = os.path.join(base_dir, 'site-packages')
+        os.mkdir(site_dir)
+        local_registry._path_entries = lambda: [(site_dir, False)]
+        uninstall._roots = lambda: [(site_dir, base_dir)]
+        names = ['plover-plugin-%u' % n for n in range(plugins)]
+        for name in names:
+            module = name.replace('-', '_')
+            make_dist(site_dir, name, '1.0', [
+                '%s/module_%u.py' % (module, n) for n in range(files)
+            ])
+        start = time.perf_counter()
+        assert uninstall.uninstall(names, progress=None) == []
+        elapsed = time.perf_counter() - start
+        assert os.listdir(site_dir) == []
+        print('%u plugins, %u files each: %.1fms' % (plugins, files, elapsed * 1e3))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m test.benchmarks.bench_uninstall')
+    parser.add_argument('-p', '--plugins', type=int, default=5,
+                        help='number of plugins')
+    parser.add_argument('-f', '--files', type=int, default=50,
+                        help='number of files per plugin')
+    args = parser.parse_args()
+    bench(args.plugins, args.files)
+
+
+if __name__ == '__main__':
+    main()
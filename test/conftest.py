@@ -18,3 +18,10 @@ def _virtualenv_fixture(cloaked):
 
 virtualenv = pytest.fixture(_virtualenv_fixture(True))
 naked_virtualenv = pytest.fixture(_virtualenv_fixture(False))
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmpdir, monkeypatch):
+    # Don't use (or pollute) the user's cache.
+    cache_dir = tmpdir / 'cache'
+    monkeypatch.setattr('plover_plugins_manager.utils.CACHE_DIR', str(cache_dir))
+    return cache_dir
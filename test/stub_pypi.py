@@ -0,0 +1,206 @@
+from collections import Counter
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import json
+import threading
+import time
+
+
+LAST_MODIFIED = 'Sat, 01 Jan 2000 00:00:00 GMT'
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body=b'', headers=()):
+        self.server.stub.count(self.path, status)
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        stub = self.server.stub
+        if stub.delay:
+            time.sleep(stub.delay)
+        fault = stub.next_fault(self.path)
+        if isinstance(fault, float):
+            time.sleep(fault)
+        elif fault is not None:
+            self._reply(fault)
+            return
+        body = stub.documents.get(self.path)
+        if body is None:
+            self._reply(404)
+            return
+        etag = '"%s"' % sha256(body).hexdigest()
+        headers = [('Content-Type', 'application/json')]
+        headers.extend(stub.headers.get(self.path, {}).items())
+        if stub.validators:
+            headers.extend((
+                ('ETag', etag),
+                ('Last-Modified', LAST_MODIFIED),
+            ))
+            if_none_match = self.headers.get('If-None-Match')
+            if if_none_match is None:
+                not_modified = self.headers.get('If-Modified-Since') == LAST_MODIFIED
+            else:
+                not_modified = if_none_match == etag
+            if not_modified:
+                self._reply(304, headers=headers)
+                return
+        self._reply(200, body, headers)
+
+
+class StubServer:
+    """
+    Local HTTP server serving static documents (a `{path: bytes}`
+    mapping), with support for conditional requests and injected
+    latency / faults, and keeping count of the responses sent (by
+    status code).
+    """
+
+    def __init__(self, documents=None, validators=True, delay=0):
+        self.documents = {} if documents is None else documents
+        # Extra headers: `{path: {name: value}}`.
+        self.headers = {}
+        self.validators = validators
+        # Injected latency (in seconds).
+        self.delay = delay
+        # Injected faults, applied in order to each request
+        # for a path: `{path: [fault]}`, where a fault is
+        # either a delay (float), or a status code (int).
+        self.faults = {}
+        self.responses = Counter()
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%u' % self._server.server_address
+
+    def count(self, path, status):
+        with self._lock:
+            self.requests[path] += 1
+            self.responses[status] += 1
+
+    def next_fault(self, path):
+        with self._lock:
+            faults = self.faults.get(path)
+            if faults:
+                return faults.pop(0)
+        return None
+
+    def reset_counts(self):
+        with self._lock:
+            self.requests.clear()
+            self.responses.clear()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def make_release(name, version='1.0.0', keywords='plover plover_plugin',
+                 serial=1, versions=None, yanked=(), **info):
+    if versions is None:
+        versions = (version,)
+    release_info = {
+        'author': 'Author of %s' % name,
+        'author_email': '%s@example.com' % name,
+        'description': 'The %s plugin for Plover.' % name,
+        'description_content_type': 'text/plain',
+        'home_page': 'https://example.com/%s' % name,
+        'keywords': keywords,
+        'license': 'GPLv2+',
+        'name': name,
+        'requires_dist': None,
+        'requires_python': None,
+        'summary': 'Summary of %s' % name,
+        'version': version,
+    }
+    release_info.update(info)
+    return {
+        'info': release_info,
+        'last_serial': serial,
+        'releases': {
+            v: [{
+                'filename': '%s-%s-py3-none-any.whl' % (name.replace('-', '_'), v),
+                'packagetype': 'bdist_wheel',
+                'yanked': v in yanked,
+            }]
+            for v in versions
+        },
+        'urls': [],
+    }
+
+
+class StubPyPI(StubServer):
+    """
+    Local stand-in for PyPI's JSON API and the plugins registry.
+    """
+
+    def __init__(self, releases=(), **kwargs):
+        super().__init__(**kwargs)
+        self.registry = []
+        for release in releases:
+            self.add_release(release)
+        self._update_registry()
+
+    @property
+    def pypi_url(self):
+        return self.url + '/pypi'
+
+    @property
+    def registry_url(self):
+        return self.url + '/registry.json'
+
+    def _update_registry(self):
+        self.documents['/registry.json'] = json.dumps(self.registry).encode()
+
+    def add_release(self, release, registered=True):
+        name = release['info']['name']
+        path = '/pypi/%s/json' % name
+        self.documents[path] = json.dumps(release).encode()
+        self.headers[path] = {'X-PyPI-Last-Serial': str(release['last_serial'])}
+        for version in release['releases']:
+            version_release = dict(release, info=dict(release['info'], version=version))
+            path = '/pypi/%s/%s/json' % (name, version)
+            self.documents[path] = json.dumps(version_release).encode()
+        if registered and name not in self.registry:
+            self.registry.append(name)
+            self._update_registry()
+
+    def remove_release(self, name):
+        self.documents.pop('/pypi/%s/json' % name, None)
+        if name in self.registry:
+            self.registry.remove(name)
+            self._update_registry()
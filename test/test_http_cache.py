@@ -0,0 +1,92 @@
+import os
+
+import pytest
+
+from plover_plugins_manager.http_cache import DiskCache
+from plover_plugins_manager.requests import CachedSession
+
+from .stub_pypi import StubServer
+
+
+@pytest.fixture
+def server():
+    with StubServer({
+        '/foo/json': b'{"foo": 1}',
+        '/bar/json': b'{"bar": 2}',
+    }) as server:
+        yield server
+
+
+def test_fresh_responses_are_served_from_cache(tmpdir, server):
+    session = CachedSession(cache_dir=str(tmpdir))
+    for __ in range(3):
+        resp = session.get(server.url + '/foo/json')
+        assert resp.json() == {'foo': 1}
+    assert server.responses == {200: 1}
+    # The cache is persistent.
+    session = CachedSession(cache_dir=str(tmpdir))
+    resp = session.get(server.url + '/foo/json')
+    assert resp.from_cache
+    assert resp.json() == {'foo': 1}
+    assert server.responses == {200: 1}
+
+
+def test_stale_responses_are_revalidated(tmpdir, server):
+    session = CachedSession(cache_dir=str(tmpdir), expire_after=0)
+    resp = session.get(server.url + '/foo/json')
+    assert not resp.from_cache
+    for __ in range(3):
+        resp = session.get(server.url + '/foo/json')
+        assert resp.from_cache and resp.revalidated
+        assert resp.json() == {'foo': 1}
+    assert server.responses == {200: 1, 304: 3}
+    # Modified document: full response.
+    server.documents['/foo/json'] = b'{"foo": 42}'
+    resp = session.get(server.url + '/foo/json')
+    assert resp.json() == {'foo': 42}
+    assert server.responses == {200: 2, 304: 3}
+
+
+def test_no_validators(tmpdir, server):
+    server.validators = False
+    session = CachedSession(cache_dir=str(tmpdir), expire_after=0)
+    for __ in range(2):
+        assert session.get(server.url + '/foo/json').json() == {'foo': 1}
+    assert server.responses == {200: 2}
+
+
+def test_not_found_is_not_cached(tmpdir, server):
+    session = CachedSession(cache_dir=str(tmpdir))
+    for __ in range(2):
+        assert session.get(server.url + '/baz/json').status_code == 404
+    assert server.responses == {404: 2}
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_lru_eviction(tmpdir):
+    cache = DiskCache(str(tmpdir), max_size=500)
+    header = {'status': 200, 'headers': {}, 'stored': 0}
+    cache.set('a', header, b'a' * 150)
+    cache.set('b', header, b'b' * 150)
+    # Make `b` the least recently used entry.
+    os.utime(cache._path('b'), (0, 0))
+    assert cache.get('a') is not None
+    cache.set('c', header, b'c' * 150)
+    assert cache.get('a') is not None
+    assert cache.get('b') is None
+    assert cache.get('c') is not None
+    # Another instance sharing the same directory.
+    other_cache = DiskCache(str(tmpdir), max_size=500)
+    assert other_cache.get('c')[1] == b'c' * 150
+
+
+def test_unusable_cache_dir(tmpdir, server):
+    cache_dir = tmpdir / 'cache'
+    cache_dir.write('not a directory')
+    # Requests are still done, just not cached.
+    session = CachedSession(cache_dir=str(cache_dir))
+    assert session.cache is None
+    for __ in range(2):
+        resp = session.get(server.url + '/foo/json')
+        assert resp.json() == {'foo': 1}
+    assert server.responses == {200: 2}
@@ -0,0 +1,217 @@
+import csv
+import os
+import sys
+import zipfile
+
+import pytest
+
+from plover_plugins_manager import local_registry, pip_wrapper
+from plover_plugins_manager.__main__ import _pip_args
+
+
+ENTRY_POINTS = '[plover.extension]\nfoo = foo:Foo\n'
+
+
+def make_dist(directory, name, version, files=(), entry_points=ENTRY_POINTS,
+              kind='dist-info', description=None):
+    '''
+    Create a distribution in `directory`, with `files` (paths relative to
+    `directory`, listed in its `RECORD` for a `.dist-info`), and return
+    its location (metadata directory, or egg).
+    '''
+    directory = str(directory)
+    metadata = 'Metadata-Version: 2.1\nName: %s\nVersion: %s\n' % (name, version)
+    if description is not None:
+        metadata += '\n' + description
+    metadata_entry = 'METADATA' if kind == 'dist-info' else 'PKG-INFO'
+    entries = {metadata_entry: metadata}
+    if entry_points is not None:
+        entries['entry_points.txt'] = entry_points
+    basename = '%s-%s' % (name.replace('-', '_'), version)
+    if kind == 'zipped-egg':
+        egg = os.path.join(directory, basename + '.egg')
+        with zipfile.ZipFile(egg, 'w') as zf:
+            for filename, contents in entries.items():
+                zf.writestr('EGG-INFO/' + filename, contents)
+        return egg
+    if kind == 'egg':
+        location = os.path.join(directory, basename + '.egg')
+        metadata_dir = os.path.join(location, 'EGG-INFO')
+    else:
+        location = metadata_dir = os.path.join(directory, basename + '.' + kind)
+    contents = {
+        os.path.join(metadata_dir, filename): entry
+        for filename, entry in entries.items()
+    }
+    for path in files:
+        contents[os.path.join(directory, path)] = '# %s %s\n' % (name, version)
+    for path, content in contents.items():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as fp:
+            fp.write(content)
+    if kind == 'dist-info':
+        record = os.path.join(metadata_dir, 'RECORD')
+        with open(record, 'w', newline='') as fp:
+            writer = csv.writer(fp)
+            for path in sorted(contents) + [record]:
+                writer.writerow((os.path.relpath(path, directory).replace(os.sep, '/'), '', ''))
+    return location
+
+
+@pytest.fixture
+def site_dirs(tmpdir, monkeypatch):
+    site_packages = tmpdir / 'site-packages'
+    user_site = tmpdir / 'user-site'
+    for directory in (site_packages, user_site):
+        directory.mkdir()
+    monkeypatch.setattr(sys, 'path', [str(site_packages)])
+    monkeypatch.setattr('site.USER_SITE', str(user_site))
+    monkeypatch.setattr('plover_plugins_manager.local_registry.running_under_virtualenv',
+                        lambda: False)
+    return site_packages, user_site
+
+
+def versions(plugins):
+    return {
+        name: [metadata.version for metadata in versions]
+        for name, versions in plugins.items()
+    }
+
+
+def test_list_plugins(site_dirs):
+    site_packages, user_site = site_dirs
+    make_dist(site_packages, 'plover-foo', '1.0')
+    make_dist(site_packages, 'plover-bar', '0.1', kind='egg-info')
+    # Eggs are only listed if they are in `sys.path`.
+    sys.path.append(str(make_dist(site_packages, 'plover-baz', '0.2', kind='egg')))
+    sys.path.append(str(make_dist(site_packages, 'plover-qux', '0.3', kind='zipped-egg')))
+    make_dist(site_packages, 'plover-not-in-path', '0.4', kind='egg')
+    make_dist(site_packages, 'not-a-plugin', '1.0', entry_points='[console_scripts]\n')
+    make_dist(site_packages, 'no-entrypoints', '1.0', entry_points=None)
+    make_dist(site_packages, 'plover', '4.0')
+    assert versions(local_registry.list_plugins()) == {
+        'plover-foo': ['1.0'],
+        'plover-bar': ['0.1'],
+        'plover-baz': ['0.2'],
+        'plover-qux': ['0.3'],
+    }
+
+
+def test_precedence(tmpdir, site_dirs, monkeypatch):
+    site_packages, user_site = site_dirs
+    other_site_packages = tmpdir / 'other-site-packages'
+    other_site_packages.mkdir()
+    sys.path.append(str(other_site_packages))
+    make_dist(site_packages, 'plover-foo', '1.0')
+    make_dist(other_site_packages, 'plover-foo', '2.0')
+    make_dist(site_packages, 'plover-bar', '1.0')
+    # Not a plugin anymore, but still shadows the other version.
+    make_dist(site_packages, 'plover-baz', '1.0', entry_points='')
+    make_dist(other_site_packages, 'plover-baz', '0.9')
+    # The user site takes precedence.
+    make_dist(user_site, 'plover-bar', '1.1')
+    assert versions(local_registry.list_plugins()) == {
+        'plover-foo': ['1.0'],
+        'plover-bar': ['1.1'],
+    }
+    # Unless running under a virtualenv.
+    monkeypatch.setattr('plover_plugins_manager.local_registry.running_under_virtualenv',
+                        lambda: True)
+    assert versions(local_registry.list_plugins()) == {
+        'plover-foo': ['1.0'],
+        'plover-bar': ['1.0'],
+    }
+
+
+def test_lazy_description(site_dirs, monkeypatch):
+    site_packages, user_site = site_dirs
+    make_dist(site_packages, 'plover-foo', '1.0', description='The foo plugin.\n\nDetails.\n')
+    make_dist(site_packages, 'plover-bar', '1.0')
+    loaded = []
+    load_description = local_registry._load_description
+    monkeypatch.setattr('plover_plugins_manager.local_registry._load_description',
+                        lambda location: loaded.append(location) or load_description(location))
+    plugins = local_registry.list_plugins()
+    assert loaded == []
+    assert plugins['plover-foo'][0].description == 'The foo plugin.\n\nDetails.\n'
+    assert plugins['plover-foo'][0].description == 'The foo plugin.\n\nDetails.\n'
+    assert not plugins['plover-bar'][0].description
+    assert len(loaded) == 2
+
+
+def test_scan_cache(site_dirs, monkeypatch):
+    site_packages, user_site = site_dirs
+
+    timestamps = iter(range(1000, 10000, 1000))
+
+    def backdate(*paths):
+        timestamp = next(timestamps)
+        for path in paths:
+            os.utime(str(path), (timestamp, timestamp))
+
+    backdate(make_dist(site_packages, 'plover-foo', '1.0'),
+             make_dist(site_packages, 'not-a-plugin', '1.0', entry_points=''),
+             site_packages, user_site)
+    assert versions(local_registry.list_plugins()) == {'plover-foo': ['1.0']}
+    scans = []
+    scan = local_registry._scan
+    monkeypatch.setattr('plover_plugins_manager.local_registry._scan',
+                        lambda path_entries: scans.append(1) or scan(path_entries))
+    # Nothing changed: no rescan.
+    assert versions(local_registry.list_plugins()) == {'plover-foo': ['1.0']}
+    assert scans == []
+    # Updated plugin.
+    dist_info = site_packages / 'plover_foo-1.0.dist-info'
+    dist_info.join('METADATA').write('Metadata-Version: 2.1\nName: plover-foo\nVersion: 1.0.1\n')
+    backdate(dist_info.join('METADATA'))
+    os.utime(str(dist_info), None)
+    assert versions(local_registry.list_plugins()) == {'plover-foo': ['1.0.1']}
+    assert len(scans) == 1
+    # New plugin (in the user site).
+    make_dist(user_site, 'plover-bar', '0.1')
+    assert versions(local_registry.list_plugins()) == {
+        'plover-foo': ['1.0.1'],
+        'plover-bar': ['0.1'],
+    }
+    assert len(scans) == 2
+    # Explicit invalidation.
+    backdate(dist_info, user_site, user_site / 'plover_bar-0.1.dist-info')
+    local_registry.list_plugins()
+    local_registry.list_plugins()
+    assert len(scans) == 3
+    local_registry.invalidate_cache()
+    local_registry.list_plugins()
+    assert len(scans) == 4
+
+
+def test_scan_cache_unwritable(site_dirs, monkeypatch):
+    site_packages, user_site = site_dirs
+    os.utime(str(make_dist(site_packages, 'plover-foo', '1.0')), (1000, 1000))
+    os.utime(str(site_packages), (1000, 1000))
+    os.utime(str(user_site), (1000, 1000))
+
+    def save_json(path, data):
+        raise PermissionError(13, 'Permission denied', path)
+
+    monkeypatch.setattr('plover_plugins_manager.local_registry.save_json', save_json)
+    # The results are just not cached.
+    assert versions(local_registry.list_plugins()) == {'plover-foo': ['1.0']}
+    assert not os.path.exists(local_registry._cache_file())
+
+
+def test_invalidated_after_pip(monkeypatch):
+    events = []
+    monkeypatch.setattr('plover_plugins_manager.local_registry.invalidate_cache',
+                        lambda: events.append('invalidate'))
+
+    def pip_main(args):
+        events.append(args[0])
+        return 0
+
+    assert pip_wrapper.run(['install', 'plover-foo'], pip_main=pip_main) == 0
+    assert pip_wrapper.run(['list'], pip_main=pip_main) == 0
+    assert events == ['install', 'invalidate', 'list']
+    # Building the arguments has no side effect.
+    events.clear()
+    _pip_args(['transaction', ['install', 'plover-foo'], ['uninstall', '-y', 'plover-bar']])
+    assert events == []
@@ -0,0 +1,318 @@
+import io
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from requests import RequestException
+
+from plover_plugins_manager import global_registry, package_index
+from plover_plugins_manager.plugin_metadata import PluginMetadata
+
+from .stub_pypi import StubPyPI, make_release
+
+
+@pytest.fixture
+def pypi():
+    with StubPyPI([
+        make_release('plover-foo', '1.0.0'),
+        make_release('plover-bar', '0.2.0'),
+        make_release('plover-baz', '3.1.0'),
+        make_release('not-a-plugin', keywords='plover'),
+    ]) as pypi:
+        yield pypi
+
+
+def find_releases(pypi, **kwargs):
+    releases = package_index.find_plover_plugins_releases(
+        pypi_url=pypi.pypi_url, registry_url=pypi.registry_url, **kwargs)
+    return {
+        release['info']['name']: release['info']['version']
+        for release in releases
+    }
+
+
+def test_find_releases(pypi):
+    assert find_releases(pypi) == {
+        'plover-foo': '1.0.0',
+        'plover-bar': '0.2.0',
+        'plover-baz': '3.1.0',
+    }
+    assert pypi.requests['/pypi/plover-foo/json'] == 1
+
+
+def test_aggregated_index(pypi):
+    index = io.BytesIO()
+    package_index.dump_index([
+        make_release('plover-foo', '1.0.0'),
+        make_release('plover-bar', '0.2.1'),
+        make_release('not-a-plugin', keywords='plover'),
+    ], index)
+    pypi.documents['/index.json.gz'] = index.getvalue()
+    assert find_releases(pypi, index_url=pypi.url + '/index.json.gz') == {
+        'plover-foo': '1.0.0',
+        'plover-bar': '0.2.1',
+        'plover-baz': '3.1.0',
+    }
+    # Only the package missing from the aggregated index was fetched.
+    assert set(pypi.requests) == {
+        '/registry.json',
+        '/index.json.gz',
+        '/pypi/plover-baz/json',
+    }
+
+
+def test_aggregated_index_fallback(pypi):
+    assert find_releases(pypi, index_url=pypi.url + '/missing.json') == {
+        'plover-foo': '1.0.0',
+        'plover-bar': '0.2.0',
+        'plover-baz': '3.1.0',
+    }
+
+
+def test_fetch_stats(pypi):
+    stats = package_index.FetchStats()
+    find_releases(pypi, concurrency=2, stats=stats)
+    # Registry + 4 packages.
+    assert stats.requests == 5
+    assert stats.from_cache == 0
+    assert stats.wall_time > 0
+    stats = package_index.FetchStats()
+    find_releases(pypi, stats=stats, max_age=0)
+    assert stats.from_cache == 5
+    assert stats.unchanged == 4
+
+
+def test_incremental_refresh(pypi, monkeypatch):
+    monkeypatch.setattr('plover_plugins_manager.requests.EXPIRE_AFTER', 0)
+    find_releases(pypi)
+    # Nothing changed: only the registry is checked.
+    pypi.reset_counts()
+    stats = package_index.FetchStats()
+    find_releases(pypi, stats=stats)
+    assert set(pypi.requests) == {'/registry.json'}
+    assert stats.unchanged == 4
+    # New and removed packages.
+    pypi.reset_counts()
+    pypi.add_release(make_release('plover-new', '0.1.0'))
+    pypi.remove_release('plover-baz')
+    assert find_releases(pypi) == {
+        'plover-foo': '1.0.0',
+        'plover-bar': '0.2.0',
+        'plover-new': '0.1.0',
+    }
+    assert set(pypi.requests) == {'/registry.json', '/pypi/plover-new/json'}
+    # Once stale, packages are checked again,
+    # but only parsed if their serial changed.
+    pypi.add_release(make_release('plover-foo', '1.1.0', serial=2))
+    pypi.reset_counts()
+    stats = package_index.FetchStats()
+    assert find_releases(pypi, stats=stats, max_age=0) == {
+        'plover-foo': '1.1.0',
+        'plover-bar': '0.2.0',
+        'plover-new': '0.1.0',
+    }
+    assert pypi.responses == {200: 1, 304: 4}
+    assert stats.unchanged == 3
+
+
+def test_iter_releases(pypi):
+    batches = list(package_index.iter_plover_plugins_releases(
+        pypi_url=pypi.pypi_url, registry_url=pypi.registry_url))
+    assert all(batches)
+    assert sorted(
+        release['info']['name']
+        for batch in batches
+        for release in batch
+    ) == ['plover-bar', 'plover-baz', 'plover-foo']
+
+
+def test_iter_releases_error(pypi):
+    releases = package_index.iter_plover_plugins_releases(
+        pypi_url=pypi.pypi_url, registry_url=pypi.url + '/missing.json')
+    with pytest.raises(RequestException):
+        list(releases)
+
+
+def test_retries(pypi):
+    pypi.faults['/pypi/plover-foo/json'] = [503]
+    pypi.faults['/pypi/plover-bar/json'] = [500, 502]
+    stats = package_index.FetchStats()
+    assert find_releases(pypi, stats=stats, retries=1) == {
+        'plover-foo': '1.0.0',
+        'plover-baz': '3.1.0',
+    }
+    assert stats.retries == 2
+    assert stats.failed == ['plover-bar']
+
+
+def test_error_statuses(pypi, monkeypatch):
+    monkeypatch.setattr('plover_plugins_manager.requests.EXPIRE_AFTER', 0)
+    find_releases(pypi)
+    pypi.add_release(make_release('plover-foo', '1.1.0', serial=2))
+    pypi.add_release(make_release('plover-bar', '0.3.0', serial=2))
+    # Rate limited: retried.
+    pypi.faults['/pypi/plover-foo/json'] = [429]
+    # Access denied: the previous release is used.
+    pypi.faults['/pypi/plover-bar/json'] = [403]
+    # Deleted.
+    del pypi.documents['/pypi/plover-baz/json']
+    stats = package_index.FetchStats()
+    assert find_releases(pypi, stats=stats, max_age=0, retries=1) == {
+        'plover-foo': '1.1.0',
+        'plover-bar': '0.2.0',
+    }
+    assert stats.retries == 1
+    assert stats.failed == ['plover-bar']
+
+
+def test_deadline(pypi, monkeypatch):
+    monkeypatch.setattr('plover_plugins_manager.requests.EXPIRE_AFTER', 0)
+    find_releases(pypi)
+    pypi.add_release(make_release('plover-foo', '1.1.0', serial=2))
+    pypi.add_release(make_release('plover-bar', '0.3.0', serial=2))
+    pypi.faults['/pypi/plover-foo/json'] = [2.0]
+    stats = package_index.FetchStats()
+    # Partial results: the straggler's previous release is used.
+    assert find_releases(pypi, stats=stats, max_age=0, deadline=0.5) == {
+        'plover-foo': '1.0.0',
+        'plover-bar': '0.3.0',
+        'plover-baz': '3.1.0',
+    }
+    assert stats.failed == ['plover-foo']
+    assert stats.wall_time < 1.5
+
+
+def test_cancel(pypi):
+    for n in range(20):
+        pypi.add_release(make_release('plover-plugin-%u' % n))
+    pypi.delay = 0.2
+    cancel = package_index.CancelToken()
+    stats = package_index.FetchStats()
+    timer = threading.Timer(0.5, cancel.cancel)
+    timer.start()
+    with pytest.raises(package_index.Cancelled):
+        find_releases(pypi, stats=stats, concurrency=2, cancel=cancel)
+    timer.join()
+    # Pending requests were cancelled.
+    assert stats.wall_time < 1.5
+    time.sleep(0.5)
+    assert sum(pypi.requests.values()) < 10
+    # Already cancelled.
+    with pytest.raises(package_index.Cancelled):
+        find_releases(pypi, cancel=cancel)
+
+
+def test_hedged_requests(pypi):
+    pypi.faults['/pypi/plover-foo/json'] = [2.0]
+    stats = package_index.FetchStats()
+    assert find_releases(pypi, stats=stats, hedge_after=0.1) == {
+        'plover-foo': '1.0.0',
+        'plover-bar': '0.2.0',
+        'plover-baz': '3.1.0',
+    }
+    assert stats.hedged == 1
+    assert stats.wall_time < 1.5
+
+
+def test_registry_fallback(pypi):
+    find_releases(pypi)
+    pypi.faults['/registry.json'] = [503]
+    assert find_releases(pypi, max_age=0, retries=0) == {
+        'plover-foo': '1.0.0',
+        'plover-bar': '0.2.0',
+        'plover-baz': '3.1.0',
+    }
+
+
+def test_state_not_saved(pypi, monkeypatch):
+    def save_json(path, data):
+        raise PermissionError(13, 'Permission denied', path)
+    monkeypatch.setattr('plover_plugins_manager.package_index.save_json', save_json)
+    # The refresh still succeeds.
+    assert find_releases(pypi) == {
+        'plover-foo': '1.0.0',
+        'plover-bar': '0.2.0',
+        'plover-baz': '3.1.0',
+    }
+
+
+def test_history(pypi):
+    pypi.add_release(make_release(
+        'plover-foo', '1.1.0', serial=2,
+        versions=('0.9.0', '1.0.0', '1.0.1', '1.1.0', '1.2.0rc1'),
+        yanked=('1.0.1',),
+    ))
+    releases = package_index.find_plover_plugins_releases(
+        pypi_url=pypi.pypi_url, registry_url=pypi.registry_url,
+        history=True)
+    plugins = global_registry._group_by_name(releases)
+    assert [m.version for m in plugins['plover-foo']] == ['0.9.0', '1.0.0', '1.1.0']
+    assert [m.version for m in plugins['plover-bar']] == ['0.2.0']
+    # Only the package documents were fetched.
+    assert not any(path.count('/') > 3 for path in pypi.requests)
+
+
+def test_fetch_releases(pypi):
+    versions = [('plover-foo', '1.0.0'), ('plover-bar', '0.2.0'), ('plover-bar', '0.3.0')]
+    for __ in range(2):
+        releases = package_index.fetch_releases(versions, pypi_url=pypi.pypi_url)
+        assert releases[('plover-foo', '1.0.0')]['info']['version'] == '1.0.0'
+        assert releases[('plover-bar', '0.2.0')]['info']['version'] == '0.2.0'
+        assert releases[('plover-bar', '0.3.0')] is None
+        # Results are cached.
+        assert sum(pypi.requests.values()) == 3
+
+
+@pytest.mark.parametrize('history', (False, True))
+def test_parse_release(history):
+    release = make_release('plover-foo', '1.1.0', versions=('1.0.0', '1.1.0'))
+    release['urls'] = [{'filename': 'plover_foo-1.1.0-py3-none-any.whl'}]
+    expected_info = {
+        field: release['info'][field]
+        for field in PluginMetadata._fields
+    }
+    # Any keys order is supported.
+    for items in (
+        list(release.items()),
+        list(reversed(list(release.items()))),
+    ):
+        data = json.dumps(dict(items), indent=1).encode()
+        parsed = package_index.parse_release(data, history=history)
+        assert parsed.pop('info') == expected_info
+        assert parsed.pop('last_serial') == 1
+        if history:
+            assert parsed.pop('versions') == ['1.0.0', '1.1.0']
+        assert parsed == {}
+    with pytest.raises(ValueError):
+        package_index.parse_release(b'[]')
+    with pytest.raises(ValueError):
+        package_index.parse_release(b'{"last_serial": 42}')
+
+
+def test_lazy_descriptions(pypi, tmpdir, monkeypatch):
+    plugins = global_registry.list_plugins(pypi_url=pypi.pypi_url,
+                                           registry_url=pypi.registry_url)
+    # The whole index state is not parsed again.
+    load_json = package_index.load_json
+    monkeypatch.setattr('plover_plugins_manager.package_index.load_json', None)
+    metadata = plugins['plover-foo'][0]
+    assert metadata._load_description is not None
+    assert metadata.description == 'The plover-foo plugin for Plover.'
+    assert metadata.to_dict()['description'] == 'The plover-foo plugin for Plover.'
+    # State saved by a previous version: the releases are saved on first use.
+    monkeypatch.setattr('plover_plugins_manager.package_index.load_json', load_json)
+    state = package_index.IndexState.for_urls(pypi.pypi_url, pypi.registry_url)
+    os.unlink(state.releases_path)
+    assert package_index.load_description('plover-bar', pypi_url=pypi.pypi_url,
+                                          registry_url=pypi.registry_url) == \
+        'The plover-bar plugin for Plover.'
+    assert os.path.exists(state.releases_path)
+    # Offline mode: loaded from the snapshot.
+    snapshot = str(tmpdir / 'index.snapshot')
+    package_index.find_plover_plugins_releases(
+        pypi_url=pypi.pypi_url, registry_url=pypi.registry_url, capture=snapshot)
+    plugins = global_registry.list_plugins(snapshot=snapshot)
+    assert plugins['plover-bar'][0].description == 'The plover-bar plugin for Plover.'
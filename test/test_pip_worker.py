@@ -0,0 +1,83 @@
+import os
+import subprocess
+
+import pytest
+
+from plover_plugins_manager import pip_worker
+from plover_plugins_manager.__main__ import pip
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    worker = pip_worker._Worker()
+    monkeypatch.setattr(pip_worker, '_worker', worker)
+    yield worker
+    worker.stop()
+
+
+def run(args, env=None):
+    if env is None:
+        env = dict(os.environ)
+    proc = pip_worker.popen(['--disable-pip-version-check'] + args, env)
+    assert proc is not None
+    output = []
+    while True:
+        line = proc.readline()
+        if not line:
+            break
+        output.append(line.decode().rstrip())
+    return proc.wait(), proc.pid, output
+
+
+def test_worker(worker):
+    code, pid, output = run(['list', '--format=freeze'])
+    assert code == 0
+    assert any(line.startswith('pip==') for line in output)
+    # The same worker is reused.
+    code, pid2, output = run(['frobnicate'])
+    assert code == 1
+    assert pid2 == pid
+    assert 'ERROR: unknown command "frobnicate"' in output
+    # Only one command at a time.
+    proc = pip_worker.popen(['--version'], dict(os.environ))
+    assert pip_worker.popen(['--version'], dict(os.environ)) is None
+    assert proc.readline().startswith(b'pip ')
+    assert proc.readline() == b''
+    assert proc.wait() == 0
+
+
+def test_worker_restart(worker, tmpdir):
+    env = dict(os.environ, PYTHONPATH=str(tmpdir))
+    code, pid, output = run(['--version'], env)
+    assert code == 0
+    # Environment variables changed.
+    code, pid2, output = run(['--version'])
+    assert code == 0
+    assert pid2 != pid
+    code, pid, output = run(['--version'], env)
+    assert pid != pid2
+    # A `sys.path` entry changed (e.g. a distribution was installed).
+    (tmpdir / 'foo-1.0.dist-info').mkdir()
+    code, pid2, output = run(['--version'], env)
+    assert code == 0
+    assert pid2 != pid
+    # Terminated.
+    worker._proc.terminate()
+    worker._proc.wait()
+    code, pid, output = run(['--version'], env)
+    assert code == 0
+    assert pid != pid2
+
+
+def test_pip(worker, monkeypatch):
+    monkeypatch.setenv('PLOVER_PLUGINS_PIP_WORKER', '1')
+    proc = pip(['list'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    assert isinstance(proc, pip_worker.WorkerProcess)
+    while proc.stdout.readline():
+        pass
+    assert proc.wait() == 0
+    proc = pip(['list'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+               worker=False)
+    assert isinstance(proc, subprocess.Popen)
+    proc.communicate()
+    assert proc.wait() == 0
@@ -1,16 +1,22 @@
+from types import SimpleNamespace
 import tarfile
 import sys
+import threading
 
 import pkg_resources
 import pytest
 
-from plover_plugins_manager.registry import Registry
+from plover_plugins_manager import local_registry, package_index
+from plover_plugins_manager.registry import PackageState, Registry, RegistryDiff
 from plover_plugins_manager.plugin_metadata import PluginMetadata
 
+from .stub_pypi import make_release
+
 
 @pytest.fixture
 def fake_global_registry(monkeypatch):
-    monkeypatch.setattr('plover_plugins_manager.global_registry.find_plover_plugins_releases', lambda: [])
+    monkeypatch.setattr('plover_plugins_manager.global_registry.find_plover_plugins_releases', lambda **kwargs: [])
+    monkeypatch.setattr('plover_plugins_manager.global_registry.iter_plover_plugins_releases', lambda **kwargs: iter(()))
 
 @pytest.fixture
 def fake_local_registry(tmpdir, monkeypatch):
@@ -92,3 +98,210 @@ def test_fake_registry(fake_env):
     assert local_dist_info.available == []
     assert local_dist_info.latest is None
     assert local_dist_info.metadata is local_dist_info.current
+
+
+def test_streaming_update(fake_local_registry, monkeypatch):
+    batches = [
+        [make_release('plover-foo', '1.0')],
+        [make_release('local_dist_info', '1.0.1'), make_release('plover-bar', '0.1')],
+    ]
+    monkeypatch.setattr('plover_plugins_manager.global_registry.iter_plover_plugins_releases',
+                        lambda **kwargs: iter(batches))
+    r = Registry()
+    assert len(r) == 3
+    updates = r.iter_update()
+    assert next(updates) == RegistryDiff(added=['plover-foo'])
+    assert len(r) == 4
+    assert r['plover-foo'].latest.version == '1.0'
+    assert next(updates) == RegistryDiff(added=['plover-bar'],
+                                         version_changed=['local-dist-info'],
+                                         status_changed=['local-dist-info'])
+    assert r['local-dist-info'].status == 'outdated'
+    assert list(updates) == []
+    assert len(r) == 5
+    # Unchanged packages are not reported, removed ones are.
+    batches[:] = [[make_release('local_dist_info', '1.0.1')]]
+    assert r.update() == RegistryDiff(removed=['plover-foo', 'plover-bar'])
+    assert sorted(r.keys()) == ['local-dist-info', 'local-egg-info', 'zipped-egg-plugin']
+    # Local changes.
+    assert r.set_installed('local-dist-info', r['local-dist-info'].latest) == \
+        RegistryDiff(status_changed=['local-dist-info'], version_changed=['local-dist-info'])
+    assert r['local-dist-info'].status == 'updated'
+
+
+def test_compatibility(fake_local_registry, monkeypatch):
+    batches = [[
+        make_release('local_dist_info', '1.0.1', requires_python='>=3.6'),
+        make_release('local_dist_info', '1.1.0', requires_dist=['plover>=5.0.0']),
+        make_release('local_dist_info', '2.0.0', requires_python='>=4'),
+    ]]
+    monkeypatch.setattr('plover_plugins_manager.global_registry.iter_plover_plugins_releases',
+                        lambda **kwargs: iter(batches))
+    r = Registry(python_version='3.8.0', plover_version='4.0.0')
+    r.update()
+    state = r['local-dist-info']
+    assert state.status == 'outdated'
+    assert state.latest.version == '1.0.1'
+    assert [m.version for m in state.newer_versions()] == ['1.0.1']
+    r = Registry(python_version='3.8.0', plover_version='5.0.0')
+    r.update()
+    assert r['local-dist-info'].latest.version == '1.1.0'
+    # No compatible newer version.
+    batches[0][:2] = []
+    r = Registry(python_version='3.8.0', plover_version='4.0.0')
+    r.update()
+    state = r['local-dist-info']
+    assert state.status == 'installed'
+    assert state.latest is None
+    assert [m.version for m in state.available] == ['2.0.0']
+
+
+def test_saved_state(fake_local_registry, monkeypatch, tmpdir):
+    batches = [[make_release('plover-foo', '1.0'), make_release('local_dist_info', '1.0.1')]]
+    monkeypatch.setattr('plover_plugins_manager.global_registry.iter_plover_plugins_releases',
+                        lambda **kwargs: iter(batches))
+    assert Registry.load() is None
+    r = Registry()
+    r.update()
+    assert not r.stale
+    # Restored as is, without scanning installed plugins.
+    list_plugins = local_registry.list_plugins
+    monkeypatch.setattr('plover_plugins_manager.local_registry.list_plugins', None)
+    r = Registry.load()
+    assert r.stale
+    assert sorted(r.keys()) == ['local-dist-info', 'local-egg-info',
+                                'plover-foo', 'zipped-egg-plugin']
+    assert r['local-dist-info'].status == 'outdated'
+    assert r['local-dist-info'].current.version == '1.0.0'
+    assert r['plover-foo'].latest.version == '1.0'
+    assert r['plover-foo'].stale
+    assert r.search('foo')[0] == 'plover-foo'
+    # Revalidation: only the differences are reported.
+    def new_list_plugins():
+        plugins = list_plugins()
+        del plugins['local-egg-info']
+        return plugins
+    monkeypatch.setattr('plover_plugins_manager.local_registry.list_plugins', new_list_plugins)
+    batches[0][0] = make_release('plover-foo', '1.1')
+    updates = r.iter_update()
+    assert next(updates) == RegistryDiff(removed=['local-egg-info'])
+    assert list(updates) == [RegistryDiff(version_changed=['plover-foo'])]
+    assert not r.stale
+    assert r['plover-foo'].latest.version == '1.1'
+    # Invalid state.
+    path = tmpdir / 'state.json'
+    path.write('{"version": 1, "packages": {"foo": {}}}')
+    assert Registry.load(path=str(path)) is None
+
+
+def test_refresh(fake_local_registry, monkeypatch):
+    started = threading.Event()
+    resume = threading.Event()
+    calls = []
+    def iter_releases(cancel=None):
+        calls.append(cancel)
+        yield [make_release('plover-foo', '1.0')]
+        started.set()
+        resume.wait(5)
+        if cancel.cancelled:
+            raise package_index.Cancelled()
+        yield [make_release('plover-bar', '1.0')]
+    monkeypatch.setattr('plover_plugins_manager.global_registry.iter_plover_plugins_releases',
+                        iter_releases)
+    r = Registry()
+    snapshot = r.snapshot()
+    foo_diffs, bar_diffs = [], []
+    task = r.refresh(foo_diffs.append)
+    assert started.wait(5)
+    assert r.refreshing
+    # Overlapping requests are coalesced.
+    assert r.refresh(bar_diffs.append) is task
+    resume.set()
+    assert task.wait(5)
+    assert not r.refreshing
+    assert len(calls) == 1
+    assert foo_diffs == [RegistryDiff(added=['plover-foo']),
+                         RegistryDiff(added=['plover-bar'])]
+    assert bar_diffs == [RegistryDiff(added=['plover-bar'])]
+    # Published snapshots are never modified.
+    assert sorted(snapshot) == ['local-dist-info', 'local-egg-info', 'zipped-egg-plugin']
+    assert len(r) == 5
+    # Cancellation: changes merged so far are kept.
+    started.clear()
+    resume.clear()
+    monkeypatch.setattr('plover_plugins_manager.local_registry.list_plugins', lambda: {})
+    done = threading.Event()
+    task = r.refresh(on_done=done.set)
+    assert r.refresh() is task
+    assert started.wait(5)
+    task.cancel()
+    resume.set()
+    assert done.wait(5)
+    assert task.cancelled
+    assert 'plover-bar' in r
+    # Removing the last listener cancels the refresh.
+    started.clear()
+    resume.clear()
+    task = r.refresh(bar_diffs.append)
+    assert started.wait(5)
+    task.remove_listener(bar_diffs.append)
+    resume.set()
+    assert task.wait(5)
+    assert task.cancelled
+
+
+def test_rescan_installed(fake_env, monkeypatch):
+    r = Registry()
+    r.update()
+    old = r['local-dist-info'].current
+    new = PluginMetadata.from_kwargs(name='local_dist_info', version='1.0.1')
+    r.set_installed('local-dist-info', new)
+    r.set_installed('local-egg-info', None)
+    # Rolled back: the rescan reverts `local-dist-info` to its old
+    # version, but the history is kept (a restart is still needed).
+    monkeypatch.setattr('plover_plugins_manager.local_registry.list_plugins', lambda: {
+        'local-dist-info': [old],
+        'zipped-egg-plugin': r['zipped-egg-plugin'].installed,
+    })
+    assert r.rescan_installed() == RegistryDiff(version_changed=['local-dist-info'])
+    pkg = r['local-dist-info']
+    assert pkg.installed == [old, new, old]
+    assert pkg.status == 'updated'
+    pkg = r['local-egg-info']
+    assert pkg.current is None
+    assert pkg.status == 'removed'
+    assert r['zipped-egg-plugin'].status == 'installed'
+
+
+def test_concurrent_removal(fake_env, monkeypatch):
+    r = Registry()
+    r.update()
+    r._apply({'local-egg-info': lambda name, pkg: None})
+    # Names picked from an outdated snapshot.
+    monkeypatch.setattr(r, 'snapshot', lambda: {
+        'local-egg-info': SimpleNamespace(versions=['1.0'], stale=True),
+    })
+    assert r._prune(set()) == RegistryDiff()
+    assert r._revalidate() == RegistryDiff()
+    assert 'local-egg-info' not in r
+
+
+def test_package_latest():
+    checked = []
+
+    def compatible(metadata):
+        checked.append(metadata.version)
+        return metadata.version != '2.0'
+
+    pkg = PackageState('plover-foo', available=[
+        PluginMetadata.from_kwargs(name='plover-foo', version=version)
+        for version in ('1.0', '1.1', '2.0')
+    ], compatible=compatible)
+    # Computed once, when the available versions are set.
+    assert checked == ['2.0', '1.1']
+    for __ in range(3):
+        assert pkg.latest.version == '1.1'
+        assert pkg.copy().latest.version == '1.1'
+    assert checked == ['2.0', '1.1']
+    pkg.available = []
+    assert pkg.latest is None
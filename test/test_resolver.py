@@ -0,0 +1,110 @@
+from functools import partial
+
+import pytest
+
+from plover_plugins_manager import global_registry
+from plover_plugins_manager.plugin_metadata import PluginMetadata
+from plover_plugins_manager.resolver import Resolver
+from plover_plugins_manager.version_index import is_compatible
+
+from .stub_pypi import StubPyPI, make_release
+
+
+compatible = partial(is_compatible, plover_version='4.0.0')
+
+
+def installed(name, version, requires_dist=None):
+    return PluginMetadata.from_kwargs(name=name, version=version,
+                                      requires_dist=requires_dist)
+
+
+@pytest.fixture
+def pypi(monkeypatch):
+    with StubPyPI([
+        make_release('plover-foo', '2.0', versions=('1.0', '2.0'),
+                     requires_dist=['plover>=4', 'pyserial>=3',
+                                    'colorama; sys_platform == "nt-never"',
+                                    'rich; extra == "fancy"']),
+        make_release('plover-bar', '1.0', requires_dist=['pyserial<3']),
+        make_release('plover-py99', '1.0', requires_python='>=99'),
+        make_release('plover-baz', '1.0', requires_dist=['libfoo>=2']),
+        make_release('pyserial', '3.5', keywords='', versions=('2.7', '3.4', '3.5')),
+        make_release('rich', '13.0', keywords=''),
+    ], validators=False) as stub:
+        monkeypatch.setenv('PYPI_URL', stub.pypi_url)
+        yield stub
+
+
+@pytest.fixture
+def local(monkeypatch):
+    distributions = {
+        'plover': installed('plover', '4.0.0'),
+        'pyserial': installed('pyserial', '3.4'),
+        'plover-serial': installed('plover-serial', '1.0', ['pyserial>=3']),
+    }
+    monkeypatch.setattr('plover_plugins_manager.local_registry.list_distributions',
+                        lambda: distributions)
+    return distributions
+
+
+def test_resolve(pypi, local):
+    resolver = Resolver(global_registry.list_plugins(
+        pypi_url=pypi.pypi_url, registry_url=pypi.registry_url),
+        compatible=compatible)
+    # Dependencies already satisfied are kept.
+    plan = resolver.resolve(['plover-foo==2.0'])
+    assert plan.ok
+    assert plan.requirements == ['plover-foo==2.0']
+    # Extras.
+    plan = resolver.resolve(['plover-foo[fancy]==2.0'])
+    assert plan.ok
+    assert plan.requirements == ['plover-foo==2.0', 'rich==13.0']
+    # Upgrade of an installed dependency.
+    del local['pyserial']
+    plan = resolver.resolve(['plover-foo==2.0'])
+    assert plan.ok
+    assert plan.requirements == ['plover-foo==2.0', 'pyserial==3.5']
+    # Downgrade breaking an installed plugin.
+    plan = resolver.resolve(['plover-bar'])
+    assert plan.requirements == ['plover-bar==1.0', 'pyserial==2.7']
+    assert plan.conflicts == [
+        'plover-serial==1.0 requires pyserial>=3, but pyserial==2.7 would be installed',
+    ]
+    # Conflicting requirements.
+    plan = resolver.resolve(['plover-foo', 'plover-bar'])
+    assert len(plan.conflicts) == 2
+    assert plan.conflicts[0] == 'pyserial>=3 (required by plover-foo==2.0) conflicts with pyserial==2.7'
+    # Incompatible / missing releases.
+    plan = resolver.resolve(['plover-py99', 'plover-baz', 'git+https://example.com/repo.git'])
+    assert plan.conflicts == [
+        'no release of plover-py99 matching "*" is compatible (requested)',
+        'no release of libfoo matches ">=2" (required by plover-baz==1.0)',
+    ]
+    assert plan.unchecked == ['git+https://example.com/repo.git']
+
+
+def test_resolve_older_version(pypi, local):
+    pypi.add_release(make_release('plover-qux', '2.0', versions=('1.0', '2.0'),
+                                  requires_dist=['plover>=5']))
+    pypi.documents['/pypi/plover-qux/1.0/json'] = pypi.documents[
+        '/pypi/plover-qux/1.0/json'].replace(b'"plover>=5"', b'"plover>=4"')
+    resolver = Resolver(compatible=compatible)
+    # The newest compatible release is selected.
+    plan = resolver.resolve(['plover-qux'])
+    assert plan.ok
+    assert plan.requirements == ['plover-qux==1.0']
+    plan = resolver.resolve(['plover-qux==2.0'])
+    assert plan.conflicts == [
+        'no release of plover-qux matching "==2.0" is compatible (requested)',
+    ]
+
+
+def test_resolve_cache(pypi, local):
+    resolver = Resolver(compatible=compatible)
+    plan = resolver.resolve(['plover-foo', 'plover-bar'])
+    pypi.reset_counts()
+    assert resolver.resolve(['plover-bar', 'plover-foo']) is plan
+    assert pypi.requests == {}
+    # Changes to the installed distributions invalidate the cache.
+    local['plover-serial'] = installed('plover-serial', '2.0')
+    assert resolver.resolve(['plover-foo', 'plover-bar']) is not plan
@@ -0,0 +1,65 @@
+from plover_plugins_manager.plugin_metadata import PluginMetadata
+from plover_plugins_manager.search_index import SearchIndex, tokenize
+
+
+def metadata(name, summary='', keywords='', author=''):
+    return PluginMetadata.from_kwargs(name=name, summary=summary,
+                                      keywords=keywords, author=author,
+                                      version='1.0')
+
+
+def make_index():
+    index = SearchIndex()
+    for m in (
+        metadata('plover-dict-commands', 'Dictionary commands', 'plover plover_plugin', 'Jane Doe'),
+        metadata('plover-stenograph', 'Stenograph machine support', 'plover_plugin machine'),
+        metadata('plover-python-dictionary', 'Python dictionaries support', ['plover', 'dictionary']),
+        metadata('plover-spanish', 'Spanish system', author='Dictionary Maker'),
+    ):
+        index.update(m.name, m)
+    return index
+
+
+def test_tokenize():
+    assert tokenize('Plover-Dict_Commands 2.0') == ['plover', 'dict', 'commands', '2', '0']
+    assert tokenize(['plover', 'plover_plugin']) == ['plover', 'plover', 'plugin']
+    assert tokenize(None) == []
+
+
+def test_search():
+    index = make_index()
+    assert len(index) == 4
+    # Name matches rank first, then keywords, summary, and author.
+    assert index.search('dict') == [
+        'plover-dict-commands',
+        'plover-python-dictionary',
+        'plover-spanish',
+    ]
+    # All terms must match (as prefixes).
+    assert index.search('machine STENO') == ['plover-stenograph']
+    assert index.search('python comm') == []
+    # Empty queries (no terms) match everything.
+    for query in ('', '-', ' + '):
+        assert index.search(query) == [
+            'plover-dict-commands',
+            'plover-python-dictionary',
+            'plover-spanish',
+            'plover-stenograph',
+        ]
+        assert index.matches(query) is None
+    assert index.search('-', limit=1) == ['plover-dict-commands']
+    assert index.search('dict', limit=1) == ['plover-dict-commands']
+    assert index.matches('DICT') == set(index.search('dict'))
+    assert index.matches('python comm') == set()
+
+
+def test_incremental_update():
+    index = make_index()
+    index.update('plover-stenograph', metadata('plover-stenograph', 'Stenograph protocol'))
+    assert index.search('machine') == []
+    assert index.search('protocol') == ['plover-stenograph']
+    index.remove('plover-spanish')
+    assert 'plover-spanish' not in index
+    assert index.search('spanish') == []
+    assert index.matches('spanish') == set()
+    assert index._tokens == sorted(index._postings)
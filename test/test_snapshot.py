@@ -0,0 +1,53 @@
+import pytest
+
+from plover_plugins_manager import global_registry, package_index
+from plover_plugins_manager.snapshot import Snapshot, SnapshotError, write_snapshot
+
+from .stub_pypi import StubPyPI, make_release
+
+
+RELEASES = [
+    make_release('plover-foo', '1.0.0', serial=3),
+    make_release('plover-bar', '0.2.0', serial=5),
+]
+
+
+def test_snapshot(tmpdir):
+    path = str(tmpdir / 'snapshot')
+    write_snapshot(path, RELEASES)
+    with Snapshot(path) as snapshot:
+        assert len(snapshot) == 2
+        assert 'Plover-Foo' in snapshot
+        assert sorted(snapshot.names()) == ['plover-bar', 'plover-foo']
+        release = snapshot.load('plover-bar')
+        assert release['last_serial'] == 5
+        assert release['info'] == RELEASES[1]['info']
+        # Only the necessary fields are kept.
+        assert 'releases' not in release
+        assert snapshot.load('plover-baz') is None
+        assert sorted(r['info']['name'] for r in snapshot) == ['plover-bar', 'plover-foo']
+
+
+def test_invalid_snapshot(tmpdir):
+    path = tmpdir / 'snapshot'
+    path.write_binary(b'PPMSNAP1 garbage')
+    with pytest.raises(SnapshotError):
+        Snapshot(str(path))
+
+
+def test_capture_and_replay(tmpdir, monkeypatch):
+    path = str(tmpdir / 'snapshot')
+    with StubPyPI(RELEASES + [make_release('not-a-plugin', keywords='')]) as pypi:
+        package_index.find_plover_plugins_releases(
+            pypi_url=pypi.pypi_url, registry_url=pypi.registry_url,
+            capture=path)
+    # No network access.
+    monkeypatch.setenv('PYPI_URL', 'http://127.0.0.1:9/pypi')
+    monkeypatch.setenv('REGISTRY_URL', 'http://127.0.0.1:9/registry.json')
+    plugins = global_registry.list_plugins(snapshot=path)
+    assert {
+        name: [m.version for m in versions]
+        for name, versions in plugins.items()
+    } == {'plover-foo': ['1.0.0'], 'plover-bar': ['0.2.0']}
+    monkeypatch.setenv('INDEX_SNAPSHOT', path)
+    assert global_registry.list_plugins() == plugins
@@ -0,0 +1,175 @@
+import os
+import shutil
+
+import pytest
+
+from plover_plugins_manager import local_registry, uninstall
+from plover_plugins_manager.transaction import affected, run_transaction
+
+from .stub_pypi import StubPyPI, make_release
+from .test_local_registry import make_dist
+
+
+def remove_dist(site_dir, name):
+    key = name.replace('_', '-')
+    location = local_registry.locate_distributions()[key]
+    paths = local_registry.read_record(location)
+    if paths is None:
+        # Legacy install.
+        shutil.rmtree(location)
+        os.unlink(os.path.join(site_dir, key.replace('-', '_') + '.py'))
+        return
+    for path in paths:
+        os.unlink(path)
+        directory = os.path.dirname(path)
+        if not os.listdir(directory):
+            os.rmdir(directory)
+
+
+def tree(site_dir):
+    contents = {}
+    for root, dirs, files in os.walk(site_dir):
+        for filename in files:
+            path = os.path.join(root, filename)
+            with open(path) as fp:
+                contents[os.path.relpath(path, site_dir)] = fp.read()
+        for dirname in dirs:
+            contents.setdefault(os.path.relpath(os.path.join(root, dirname), site_dir), None)
+    return contents
+
+
+@pytest.fixture
+def site_dir(tmpdir, monkeypatch):
+    site_dir = tmpdir / 'site'
+    site_dir.mkdir()
+    site_dir = str(site_dir)
+    monkeypatch.setattr(local_registry, '_path_entries', lambda: [(site_dir, False)])
+    monkeypatch.setattr(uninstall, '_roots', lambda: [(site_dir, str(tmpdir))])
+    make_dist(site_dir, 'plover-foo', '1.0', [
+        'plover_foo/__init__.py',
+        'plover_foo/data/foo.json',
+    ])
+    # Compiled file (not listed in `RECORD`).
+    os.mkdir(os.path.join(site_dir, 'plover_foo', '__pycache__'))
+    with open(os.path.join(site_dir, 'plover_foo', '__pycache__', '__init__.cpython-39.pyc'), 'w') as fp:
+        fp.write('compiled')
+    make_dist(site_dir, 'pyserial', '3.4', ['serial/__init__.py'])
+    with StubPyPI([
+        make_release('plover-foo', '2.0', versions=('1.0', '2.0'),
+                     requires_dist=['newdep']),
+        make_release('plover-bar', '1.0'),
+        make_release('newdep', '1.0', keywords=''),
+        make_release('pyserial', '3.4', keywords=''),
+    ], validators=False) as pypi:
+        monkeypatch.setenv('PYPI_URL', pypi.pypi_url)
+        yield site_dir
+
+
+TRANSACTION = {
+    'steps': [
+        ['install', 'plover-foo==2.0'],
+        ['uninstall', '-y', 'pyserial'],
+        ['install', 'plover-bar==1.0'],
+    ],
+    'install': ['install', '--no-deps', '--no-index'],
+    'uninstall': ['uninstall', '-y'],
+}
+
+
+def fake_pip(site_dir, fail=None):
+    commands = []
+
+    def run(args):
+        commands.append(args)
+        if args == fail:
+            return 1
+        command, *requirements = [arg for arg in args if not arg.startswith('-')]
+        for requirement in requirements:
+            name, __, version = requirement.partition('==')
+            if command == 'uninstall' or name in local_registry.locate_distributions():
+                remove_dist(site_dir, name)
+            if command == 'install':
+                make_dist(site_dir, name, version, [name.replace('-', '_') + '/__init__.py'])
+                if name == 'plover-foo':
+                    make_dist(site_dir, 'newdep', '1.0', ['newdep.py'])
+        return 0
+
+    return run, commands
+
+
+def test_affected(site_dir):
+    assert affected(TRANSACTION['steps']) == {
+        'plover-foo', 'newdep', 'pyserial', 'plover-bar',
+    }
+
+
+def test_success(site_dir):
+    run, commands = fake_pip(site_dir)
+    messages = []
+    assert run_transaction(TRANSACTION, run, progress=messages.append) == 0
+    assert commands == TRANSACTION['steps']
+    assert messages == []
+    assert sorted(local_registry.locate_distributions()) == [
+        'newdep', 'plover-bar', 'plover-foo',
+    ]
+
+
+def test_rollback(site_dir):
+    before = tree(site_dir)
+    run, commands = fake_pip(site_dir, fail=TRANSACTION['steps'][-1])
+    messages = []
+    assert run_transaction(TRANSACTION, run, progress=messages.append) == 1
+    assert commands == TRANSACTION['steps']
+    assert messages == [
+        'command failed, rolling back all changes',
+        'removing newdep==1.0',
+        'removing plover-foo==2.0',
+        'restoring plover-foo==1.0',
+        'restoring pyserial==3.4',
+        'rollback done',
+    ]
+    after = tree(site_dir)
+    # Note: compiled files are not restored.
+    del before[os.path.join('plover_foo', '__pycache__', '__init__.cpython-39.pyc')]
+    del before[os.path.join('plover_foo', '__pycache__')]
+    assert after == before
+
+
+def test_rollback_legacy(site_dir):
+    make_dist(site_dir, 'plover-legacy', '1.0', ['plover_legacy.py'], kind='egg-info')
+    transaction = dict(TRANSACTION, steps=[
+        ['uninstall', '-y', 'plover-legacy'],
+        ['install', 'plover-bar==1.0'],
+    ])
+    run, commands = fake_pip(site_dir, fail=transaction['steps'][-1])
+    messages = []
+    assert run_transaction(transaction, run, progress=messages.append) == 1
+    assert messages[0] == 'warning: plover-legacy==1.0 cannot be restored on failure'
+    assert messages[-1] == 'rollback incomplete, could not restore: plover-legacy==1.0'
+
+
+def test_rollback_unpredicted_upgrade(site_dir):
+    transaction = dict(TRANSACTION, steps=[
+        ['install', 'plover-bar==1.0'],
+        ['install', 'plover-foo==2.0'],
+    ])
+    run, commands = fake_pip(site_dir, fail=transaction['steps'][-1])
+
+    def upgrading_run(args):
+        if args == transaction['steps'][0]:
+            # Also upgrade a dependency (not predicted, so not snapshotted).
+            run(['install', 'pyserial==3.5'])
+        return run(args)
+
+    messages = []
+    assert run_transaction(transaction, upgrading_run, progress=messages.append) == 1
+    assert messages == [
+        'command failed, rolling back all changes',
+        'warning: keeping pyserial==3.5, as pyserial==3.4 cannot be restored',
+        'removing plover-bar==1.0',
+        'rollback incomplete, could not restore: pyserial==3.4',
+    ]
+    # The new version is left in place.
+    distributions = local_registry.list_distributions()
+    assert sorted(distributions) == ['plover-foo', 'pyserial']
+    assert distributions['pyserial'].version == '3.5'
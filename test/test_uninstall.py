@@ -0,0 +1,127 @@
+import os
+import shutil
+
+import pytest
+
+from plover_plugins_manager import local_registry, uninstall
+from plover_plugins_manager.uninstall import uninstall_args
+
+from .test_local_registry import make_dist
+from .test_transaction import tree
+
+
+@pytest.fixture
+def base_dir(tmpdir, monkeypatch):
+    base_dir = str(tmpdir / 'base')
+    site_dir = os.path.join(base_dir, 'lib', 'site-packages')
+    os.makedirs(site_dir)
+    monkeypatch.setattr(local_registry, '_path_entries', lambda: [(site_dir, False)])
+    monkeypatch.setattr(uninstall, '_roots', lambda: [(site_dir, base_dir)])
+    return base_dir
+
+
+def site_path(base_dir, *parts):
+    return os.path.join(base_dir, 'lib', 'site-packages', *parts)
+
+
+def test_uninstall(base_dir):
+    site_dir = site_path(base_dir)
+    make_dist(site_dir, 'plover-foo', '1.0', [
+        'plover_foo/__init__.py',
+        'plover_foo/data/foo.json',
+        os.path.join('..', '..', 'bin', 'plover-foo'),
+    ])
+    os.mkdir(site_path(base_dir, 'plover_foo', '__pycache__'))
+    with open(site_path(base_dir, 'plover_foo', '__pycache__', '__init__.cpython-39.pyc'), 'w') as fp:
+        fp.write('compiled')
+    make_dist(site_dir, 'plover-bar', '2.0', ['plover_bar.py'])
+    make_dist(site_dir, 'pyserial', '3.4', ['serial/__init__.py'])
+    # Not part of any distribution.
+    with open(os.path.join(base_dir, 'bin', 'other'), 'w') as fp:
+        fp.write('other')
+    assert sorted(local_registry.list_distributions()) == ['plover-bar', 'plover-foo', 'pyserial']
+    messages = []
+    assert uninstall.uninstall(['plover_foo', 'plover-bar', 'plover-baz'],
+                               progress=messages.append) == []
+    assert messages == [
+        'skipping plover-baz, as it is not installed',
+        'uninstalled plover_foo-1.0.dist-info (6 files)',
+        'uninstalled plover_bar-2.0.dist-info (4 files)',
+    ]
+    assert sorted(os.listdir(site_dir)) == ['pyserial-3.4.dist-info', 'serial']
+    assert os.listdir(os.path.join(base_dir, 'bin')) == ['other']
+    assert sorted(local_registry.list_distributions()) == ['pyserial']
+    # The site directory is kept.
+    assert uninstall.uninstall(['pyserial'], progress=None) == []
+    assert os.listdir(site_dir) == []
+
+
+def test_uninstall_fallback(base_dir, tmpdir, monkeypatch):
+    site_dir = site_path(base_dir)
+    make_dist(site_dir, 'plover-legacy', '1.0', ['plover_legacy.py'], kind='egg-info')
+    make_dist(site_dir, 'plover-evil', '1.0', [
+        'plover_evil.py',
+        os.path.join('..', '..', '..', 'outside.txt'),
+    ])
+    assert uninstall.uninstall(['plover-legacy', 'plover-evil'], progress=None) == [
+        'plover-legacy', 'plover-evil',
+    ]
+    assert (tmpdir / 'outside.txt').exists()
+    assert os.path.exists(site_path(base_dir, 'plover_evil.py'))
+    assert sorted(local_registry.list_distributions()) == ['plover-evil', 'plover-legacy']
+    # Outside of the user site / virtualenv.
+    other_site = str(tmpdir / 'other')
+    make_dist(other_site, 'plover-system', '1.0', ['plover_system.py'])
+    monkeypatch.setattr(local_registry, '_path_entries',
+                        lambda: [(site_dir, False), (other_site, False)])
+    assert uninstall.uninstall(['plover-system'], progress=None) == ['plover-system']
+
+
+def test_uninstall_args(base_dir):
+    site_dir = site_path(base_dir)
+    make_dist(site_dir, 'plover-foo', '1.0', ['plover_foo.py'])
+    make_dist(site_dir, 'plover-bar', '1.0', ['plover_bar.py'])
+    make_dist(site_dir, 'plover-legacy', '1.0', ['plover_legacy.py'], kind='egg-info')
+    # Confirmation is left to pip.
+    args = ['--disable-pip-version-check', 'uninstall', 'plover-foo']
+    assert uninstall_args(args) == args
+    args = ['uninstall', '-r', 'requirements.txt']
+    assert uninstall_args(args) == args
+    args = ['install', '-y', 'uninstall']
+    assert uninstall_args(args) == args
+    assert uninstall_args(['--disable-pip-version-check', 'uninstall', '-y',
+                           'plover-foo', 'plover-legacy'], progress=None) == \
+        ['--disable-pip-version-check', 'uninstall', '-y', 'plover-legacy']
+    assert uninstall_args(['uninstall', '--yes', 'plover-bar'], progress=None) is None
+    assert sorted(local_registry.list_distributions()) == ['plover-legacy']
+
+
+def test_uninstall_failure(base_dir, monkeypatch):
+    site_dir = site_path(base_dir)
+    make_dist(site_dir, 'plover-foo', '1.0', [
+        'plover_foo/__init__.py',
+        'plover_foo/_speedups.pyd',
+    ])
+    make_dist(site_dir, 'plover-bar', '2.0', ['plover_bar.py'])
+    before = tree(site_dir)
+    move = shutil.move
+
+    def locked_move(src, dst):
+        if src.endswith('.pyd'):
+            # E.g. a library in use on Windows.
+            raise PermissionError(13, 'Permission denied', src)
+        return move(src, dst)
+
+    monkeypatch.setattr(shutil, 'move', locked_move)
+    messages = []
+    # The distribution is restored, and left to pip.
+    assert uninstall.uninstall(['plover-foo', 'plover-bar'],
+                               progress=messages.append) == ['plover-foo']
+    assert messages == ['uninstalled plover_bar-2.0.dist-info (4 files)']
+    del before['plover_bar.py']
+    del before['plover_bar-2.0.dist-info']
+    del before[os.path.join('plover_bar-2.0.dist-info', 'METADATA')]
+    del before[os.path.join('plover_bar-2.0.dist-info', 'RECORD')]
+    del before[os.path.join('plover_bar-2.0.dist-info', 'entry_points.txt')]
+    assert tree(site_dir) == before
+    assert sorted(local_registry.list_distributions()) == ['plover-foo']
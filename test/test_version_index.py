@@ -0,0 +1,69 @@
+from packaging.version import Version
+import pytest
+
+from plover_plugins_manager.plugin_metadata import PluginMetadata, _parse_version_string
+from plover_plugins_manager.version_index import VersionIndex, is_compatible
+
+
+def metadata(version, requires_python='', requires_dist=None):
+    return PluginMetadata.from_kwargs(name='plover-foo', version=version,
+                                      requires_python=requires_python,
+                                      requires_dist=requires_dist)
+
+
+@pytest.mark.parametrize('requires_python, requires_dist, compatible', (
+    ('', None, True),
+    ('>=3.6', None, True),
+    ('>=3.9', None, False),
+    ('>=3.6', ['plover>=4.0.0.dev8', 'requests'], True),
+    ('', ['plover[gui_qt]>=4.0.0.dev10'], False),
+    ('', ['plover>=4.0.0.dev8,<5'], True),
+    ('', ['plover<4; python_version < "3"'], True),
+    ('', ['plover (>=4.0.0.dev8)'], True),
+    ('invalid', ['invalid requirement!'], True),
+))
+def test_is_compatible(requires_python, requires_dist, compatible):
+    assert is_compatible(metadata('1.0', requires_python, requires_dist),
+                         python_version='3.8.2',
+                         plover_version='4.0.0.dev9') == compatible
+
+
+def test_version_index():
+    versions = VersionIndex([
+        metadata('1.0'),
+        metadata('2.0.0rc1'),
+        metadata('0.9'),
+        metadata('1.1', requires_python='>=3.9'),
+    ])
+    assert [m.version for m in versions] == ['0.9', '1.0', '1.1', '2.0.0rc1']
+    versions.add(metadata('1.0.1'))
+    assert [m.version for m in versions] == ['0.9', '1.0', '1.0.1', '1.1', '2.0.0rc1']
+    assert versions.find('1.0.1').version == '1.0.1'
+    assert versions.find('1.2') is None
+    assert [m.version for m in versions.newer_than(metadata('1.0'))] == ['1.0.1', '1.1', '2.0.0rc1']
+    assert versions.latest().version == '2.0.0rc1'
+    assert versions.latest('<2').version == '1.1'
+    assert versions.latest('<=1.0.1').version == '1.0.1'
+    assert versions.latest('==1.0').version == '1.0'
+    assert versions.latest('==1.*').version == '1.1'
+    assert versions.latest('>=3') is None
+    assert versions.latest('invalid') is None
+    assert versions.latest('<2', compatible=lambda m: not m.requires_python).version == '1.0.1'
+    assert versions.latest_compatible(python_version='3.8.2').version == '2.0.0rc1'
+    assert VersionIndex().latest() is None
+
+
+def test_invalid_versions(monkeypatch):
+    # Recent versions of setuptools reject non-PEP 440 versions.
+    monkeypatch.setattr('plover_plugins_manager.plugin_metadata.parse_version', Version)
+    _parse_version_string.cache_clear()
+    try:
+        versions = [metadata(v) for v in ('1.0', 'custom build', '0.9', 'another build')]
+        index = VersionIndex(versions)
+        assert [m.version for m in index] == ['another build', 'custom build', '0.9', '1.0']
+        assert index.find('custom build').version == 'custom build'
+        assert index.latest().version == '1.0'
+        assert index.latest('<1.0').version == '0.9'
+        assert [m.version for m in index.newer_than(metadata('custom build'))] == ['0.9', '1.0']
+    finally:
+        _parse_version_string.cache_clear()
@@ -0,0 +1,261 @@
+from hashlib import sha256
+import json
+import os
+import shutil
+import subprocess
+import tarfile
+
+from packaging.tags import Tag
+import pytest
+
+from plover_plugins_manager import pip_wrapper
+from plover_plugins_manager.plugin_metadata import PluginMetadata
+from plover_plugins_manager.wheelhouse import (
+    Wheelhouse,
+    WheelhouseError,
+    _split_git_url,
+    install_args,
+    select_file,
+    source_identity,
+)
+
+from .stub_pypi import StubPyPI, make_release
+
+
+def add_files(pypi, name, version, filenames):
+    files = []
+    for filename in filenames:
+        content = ('content of %s' % filename).encode()
+        path = '/files/' + filename
+        pypi.documents[path] = content
+        files.append({
+            'filename': filename,
+            'url': pypi.url + path,
+            'digests': {'sha256': sha256(content).hexdigest()},
+            'packagetype': 'bdist_wheel' if filename.endswith('.whl') else 'sdist',
+        })
+    path = '/pypi/%s/%s/json' % (name, version)
+    release = json.loads(pypi.documents[path].decode())
+    release['urls'] = files
+    pypi.documents[path] = json.dumps(release).encode()
+
+
+@pytest.fixture
+def pypi(monkeypatch):
+    with StubPyPI([
+        make_release('plover-foo', '1.0', requires_dist=['pyserial']),
+        make_release('plover-sdist', '1.0'),
+        make_release('pyserial', '3.5', keywords=''),
+    ], validators=False) as pypi:
+        add_files(pypi, 'plover-foo', '1.0', [
+            'plover_foo-1.0.tar.gz',
+            'plover_foo-1.0-py3-none-any.whl',
+        ])
+        add_files(pypi, 'plover-sdist', '1.0', ['plover_sdist-1.0.tar.gz'])
+        add_files(pypi, 'pyserial', '3.5', ['pyserial-3.5-py2.py3-none-any.whl'])
+        monkeypatch.setenv('PYPI_URL', pypi.pypi_url)
+        monkeypatch.setattr('plover_plugins_manager.local_registry.list_distributions', lambda: {
+            'plover': PluginMetadata.from_kwargs(name='plover', version='4.0.0'),
+        })
+        yield pypi
+
+
+def test_select_file():
+    tags = {Tag('cp38', 'cp38', 'linux_x86_64'): 0, Tag('py3', 'none', 'any'): 1}
+    files = [
+        {'filename': 'foo-1.0.tar.gz', 'packagetype': 'sdist', 'sha256': '1'},
+        {'filename': 'foo-1.0-py3-none-any.whl', 'sha256': '2'},
+        {'filename': 'foo-1.0-cp38-cp38-linux_x86_64.whl', 'sha256': '3'},
+        {'filename': 'foo-1.0-cp39-cp39-win32.whl', 'sha256': '4'},
+    ]
+    assert select_file(files, tags)['sha256'] == '3'
+    assert select_file(files[:2], tags)['sha256'] == '2'
+    assert select_file([files[0], files[3]], tags)['sha256'] == '1'
+    assert select_file([files[3]], tags) is None
+    assert select_file([dict(files[2], sha256=None)], tags) is None
+
+
+def test_stage(pypi, tmpdir):
+    wheelhouse = Wheelhouse(str(tmpdir / 'wheelhouse'))
+    staging = tmpdir / 'staging'
+    staging.mkdir()
+    assert wheelhouse.stage([('plover-foo', '1.0'), ('pyserial', '3.5')], str(staging))
+    assert sorted(os.listdir(str(staging))) == [
+        'plover_foo-1.0-py3-none-any.whl',
+        'pyserial-3.5-py2.py3-none-any.whl',
+    ]
+    assert pypi.requests['/files/plover_foo-1.0-py3-none-any.whl'] == 1
+    # Cached: no network access needed.
+    pypi.reset_counts()
+    staging = tmpdir / 'staging2'
+    staging.mkdir()
+    wheelhouse = Wheelhouse(str(tmpdir / 'wheelhouse'))
+    assert wheelhouse.stage([('plover-foo', '1.0')], str(staging))
+    assert pypi.requests == {}
+    assert (staging / 'plover_foo-1.0-py3-none-any.whl').read_binary() == \
+        b'content of plover_foo-1.0-py3-none-any.whl'
+    # Source distributions only.
+    assert not wheelhouse.stage([('plover-sdist', '1.0')], str(staging))
+    assert (staging / 'plover_sdist-1.0.tar.gz').exists()
+
+
+def test_hash_mismatch(pypi, tmpdir):
+    pypi.documents['/files/pyserial-3.5-py2.py3-none-any.whl'] = b'tampered'
+    wheelhouse = Wheelhouse(str(tmpdir / 'wheelhouse'))
+    with pytest.raises(WheelhouseError):
+        wheelhouse.stage([('pyserial', '3.5')], str(tmpdir))
+    assert not os.path.exists(wheelhouse.path(
+        wheelhouse.files([('pyserial', '3.5')])[('pyserial', '3.5')][0]))
+
+
+def test_install_args(pypi, tmpdir, monkeypatch):
+    monkeypatch.setenv('WHEELHOUSE_DIR', str(tmpdir / 'wheelhouse'))
+    staging = str(tmpdir)
+    messages = []
+    args = ['install', '--user', 'plover-foo==1.0']
+    assert install_args(args, staging, progress=messages.append) == [
+        'install', '--no-index', '--find-links', staging, '--user', 'plover-foo==1.0',
+    ]
+    assert os.path.exists(os.path.join(staging, 'pyserial-3.5-py2.py3-none-any.whl'))
+    assert messages[0] == 'staging 2 distributions'
+    # The index is still needed for source distributions.
+    args = ['install', 'plover-sdist==1.0']
+    assert install_args(args, staging, progress=messages.append) == [
+        'install', '--find-links', staging, 'plover-sdist==1.0',
+    ]
+    # Only pinned requirements are handled.
+    for args in (
+        ['install', 'plover-foo'],
+        ['install', '/path/to/plover_foo-1.0-py3-none-any.whl'],
+        ['install', 'plover-foo==1.0', 'plover-bar>=1.0'],
+    ):
+        assert install_args(args, staging) == args
+
+
+TEST_SDIST = os.path.join(os.path.dirname(__file__),
+                          'plover_template_system-0.1.0.tar.gz')
+
+
+def test_split_git_url():
+    assert _split_git_url('git+https://host/user/repo.git') == \
+        ('https://host/user/repo.git', None, '')
+    assert _split_git_url('git+ssh://git@host/user/repo.git@v1.0#egg=repo') == \
+        ('ssh://git@host/user/repo.git', 'v1.0', 'egg=repo')
+
+
+def test_build_sdist(tmpdir):
+    sdist = str(tmpdir / 'plover_template_system-0.1.0.tar.gz')
+    shutil.copyfile(TEST_SDIST, sdist)
+    wheelhouse = Wheelhouse(str(tmpdir / 'wheelhouse'))
+    messages = []
+    wheel = wheelhouse.build(sdist, progress=messages.append)
+    assert os.path.basename(wheel) == 'plover_template_system-0.1.0-py3-none-any.whl'
+    assert messages == ['building %s' % sdist]
+    # Same source: cached.
+    messages.clear()
+    assert wheelhouse.build(sdist, progress=messages.append) == wheel
+    assert messages == ['using cached build of %s: %s' % (sdist, os.path.basename(wheel))]
+    # Other requirements are not built.
+    assert wheelhouse.build('plover-foo==1.0') is None
+    assert wheelhouse.build(str(tmpdir / 'missing.tar.gz')) is None
+
+
+def test_build_git(tmpdir):
+    repo = tmpdir / 'repo'
+    with tarfile.open(TEST_SDIST) as tar:
+        tar.extractall(str(tmpdir))
+    # Note: copy, so the files are owned by the current user.
+    shutil.copytree(str(tmpdir / 'plover_template_system-0.1.0'), str(repo))
+
+    def git(*args):
+        return subprocess.check_output(
+            ('git', '-c', 'user.name=test', '-c', 'user.email=test@example.com')
+            + args, cwd=str(repo), universal_newlines=True).strip()
+
+    git('init', '-q')
+    git('add', '.')
+    git('commit', '-q', '-m', 'first')
+    git('tag', '-a', '-m', 'v0.1.0', 'v0.1.0')
+    first = git('rev-parse', 'HEAD')
+    url = 'file://' + str(repo)
+    requirement = 'git+' + url
+    wheelhouse = Wheelhouse(str(tmpdir / 'wheelhouse'))
+    assert source_identity(requirement) == ('git:%s@%s' % (url, first),
+                                            'git+%s@%s' % (url, first))
+    wheel = wheelhouse.build(requirement)
+    assert wheel is not None
+    # Same commit: cached.
+    assert wheelhouse.built_wheel('git:%s@%s' % (url, first)) == wheel
+    assert source_identity(requirement + '@v0.1.0')[0] == 'git:%s@%s' % (url, first)
+    # New commit: rebuilt.
+    (repo / 'README.rst').write_text('Updated.', 'utf-8')
+    git('commit', '-q', '-a', '-m', 'second')
+    second = git('rev-parse', 'HEAD')
+    assert source_identity(requirement)[0] == 'git:%s@%s' % (url, second)
+    assert source_identity(requirement + '@v0.1.0')[0] == 'git:%s@%s' % (url, first)
+    with pytest.raises(ValueError):
+        source_identity(requirement + '@unknown')
+
+
+def test_install_args_built(pypi, tmpdir, monkeypatch):
+    monkeypatch.setenv('WHEELHOUSE_DIR', str(tmpdir / 'wheelhouse'))
+    wheel = Wheelhouse().build(TEST_SDIST)
+    staging = str(tmpdir / 'staging')
+    os.mkdir(staging)
+    messages = []
+    assert install_args(['install', TEST_SDIST], staging, progress=messages.append) == \
+        ['install', wheel]
+    assert messages == ['using cached build of %s: %s' % (TEST_SDIST, os.path.basename(wheel))]
+    # With other requirements, the index is still used
+    # (the dependencies of the built wheel are unknown).
+    assert install_args(['install', 'plover-foo==1.0', TEST_SDIST], staging,
+                        progress=messages.append) == \
+        ['install', '--find-links', staging, 'plover-foo==1.0', wheel]
+
+
+def test_install_args_reinstall(pypi, tmpdir, monkeypatch):
+    monkeypatch.setenv('WHEELHOUSE_DIR', str(tmpdir / 'wheelhouse'))
+    wheel = Wheelhouse().build(TEST_SDIST)
+    staging = str(tmpdir / 'staging')
+    os.mkdir(staging)
+    # Same version already installed: pip would ignore the
+    # wheel, so the source distribution is used instead.
+    monkeypatch.setattr('plover_plugins_manager.local_registry.list_distributions', lambda: {
+        'plover-template-system': PluginMetadata.from_kwargs(
+            name='plover_template_system', version='0.1.0'),
+    })
+    messages = []
+    assert install_args(['install', TEST_SDIST], staging, progress=messages.append) == \
+        ['install', TEST_SDIST]
+    assert messages[-1] == 'same version already installed, not using %s' % os.path.basename(wheel)
+    # Other version installed: the wheel is used.
+    monkeypatch.setattr('plover_plugins_manager.local_registry.list_distributions', lambda: {
+        'plover-template-system': PluginMetadata.from_kwargs(
+            name='plover_template_system', version='0.0.9'),
+    })
+    assert install_args(['install', TEST_SDIST], staging, progress=None) == \
+        ['install', wheel]
+
+
+def test_no_index_retry(pypi, tmpdir, monkeypatch, capsys):
+    monkeypatch.setenv('WHEELHOUSE_DIR', str(tmpdir / 'wheelhouse'))
+    calls = []
+
+    def pip_main(args):
+        calls.append(args)
+        # E.g. `pyserial` has an undeclared dependency
+        # (`requires_dist` is `None`), so it's not staged.
+        return 1 if '--no-index' in args else 0
+
+    assert pip_wrapper.run(['--wheelhouse', 'install', 'plover-foo==1.0'],
+                           pip_main=pip_main) == 0
+    assert len(calls) == 2
+    assert calls[0][:2] == ['install', '--no-index']
+    assert calls[1] == calls[0][:1] + calls[0][2:]
+    assert '--find-links' in calls[1]
+    assert capsys.readouterr().out.splitlines()[-1] == 'retrying with the package index'
+    # No retry if the index was used.
+    calls.clear()
+    assert pip_wrapper.run(['--wheelhouse', 'install', 'plover-sdist==1.0'],
+                           pip_main=lambda args: calls.append(args) or 1) == 1
+    assert len(calls) == 1